@@ -0,0 +1,104 @@
+"""
+SAM account decoding (src.users.get_user_accounts) on synthetic SAM hives.
+
+    python benchmarks/bench_accounts.py [--users 1000 10000 50000] [--repeat 3]
+    python benchmarks/bench_accounts.py --hive /path/to/SAM
+
+For each hive the best of --repeat runs is reported: the whole
+get_user_accounts() call on both backends, and the F/V decoding alone,
+batched (one struct.iter_unpack pass over the joined F records) and as the
+baseline it replaces, a slice and an unpack per field per account.
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src.session import HiveSession
+from src.users import USERS_KEY, V_DATA, _filetime, decode_accounts, get_user_accounts
+from src.values import KeyValues
+from synth_hive import sam_hive, write_hive
+
+
+def _best(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _slice_accounts(rids, f_records, v_records):
+    ## baseline: every field sliced out of its own record
+    rows = []
+    for rid, f, v in zip(rids, f_records, v_records):
+        def text(entry):
+            offset, length = struct.unpack("<II", v[0x0C * entry:0x0C * entry + 8])
+            return v[V_DATA + offset:V_DATA + offset + length].decode("utf-16le", "replace")
+        rows.append({
+            "rid": rid, "name": text(1), "full_name": text(2), "comment": text(3),
+            "last_logon": _filetime(struct.unpack("<Q", f[0x08:0x10])[0]),
+            "password_last_set": _filetime(struct.unpack("<Q", f[0x18:0x20])[0]),
+            "account_expires": _filetime(struct.unpack("<Q", f[0x20:0x28])[0]),
+            "last_failed_logon": _filetime(struct.unpack("<Q", f[0x28:0x30])[0]),
+            "flags": struct.unpack("<H", f[0x38:0x3A])[0],
+            "failed_logon_count": struct.unpack("<H", f[0x40:0x42])[0],
+            "logon_count": struct.unpack("<H", f[0x42:0x44])[0],
+        })
+    return rows
+
+
+def _raw_records(path):
+    with HiveSession(path, backend="mmap") as session:
+        rids, f_records, v_records = [], [], []
+        for key in session.open(USERS_KEY).subkeys():
+            if key.name().lower() != "names":
+                values = KeyValues(key)
+                rids.append(int(key.name(), 16))
+                f_records.append(values.raw("F"))
+                v_records.append(values.raw("V"))
+    return rids, f_records, v_records
+
+
+def bench(path, repeat):
+    times = []
+    for backend in ("registry", "mmap"):
+        def run():
+            with HiveSession(path, backend=backend) as session:
+                return get_user_accounts(session)
+        elapsed, accounts = _best(run, repeat)
+        times.append(elapsed)
+    records = _raw_records(path)
+    batched, _ = _best(lambda: decode_accounts(*records), repeat)
+    sliced, _ = _best(lambda: _slice_accounts(*records), repeat)
+    print(f"{os.path.basename(path):<20}{len(accounts):>8}{times[0]:>10.3f}{times[1]:>10.3f}"
+          f"{batched:>10.4f}{sliced:>10.4f}{sliced / batched:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--hive", action="append", help="Also time a SAM hive of your own (repeatable)")
+    args = parser.parse_args()
+
+    print(f"seconds, best of {args.repeat}")
+    print(f"{'hive':<20}{'accounts':>8}{'registry':>10}{'mmap':>10}{'decode':>10}{'sliced':>10}{'':>9}")
+    with tempfile.TemporaryDirectory(prefix="regpy-bench-accounts-") as directory:
+        for users in args.users:
+            path = os.path.join(directory, f"sam-{users}.hive")
+            write_hive(path, sam_hive(users=users), "SAM")
+            bench(path, args.repeat)
+    for path in args.hive or []:
+        bench(path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare the python-registry and memory-mapped backends on one hive.
+
+    python benchmarks/bench_backends.py /path/to/SOFTWARE [--repeat 3]
+
+Times list_all_keys_recursive, search_keys_by_keyword and a full walk that
+decodes every value, checks that both backends return identical output and
+prints the speed-up of the mmap backend.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.general import list_all_keys_recursive, search_keys_by_keyword
+from src.session import HiveSession
+
+
+def _walk_values(session):
+    out = []
+    stack = [session.root()]
+    while stack:
+        key = stack.pop()
+        for value in key.values():
+            out.append((value.name(), value.value_type_str(), value.value()))
+        stack.extend(key.subkeys())
+    return out
+
+
+def _time(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("hive")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keyword", default="microsoft")
+    args = parser.parse_args()
+
+    cases = [
+        ("list_all_keys_recursive", lambda s: list_all_keys_recursive(s)),
+        ("search_keys_by_keyword", lambda s: search_keys_by_keyword(s, args.keyword)),
+        ("walk + decode all values", _walk_values),
+    ]
+
+    print(f"hive: {args.hive} ({os.path.getsize(args.hive) / 1e6:.1f} MB), best of {args.repeat}")
+    print(f"{'case':<28}{'registry':>12}{'mmap':>12}{'speed-up':>10}  same output")
+    for name, fn in cases:
+        timings = {}
+        results = {}
+        for backend in ("registry", "mmap"):
+            ## a fresh session per run so open + parse is part of the timing
+            def run():
+                with HiveSession(args.hive, backend=backend) as session:
+                    return fn(session)
+            timings[backend], results[backend] = _time(run, args.repeat)
+        same = results["registry"] == results["mmap"]
+        speedup = timings["registry"] / timings["mmap"] if timings["mmap"] else float("inf")
+        print(f"{name:<28}{timings['registry']:>11.3f}s{timings['mmap']:>11.3f}s{speedup:>9.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
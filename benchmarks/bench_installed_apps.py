@@ -0,0 +1,75 @@
+"""
+get_installed_apps(verbose=True) with per-key value views vs per-value lookups.
+
+    python benchmarks/bench_installed_apps.py /path/to/SOFTWARE [--repeat 3]
+
+The baseline reproduces the previous implementation, which called
+key.value(name) once per field (a linear scan of the value list each time).
+Both are timed on each backend and their output is compared.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.general import get_installed_apps
+from src.session import HiveSession
+
+UNINSTALL = "Microsoft\\Windows\\CurrentVersion\\Uninstall"
+
+
+def _per_value_lookups(session):
+    def safe_get_value(key, value_name):
+        try:
+            return key.value(value_name).value()
+        except Exception:
+            return "(not set)"
+
+    apps = []
+    for subkey in session.open(UNINSTALL).subkeys():
+        info = {"KeyName": subkey.name()}
+        for field in ("DisplayName", "Publisher", "DisplayVersion"):
+            info[field] = safe_get_value(subkey, field)
+        install_date = safe_get_value(subkey, "InstallDate")
+        if install_date != "(not set)" and len(install_date) == 8:
+            install_date = f"{install_date[0:4]}-{install_date[4:6]}-{install_date[6:8]}"
+        info["InstallDate"] = install_date
+        info["InstallLocation"] = safe_get_value(subkey, "InstallLocation")
+        info["UninstallString"] = safe_get_value(subkey, "UninstallString")
+        info["EstimatedSizeKB"] = str(safe_get_value(subkey, "EstimatedSize"))
+        apps.append(info)
+    return apps
+
+
+def _time(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("hive")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"hive: {args.hive}, best of {args.repeat}")
+    print(f"{'backend':<10}{'apps':>7}{'per-value':>12}{'key view':>12}{'speed-up':>10}  same output")
+    for backend in ("registry", "mmap"):
+        with HiveSession(args.hive, backend=backend) as session:
+            ## parse once outside the timing, both variants share it
+            session.root()
+            old, expected = _time(lambda: _per_value_lookups(session), args.repeat)
+            new, result = _time(lambda: get_installed_apps(session, verbose=True), args.repeat)
+        print(f"{backend:<10}{len(result):>7}{old:>11.3f}s{new:>11.3f}s{old / new:>9.2f}x  {result == expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Repeated open() of sibling paths with and without the key path cache.
+
+    python benchmarks/bench_open.py /path/to/SYSTEM [--repeat 3]
+
+Opens Services\\<name>\\... for every service and the Connection key of
+every network interface, the way the artifact functions do. The uncached
+baseline resolves each path from the root (python-registry's own open(),
+RegfKey.find_key with a linear subkey scan); the cached run goes through
+the session, which keeps resolved prefixes in a trie and looks subkeys up
+by lh hash.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Registry import Registry
+
+from src.regf import RegfHive
+from src.session import HiveSession
+
+NETWORK = "ControlSet001\\Control\\Network\\{4D36E972-E325-11CE-BFC1-08002BE10318}"
+
+
+def _paths(hive_path):
+    with HiveSession(hive_path, backend="mmap") as session:
+        services = [key.name() for key in session.open("ControlSet001\\Services").subkeys()]
+        try:
+            nics = [key.name() for key in session.open(NETWORK).subkeys()]
+        except Registry.RegistryKeyNotFoundException:
+            nics = []
+    return ([f"ControlSet001\\Services\\{name}" for name in services]
+            + [f"{NETWORK}\\{guid}\\Connection" for guid in nics])
+
+
+def _linear_open(hive, path):
+    ## RegfKey.find_key with the old linear subkey scan
+    nk = hive.root_offset()
+    for part in path.split("\\"):
+        wanted = part.lower()
+        nk = next(off for off in hive.subkey_offsets(nk) if hive.key_name(off).lower() == wanted)
+    return nk
+
+
+def _time(fn, repeat, setup=lambda: None):
+    best = None
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        fn(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("hive")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = _paths(args.hive)
+    print(f"hive: {args.hive}, {len(paths)} paths, best of {args.repeat}")
+    print(f"{'backend':<10}{'uncached':>10}{'cached':>10}{'speed-up':>10}")
+
+    ## every cached run starts from a fresh session, i.e. an empty trie
+    def fresh_session(backend):
+        session = HiveSession(args.hive, backend=backend)
+        session.registry
+        return session
+
+    registry = Registry.Registry(args.hive)
+    old = _time(lambda _: [registry.open(p) for p in paths], args.repeat)
+    new = _time(lambda session: [session.open(p) for p in paths], args.repeat, lambda: fresh_session("registry"))
+    print(f"{'registry':<10}{old:>9.3f}s{new:>9.3f}s{old / new:>9.1f}x")
+
+    with RegfHive(args.hive) as hive:
+        old = _time(lambda _: [_linear_open(hive, p) for p in paths], args.repeat)
+    new = _time(lambda session: [session.open(p) for p in paths], args.repeat, lambda: fresh_session("mmap"))
+    print(f"{'mmap':<10}{old:>9.3f}s{new:>9.3f}s{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Scaling of parallel whole-hive walks.
+
+    python benchmarks/bench_parallel.py /path/to/SOFTWARE [--backend mmap] [--jobs 1 2 4 8]
+
+Runs list_all_keys_recursive and search_keys_by_keyword at each worker count
+and prints keys per second and the speed-up over one worker. Output is
+checked against the single-process walk.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.general import list_all_keys_recursive, search_keys_by_keyword
+from src.session import HiveSession
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("hive")
+    parser.add_argument("--backend", default="mmap")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--keyword", default="microsoft")
+    args = parser.parse_args()
+
+    with HiveSession(args.hive, backend=args.backend) as session:
+        expected_keys = list_all_keys_recursive(session)
+        expected_matches = search_keys_by_keyword(session, args.keyword)
+    total = len(expected_keys)
+
+    print(f"hive: {args.hive} ({total} keys), backend: {args.backend}, cpus: {os.cpu_count()}")
+    print(f"{'case':<26}{'jobs':>5}{'seconds':>10}{'keys/s':>12}{'speed-up':>10}  same output")
+    for name, fn, expected in (
+        ("list_all_keys_recursive", lambda s, j: list_all_keys_recursive(s, jobs=j), expected_keys),
+        ("search_keys_by_keyword", lambda s, j: search_keys_by_keyword(s, args.keyword, jobs=j), expected_matches),
+    ):
+        baseline = None
+        for jobs in args.jobs:
+            with HiveSession(args.hive, backend=args.backend) as session:
+                start = time.perf_counter()
+                result = fn(session, jobs)
+                elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{name:<26}{jobs:>5}{elapsed:>10.3f}{total / elapsed:>12.0f}{baseline / elapsed:>9.2f}x  {result == expected}")
+
+
+if __name__ == "__main__":
+    main()
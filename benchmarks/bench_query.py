@@ -0,0 +1,101 @@
+"""
+Wildcard path queries (src.query) against a full walk filtered afterwards,
+on synthetic SYSTEM hives.
+
+    python benchmarks/bench_query.py [--scales 1 4 16] [--repeat 3] [--backend mmap]
+    python benchmarks/bench_query.py --hive /path/to/SYSTEM
+
+For each query the best of --repeat runs is reported: iter_query() and the
+baseline it replaces, every key visited with src.walk and its path and value
+names matched with fnmatch (what --list-all-keys piped into grep amounts
+to). Both must return the same matches. The hives are padded with filler
+keys under ControlSet001\\Enum, so a query that can skip them shows it.
+"""
+import argparse
+import fnmatch
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src.query import iter_query
+from src.session import HiveSession
+from src.walk import walk_keys
+from synth_hive import system_hive, write_hive
+
+QUERIES = (
+    "ControlSet00*\\Services\\*\\ImagePath",
+    "ControlSet001\\Services\\Tcpip\\Parameters\\Interfaces\\*\\Dhcp*",
+    "**\\Parameters\\ServiceDll",
+    "Select\\*",
+)
+
+
+def _best(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _components_match(patterns, names):
+    if not patterns:
+        return not names
+    if patterns[0] == "**":
+        return any(_components_match(patterns[1:], names[i:]) for i in range(len(names) + 1))
+    return bool(names) and fnmatch.fnmatch(names[0].lower(), patterns[0].lower()) \
+        and _components_match(patterns[1:], names[1:])
+
+
+def _walk_and_filter(session, query):
+    ## baseline: every key of the hive, filtered by path and value name
+    parts = query.split("\\")
+    keys, value = parts[:-1], parts[-1].lower()
+    matches = []
+    for path, key in walk_keys(session):
+        if _components_match(keys, path.split("\\")[1:]):
+            for v in key.values():
+                name = v.name() or "(default)"
+                if fnmatch.fnmatch(name.lower(), value):
+                    matches.append((path, name, v.value()))
+    return matches
+
+
+def bench(path, repeat, backend):
+    with HiveSession(path, backend=backend) as session:
+        session.registry
+        for query in QUERIES:
+            planned, matches = _best(lambda: list(iter_query(session, query)), repeat)
+            walked, expected = _best(lambda: _walk_and_filter(session, query), repeat)
+            assert matches == expected, f"query and walk disagree on {query}"
+            print(f"{os.path.basename(path):<20}{query:<62}{len(matches):>8}{planned:>10.4f}{walked:>10.3f}"
+                  f"{walked / planned:>8.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backend", choices=("registry", "mmap"), default="mmap")
+    parser.add_argument("--hive", action="append", help="Also time a SYSTEM hive of your own (repeatable)")
+    args = parser.parse_args()
+
+    print(f"seconds, best of {args.repeat}, {args.backend} backend")
+    print(f"{'hive':<20}{'query':<62}{'matches':>8}{'query':>10}{'walk':>10}{'':>9}")
+    with tempfile.TemporaryDirectory(prefix="regpy-bench-query-") as directory:
+        for scale in args.scales:
+            path = os.path.join(directory, f"system-x{scale}.hive")
+            write_hive(path, system_hive(services=500 * scale, filler_keys=20000 * scale, seed=scale), "SYSTEM")
+            bench(path, args.repeat, args.backend)
+    for path in args.hive or []:
+        bench(path, args.repeat, args.backend)
+
+
+if __name__ == "__main__":
+    main()
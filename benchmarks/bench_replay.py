@@ -0,0 +1,111 @@
+"""
+Transaction log replay (src.replay) on synthetic dirty SYSTEM hives, as the
+number of dirty pages in the logs grows.
+
+    python benchmarks/bench_replay.py [--pages 16 128 1024 4096] [--scale 8] [--repeat 3]
+
+For each log size the best of --repeat runs is reported for the replayed
+view with the default checks (header hash of every entry, data hash of the
+last one of each log), with --verify-logs (data hash of every entry), and
+for the same replay onto a full in-memory copy of the primary file, which
+is what the view's private mapping avoids. "held" is the memory the view
+keeps beyond the file's page cache, the pages the logs overwrote, and
+"private" what the kernel reports as copied for the view's mapping
+(Anonymous in /proc/self/smaps, Linux only). Every replayed hive must
+equal the clean one it was made from.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src import replay
+from src.archive import find_logs
+from synth_hive import system_hive, write_dirty_hive
+
+
+class CopiedView(replay.ReplayedView):
+    ## baseline: the primary file read into memory before the logs are applied
+    def _open_primary(self, source):
+        with open(source, "rb") as f:
+            return f.read()
+
+
+def _copied_on_write(buffer):
+    ## anonymous (copied on write) memory of the mapping holding buffer,
+    ## from /proc/self/smaps; its Private_Dirty also counts page cache
+    ## pages of a file not yet written back
+    import ctypes
+    try:
+        address = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+        inside = False
+        with open("/proc/self/smaps") as f:
+            for line in f:
+                fields = line.split()
+                if "-" in fields[0] and not fields[0].endswith(":"):
+                    start, end = (int(bound, 16) for bound in fields[0].split("-"))
+                    inside = start <= address < end
+                elif inside and fields[0] == "Anonymous:":
+                    return int(fields[1]) * 1024
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def _best(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        view = fn()
+        elapsed = time.perf_counter() - start
+        view.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench(path, clean, pages, repeat):
+    logs = find_logs(path)
+    log_size = sum(os.path.getsize(log) for log in logs)
+
+    replay.enable()
+    view = replay.ReplayedView(path, logs)
+    dirty = _copied_on_write(view.buffer)
+    assert bytes(view.buffer[0x1000:]) == clean[0x1000:], "replayed hive differs from the clean one"
+    entries, held = view.entries, view.touched
+    view.close()
+    fast = _best(lambda: replay.ReplayedView(path, logs), repeat)
+    copied = _best(lambda: CopiedView(path, logs), repeat)
+    replay.enable(verify_all=True)
+    verified = _best(lambda: replay.ReplayedView(path, logs), repeat)
+    replay.disable()
+
+    print(f"{pages:>7}{entries:>9}{log_size / 1024:>10.0f}{fast * 1000:>10.1f}{verified * 1000:>10.1f}"
+          f"{copied * 1000:>10.1f}{held / 1024:>10.0f}"
+          f"{(dirty / 1024 if dirty is not None else float('nan')):>10.0f}{os.path.getsize(path) / 1024:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[16, 128, 1024, 4096])
+    parser.add_argument("--scale", type=int, default=8, help="Size of the hive, see synth_hive.system_hive")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    root = system_hive(services=500 * args.scale, filler_keys=20000 * args.scale, seed=args.scale)
+    print(f"milliseconds, best of {args.repeat}; sizes in KB")
+    print(f"{'pages':>7}{'entries':>9}{'logs':>10}{'replay':>10}{'verified':>10}{'copy':>10}"
+          f"{'held':>10}{'private':>10}{'hive':>12}")
+    with tempfile.TemporaryDirectory(prefix="regpy-bench-replay-") as directory:
+        for pages in args.pages:
+            path = os.path.join(directory, f"SYSTEM-{pages}")
+            ## one entry per 16 pages, as a flush every few changes would write
+            clean = write_dirty_hive(path, root, dirty_pages=pages, entries=max(1, pages // 16),
+                                     hive_name="SYSTEM", seed=pages)
+            bench(path, clean, pages, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
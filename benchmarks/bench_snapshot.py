@@ -0,0 +1,122 @@
+"""
+Memory per key and query times of hive snapshots (src.snapshot) against
+the python-registry object graph, on synthetic SOFTWARE hives.
+
+    python benchmarks/bench_snapshot.py [--scales 1 4 16] [--repeat 3] [--queries 1000]
+    python benchmarks/bench_snapshot.py --hive /path/to/SOFTWARE
+
+Memory is what tracemalloc sees allocated and still held once each
+representation of the whole hive is in memory, the hive file's own bytes
+left out: for the object graph, a RegistryKey and the RegistryValues of
+every key (what keeping a hive "loaded" with python-registry takes); for
+the snapshot, its arrays and name table. Times are the best of --repeat:
+building the snapshot, reloading it from disk, --queries path lookups,
+listing every key and a key search, each against the same query through a
+python-registry session.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Registry import Registry
+
+from src.general import list_all_keys_recursive, search_keys_by_keyword
+from src.session import HiveSession
+from src.snapshot import HiveSnapshot, build_snapshot
+from synth_hive import software_hive, write_hive
+
+
+def _best(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _held(build):
+    ## bytes still allocated once build() returns, and what it returned
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return tracemalloc.get_traced_memory()[0] - before, result
+    finally:
+        tracemalloc.stop()
+
+
+def _object_graph(registry):
+    graph = []
+    stack = [registry.root()]
+    while stack:
+        key = stack.pop()
+        graph.append((key, key.values()))
+        stack.extend(reversed(key.subkeys()))
+    return graph
+
+
+def bench(path, repeat, queries):
+    registry = Registry.Registry(path)
+    graph_bytes, graph = _held(lambda: _object_graph(registry))
+    keys, values = len(graph), sum(len(vals) for _, vals in graph)
+    del graph, registry
+
+    snapshot_bytes, snapshot = _held(lambda: build_snapshot(path))
+    build, _ = _best(lambda: build_snapshot(path).close(), repeat)
+    with tempfile.NamedTemporaryFile(suffix=".regpy-snapshot", delete=False) as f:
+        saved = f.name
+    try:
+        snapshot.save(saved)
+        disk = os.path.getsize(saved)
+        load, _ = _best(lambda: HiveSnapshot.load(saved, path), repeat)
+    finally:
+        os.remove(saved)
+
+    paths = list_all_keys_recursive(snapshot)
+    sample = random.Random(0).choices(paths, k=queries)
+    with HiveSession(path) as session:
+        live_find, _ = _best(lambda: [session.open(p) for p in sample], repeat)
+        live_list, live_paths = _best(lambda: list_all_keys_recursive(session), repeat)
+        live_search, live_hits = _best(lambda: search_keys_by_keyword(session, "app"), repeat)
+    snap_find, _ = _best(lambda: [snapshot.find(p) for p in sample], repeat)
+    snap_list, _ = _best(lambda: list_all_keys_recursive(snapshot), repeat)
+    snap_search, snap_hits = _best(lambda: search_keys_by_keyword(snapshot, "app"), repeat)
+    assert paths == live_paths and snap_hits == live_hits, "snapshot and live walk disagree"
+    snapshot.close()
+
+    print(f"{os.path.basename(path):<20}{keys:>8}{values:>8}{graph_bytes / keys:>10.0f}{snapshot_bytes / keys:>10.0f}"
+          f"{graph_bytes / snapshot_bytes:>7.1f}x{disk / keys:>8.0f}{build:>8.3f}{load:>8.3f}"
+          f"{live_find:>8.3f}/{snap_find:<7.3f}{live_list:>7.3f}/{snap_list:<7.3f}{live_search:>7.3f}/{snap_search:<7.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=1000, help="Random key paths looked up per run")
+    parser.add_argument("--hive", action="append", help="Also measure a hive of your own (repeatable)")
+    args = parser.parse_args()
+
+    print(f"bytes per key held in memory; seconds, best of {args.repeat}, live/snapshot for the queries")
+    print(f"{'hive':<20}{'keys':>8}{'values':>8}{'graph B':>10}{'snap B':>10}{'ratio':>8}{'disk B':>8}"
+          f"{'build':>8}{'load':>8}{'find':>16}{'list':>15}{'search':>15}")
+    with tempfile.TemporaryDirectory(prefix="regpy-bench-snapshot-") as directory:
+        for scale in args.scales:
+            path = os.path.join(directory, f"software-x{scale}.hive")
+            write_hive(path, software_hive(apps=2000 * scale, filler_keys=10000 * scale, seed=scale), "SOFTWARE")
+            bench(path, args.repeat, args.queries)
+    for path in args.hive or []:
+        bench(path, args.repeat, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Start-up cost of regpy.py command lines, from `python -X importtime`.
+
+    python benchmarks/bench_startup.py [--system SYSTEM] [--repeat 5] [--top 8] [--regpy PATH]
+
+For each command line the best wall time of --repeat runs is reported next
+to the time spent importing modules (the sum of the cumulative times of
+the top-level imports CPython reports on stderr) and the number of modules
+imported. The slowest top-level imports of each command are listed below
+the table. Without --system only commands that need no hive are run;
+--regpy times another checkout's regpy.py for comparison.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REGPY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "regpy.py")
+
+
+def _commands(system):
+    commands = [("help", ["--help"]), ("serve --help", ["serve", "--help"])]
+    if system:
+        commands += [
+            ("list-services", ["--system", system, "--list-services"]),
+            ("list-dns", ["--system", system, "--list-dns"]),
+            ("services + dns + drivers", ["--system", system, "--list-services", "--list-dns", "--list-drivers"]),
+            ("list-services --json", ["--system", system, "--list-services", "--json"]),
+        ]
+    return commands
+
+
+def parse_importtime(stderr):
+    """[(module, self us, cumulative us, depth)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[0].strip().isdigit():
+            ## the header line
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return rows
+
+
+def run(argv, repeat):
+    """(best wall seconds, import rows of the last run) for `python -X importtime argv`."""
+    best = None
+    rows = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime"] + argv,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        rows = parse_importtime(proc.stderr)
+    return best, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--system", help="SYSTEM hive for the artifact commands")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports listed per command")
+    parser.add_argument("--regpy", default=REGPY, help="regpy.py to time, e.g. of another checkout to compare with")
+    args = parser.parse_args()
+
+    ## the interpreter alone, for reference
+    interpreter, _ = run(["-c", "pass"], args.repeat)
+
+    print(f"{args.regpy}, best of {args.repeat}, bare interpreter {interpreter * 1000:.0f}ms")
+    print(f"{'command':<28}{'wall ms':>9}{'import ms':>11}{'modules':>9}")
+    slowest = []
+    for label, argv in _commands(args.system):
+        wall, rows = run([args.regpy] + argv, args.repeat)
+        top_level = [row for row in rows if row[3] == 0]
+        imported = sum(row[2] for row in top_level) / 1000
+        print(f"{label:<28}{wall * 1000:>9.0f}{imported:>11.1f}{len(rows):>9}")
+        slowest.append((label, sorted(top_level, key=lambda row: -row[2])[:args.top]))
+
+    for label, rows in slowest:
+        print(f"\n{label}: " + ", ".join(f"{name} {cumulative / 1000:.1f}ms" for name, _, cumulative, _ in rows))
+
+
+if __name__ == "__main__":
+    main()
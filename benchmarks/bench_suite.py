@@ -0,0 +1,277 @@
+"""
+Benchmark suite over deterministic synthetic hives.
+
+    python benchmarks/bench_suite.py [--scales 1 4] [--backends registry mmap]
+                                     [--save-baseline FILE] [--baseline FILE]
+
+Generates SYSTEM, SOFTWARE, SAM and generic hives at each scale with
+benchmarks/synth_hive.py, times the public functions of src/ against them
+(each case in a fresh process, best of --repeat) and reports keys/s and
+peak RSS. With --baseline, timings are compared with a saved run and any
+case slower than the tolerance is flagged; the exit status is 1 when
+something regressed.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import synth_hive
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+## ignore differences below this many seconds, they are timer noise
+NOISE_SECONDS = 0.005
+
+
+## layouts of synth_hive written at each scale; "deleted" is the generic
+## tree with every DELETE_EVERY-th leaf key deleted
+LAYOUTS = ("generic", "system", "software", "sam", "deleted")
+DELETE_EVERY = 50
+## the SYSTEM hive again, inside a zip triage package (src.archive)
+ZIP_MEMBER = "C/Windows/System32/config/SYSTEM"
+## and dirty, with DIRTY_PAGES pages per scale in its transaction logs (src.replay)
+DIRTY_PAGES = 64
+## host collections for run_batch: copies of the SYSTEM, SOFTWARE and SAM hives
+BATCH_HOSTS = 2
+
+
+def _first_subkey(session, path):
+    return session.open(path).subkeys()[0].name()
+
+
+def _beside(session, layout, suffix=".hive"):
+    ## the file of another layout at the session's scale, e.g. generic-x4.hive for deleted-x4.hive
+    directory, name = os.path.split(session.hive_path)
+    return os.path.join(directory, layout + name[name.rindex("-x"):-len(".hive")] + suffix)
+
+
+def _case_functions():
+    ## imported here so the parent process stays small
+    from src.batch import run_batch
+    from src.carve import recover_deleted
+    from src.diff import compute_digests, diff_hives
+    from src.export import export_hive
+    from src.general import (find_services, get_drivers, get_installed_apps, get_key_values, get_service_details,
+                             get_services, get_shares, get_windows_version, iter_search_keys,
+                             list_all_keys_recursive, search_keys_by_keyword)
+    from src.index import (build_index, get_key_values_from_index, list_keys_from_index,
+                           search_keys_from_index)
+    from src.network import get_dns_servers, get_nic_details, get_nic_names
+    from src import replay
+    from src.query import query_values
+    from src.search import search_values
+    from src.snapshot import build_snapshot
+    from src.timeline import iter_timeline
+    from src.users import get_user_accounts, get_user_names, get_user_sids
+
+    interfaces = "ControlSet001\\Services\\Tcpip\\Parameters\\Interfaces"
+
+    def export_case(session):
+        with open(os.devnull, "w") as out:
+            return export_hive(session, out)
+
+    def build_index_case(session):
+        with tempfile.TemporaryDirectory() as tmp:
+            return build_index(session.hive_path, os.path.join(tmp, "index"))
+
+    def replayed_case(session):
+        replay.enable()
+        try:
+            return get_services(session)
+        finally:
+            ## the next run replays the logs again instead of reusing this view
+            replay.close_views()
+            replay.disable()
+
+    def batch_case(session):
+        return run_batch(_beside(session, "hosts", ""), jobs=1, output=os.devnull)
+
+    ## name -> (layout, uses the session backend, function(session)); the
+    ## index cases build the index beside the hive on their first run, the
+    ## best of --repeat is the lookup alone
+    return {
+        "list_all_keys_recursive": ("generic", True, lambda s: list_all_keys_recursive(s)),
+        "search_keys_by_keyword": ("generic", True, lambda s: search_keys_by_keyword(s, "key00")),
+        "iter_search_keys": ("generic", True, lambda s: list(iter_search_keys(s, "key00"))),
+        "get_key_values": ("generic", True, lambda s: get_key_values(s, _first_subkey(s, ""))),
+        "export_hive": ("generic", True, export_case),
+        "search_values": ("generic", True, lambda s: search_values(s, ["abc", "xyz"], [r"\d{4}$"])),
+        "build_index": ("generic", False, build_index_case),
+        "list_keys_from_index": ("generic", False, lambda s: list_keys_from_index(s)),
+        "search_keys_from_index": ("generic", False, lambda s: search_keys_from_index(s, "key00")),
+        "get_key_values_from_index": ("generic", False, lambda s: get_key_values_from_index(s, _first_subkey(s, ""))),
+        "recover_deleted": ("deleted", False, lambda s: recover_deleted(s)),
+        "diff_hives": ("deleted", False, lambda s: diff_hives(_beside(s, "generic"), s, cache=False)),
+        "build_snapshot": ("generic", False, lambda s: build_snapshot(s)),
+        "compute_digests": ("generic", False, lambda s: compute_digests(s.hive_path)),
+        "iter_timeline": ("generic", False, lambda s: list(iter_timeline([("GENERIC", s)]))),
+        "get_services": ("system", True, lambda s: get_services(s)),
+        "query_values": ("system", True, lambda s: query_values(s, "ControlSet00*\\Services\\*\\ImagePath")),
+        "get_services_zip": ("system-zip", True, lambda s: get_services(s)),
+        "get_services_replayed": ("system-dirty", True, replayed_case),
+        "get_drivers": ("system", True, lambda s: get_drivers(s)),
+        "get_shares": ("system", True, lambda s: get_shares(s)),
+        "get_service_details": ("system", True, lambda s: get_service_details(s, "Svc0001")),
+        "find_services": ("system", True, lambda s: find_services(s, image_outside="System32")),
+        "get_nic_names": ("system", True, lambda s: get_nic_names(s)),
+        "get_nic_details": ("system", True, lambda s: get_nic_details(s, _first_subkey(s, interfaces))),
+        "get_dns_servers": ("system", True, lambda s: get_dns_servers(s)),
+        "get_installed_apps": ("software", True, lambda s: get_installed_apps(s)),
+        "get_installed_apps_verbose": ("software", True, lambda s: get_installed_apps(s, verbose=True)),
+        "get_windows_version": ("software", True, lambda s: get_windows_version(s)),
+        "get_user_sids": ("software", True, lambda s: get_user_sids(s)),
+        "get_user_names": ("sam", True, lambda s: get_user_names(s)),
+        "get_user_accounts": ("sam", True, lambda s: get_user_accounts(s)),
+        "run_batch": ("system", False, batch_case),
+    }
+
+
+def _peak_rss_mb():
+    ## VmHWM is this process's own high-water mark on Linux; ru_maxrss
+    ## elsewhere (KiB on Linux, bytes on macOS), which may include the parent
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_case(name, hive_path, backend, repeat):
+    """Runs in a fresh process: best time of repeat runs and the peak RSS."""
+    from src.session import HiveSession
+
+    layout, _, fn = _case_functions()[name]
+    rss_before = _peak_rss_mb()
+    best = None
+    for _ in range(repeat):
+        with HiveSession(hive_path, backend=backend) as session, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn(session)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rss_after = _peak_rss_mb()
+    return best, rss_after, (rss_after - rss_before) if rss_after is not None else None
+
+
+def _hives(workdir, scales):
+    """Write (or reuse) one hive per layout and scale. Returns {(layout, scale): (path, keys)}."""
+    hives = {}
+    for scale in scales:
+        for layout in LAYOUTS:
+            path = os.path.join(workdir, f"{layout}-x{scale}.hive")
+            if layout == "deleted":
+                root = synth_hive.LAYOUTS["generic"](scale)
+                synth_hive.mark_deleted(root, DELETE_EVERY)
+            else:
+                root = synth_hive.LAYOUTS[layout](scale)
+            if not os.path.exists(path):
+                synth_hive.write_hive(path, root, layout.upper())
+            hives[(layout, scale)] = (path, synth_hive.count_keys(root))
+        zip_path = os.path.join(workdir, f"system-x{scale}.zip")
+        if not os.path.exists(zip_path):
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.write(hives[("system", scale)][0], ZIP_MEMBER)
+        hives[("system-zip", scale)] = (f"{zip_path}::{ZIP_MEMBER}", hives[("system", scale)][1])
+        dirty_path = os.path.join(workdir, f"system-dirty-x{scale}.hive")
+        if not os.path.exists(dirty_path):
+            pages = DIRTY_PAGES * scale
+            synth_hive.write_dirty_hive(dirty_path, synth_hive.LAYOUTS["system"](scale), dirty_pages=pages,
+                                        entries=max(1, pages // 16), hive_name="SYSTEM")
+        hives[("system-dirty", scale)] = (dirty_path, hives[("system", scale)][1])
+        for host in range(1, BATCH_HOSTS + 1):
+            host_dir = os.path.join(workdir, f"hosts-x{scale}", f"HOST{host:02d}")
+            os.makedirs(host_dir, exist_ok=True)
+            for layout in ("system", "software", "sam"):
+                target = os.path.join(host_dir, layout.upper())
+                if not os.path.exists(target):
+                    shutil.copyfile(hives[(layout, scale)][0], target)
+    return hives
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--backends", nargs="+", default=["registry", "mmap"])
+    parser.add_argument("--cases", nargs="+", help="Only run these cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", help="Where generated hives are kept (default: a temporary directory)")
+    parser.add_argument("--baseline", help=f"Compare with this saved run (default: {os.path.relpath(DEFAULT_BASELINE)} if present)")
+    parser.add_argument("--save-baseline", help="Write this run's results as a baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slow-down before a case is flagged (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    cases = _case_functions()
+    names = args.cases or list(cases)
+    baseline_path = args.baseline or (DEFAULT_BASELINE if os.path.exists(DEFAULT_BASELINE) else None)
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix="regpy-bench-"))
+        os.makedirs(workdir, exist_ok=True)
+        hives = _hives(workdir, args.scales)
+
+        print(f"{'case':<28}{'hive':<18}{'backend':<10}{'seconds':>9}{'keys/s':>11}{'peak MB':>9}{'+MB':>7}  vs baseline")
+        spawn = multiprocessing.get_context("spawn")
+        for name in names:
+            layout, uses_backend, _ = cases[name]
+            for scale in args.scales:
+                path, keys = hives[(layout, scale)]
+                for backend in (args.backends if uses_backend else ["-"]):
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                        seconds, peak, delta = pool.submit(_run_case, name, path, "mmap" if backend == "-" else backend,
+                                                           args.repeat).result()
+                    key = f"{name}|{layout}-x{scale}|{backend}"
+                    results[key] = {"seconds": round(seconds, 6), "keys": keys,
+                                    "peak_rss_mb": round(peak, 1) if peak is not None else None}
+
+                    note = ""
+                    if key in baseline:
+                        before = baseline[key]["seconds"]
+                        change = (seconds - before) / before if before else 0.0
+                        note = f"{change:+.0%}"
+                        if change > args.tolerance and seconds - before > NOISE_SECONDS:
+                            note += "  REGRESSION"
+                            regressions.append(key)
+                    peak_text = f"{peak:>9.1f}{delta:>7.1f}" if peak is not None else f"{'n/a':>9}{'':>7}"
+                    print(f"{name:<28}{layout + '-x' + str(scale):<18}{backend:<10}{seconds:>9.3f}"
+                          f"{keys / seconds:>11.0f}{peak_text}  {note}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"python": sys.version.split()[0], "scales": args.scales, "results": results}, f, indent=1, sort_keys=True)
+        print(f"baseline written to {args.save_baseline}")
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}:")
+        for key in regressions:
+            print(f"  {key}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,671 @@
+"""
+Deterministic synthetic regf writer used by the benchmark suite.
+
+Hives are described as a tree of SynthKey nodes and serialised into a
+valid regf file (base block, hbins, nk/vk/lh/ri/db/sk cells) that
+python-registry and src.regf can both parse.
+"""
+import struct
+
+REG_NONE = 0
+REG_SZ = 1
+REG_EXPAND_SZ = 2
+REG_BINARY = 3
+REG_DWORD = 4
+REG_MULTI_SZ = 7
+REG_QWORD = 11
+
+HBIN_SIZE = 0x1000
+BIG_DATA_CHUNK = 0x3fd8
+LH_MAX_ENTRIES = 500
+
+## 2020-01-01 00:00:00 as a FILETIME, keys get deterministic offsets from it
+BASE_FILETIME = 132223104000000000
+
+
+class SynthKey(object):
+    def __init__(self, name, values=None, subkeys=None, timestamp=None):
+        self.name = name
+        self.values = values or []
+        self.subkeys = subkeys or []
+        self.timestamp = timestamp
+        ## written, then unlinked from its parent and its cells freed
+        self.deleted = False
+
+    def add(self, name, values=None, timestamp=None):
+        key = SynthKey(name, values, timestamp=timestamp)
+        self.subkeys.append(key)
+        return key
+
+    def child(self, path):
+        """Return (creating as needed) the descendant at a backslash path."""
+        key = self
+        for part in path.split("\\"):
+            for sub in key.subkeys:
+                if sub.name.lower() == part.lower():
+                    key = sub
+                    break
+            else:
+                key = key.add(part)
+        return key
+
+
+def sz(text):
+    return (REG_SZ, (text + "\x00").encode("utf-16le"))
+
+
+def expand_sz(text):
+    return (REG_EXPAND_SZ, (text + "\x00").encode("utf-16le"))
+
+
+def multi_sz(items):
+    return (REG_MULTI_SZ, ("\x00".join(items) + "\x00\x00").encode("utf-16le"))
+
+
+def dword(number):
+    return (REG_DWORD, struct.pack("<I", number))
+
+
+def qword(number):
+    return (REG_QWORD, struct.pack("<Q", number))
+
+
+def binary(data):
+    return (REG_BINARY, bytes(data))
+
+
+def _lh_hash(name):
+    h = 0
+    for ch in name.upper():
+        h = (h * 37 + ord(ch)) & 0xFFFFFFFF
+    return h
+
+
+def _encode_name(name):
+    try:
+        return name.encode("ascii"), True
+    except UnicodeEncodeError:
+        return name.encode("utf-16le"), False
+
+
+class _CellWriter(object):
+    """Bump allocator laying cells out across 4k-aligned hbins."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self._hbin_start = 0
+        self._hbin_end = 0
+        ## when set, offsets of the cells allocated are appended to it
+        self.track = None
+        self._freed = False
+
+    def _new_hbin(self, need):
+        size = HBIN_SIZE
+        while size - 0x20 < need:
+            size += HBIN_SIZE
+        self._close_hbin()
+        start = len(self.buf)
+        self.buf += b"\x00" * size
+        struct.pack_into("<4sIIIIQI", self.buf, start, b"hbin", start, size, 0, 0, 0, 0)
+        self._hbin_start = start
+        self._hbin_end = start + size
+        self._cursor = start + 0x20
+
+    def _close_hbin(self):
+        ## the tail of an hbin is one free cell
+        if self._hbin_end and self._cursor < self._hbin_end:
+            struct.pack_into("<i", self.buf, self._cursor, self._hbin_end - self._cursor)
+            self._cursor = self._hbin_end
+
+    def alloc(self, payload_size):
+        size = (payload_size + 4 + 7) & ~7
+        if not self._hbin_end or self._cursor + size > self._hbin_end:
+            self._new_hbin(size)
+        offset = self._cursor
+        struct.pack_into("<i", self.buf, offset, -size)
+        self._cursor += size
+        if self.track is not None:
+            self.track.append(offset)
+        return offset
+
+    def free(self, offset):
+        ## a free cell keeps its contents, only the size turns positive
+        size = struct.unpack_from("<i", self.buf, offset)[0]
+        struct.pack_into("<i", self.buf, offset, abs(size))
+        self._freed = True
+
+    def _coalesce(self):
+        ## adjacent free cells are merged into one, as Windows does
+        hbin = 0
+        while hbin < len(self.buf):
+            end = hbin + struct.unpack_from("<I", self.buf, hbin + 8)[0]
+            cell, free_start = hbin + 0x20, None
+            while cell < end:
+                size = struct.unpack_from("<i", self.buf, cell)[0]
+                if size > 0 and free_start is not None:
+                    struct.pack_into("<i", self.buf, free_start, cell + size - free_start)
+                elif size > 0:
+                    free_start = cell
+                else:
+                    free_start = None
+                cell += abs(size)
+            hbin = end
+
+    def cell(self, payload):
+        offset = self.alloc(len(payload))
+        self.buf[offset + 4:offset + 4 + len(payload)] = payload
+        return offset
+
+    def finish(self):
+        self._close_hbin()
+        if self._freed:
+            self._coalesce()
+        return bytes(self.buf)
+
+
+class _KeyFrame(object):
+    __slots__ = ("key", "parent", "offset", "children", "entries", "value_count",
+                 "values_list", "max_value_name", "max_value_data", "cells", "deleted")
+
+    def __init__(self, key, parent, offset):
+        self.key = key
+        self.parent = parent
+        self.offset = offset
+        self.cells = [offset]
+        self.deleted = key.deleted or (parent is not None and parent.deleted)
+        self.children = []
+        self.entries = []
+        self.value_count = 0
+        self.values_list = 0xFFFFFFFF
+        self.max_value_name = 0
+        self.max_value_data = 0
+
+
+class HiveWriter(object):
+    def __init__(self, hive_name="SYNTHETIC"):
+        self.hive_name = hive_name
+        self._cells = _CellWriter()
+        self._tick = 0
+
+    def _timestamp(self, key):
+        if key.timestamp is not None:
+            return key.timestamp
+        self._tick += 1
+        return BASE_FILETIME + self._tick * 10000000
+
+    def _write_data(self, data):
+        if len(data) <= BIG_DATA_CHUNK:
+            return self._cells.cell(data)
+        segments = [self._cells.cell(data[i:i + BIG_DATA_CHUNK])
+                    for i in range(0, len(data), BIG_DATA_CHUNK)]
+        seg_list = self._cells.cell(struct.pack("<%dI" % len(segments), *segments))
+        return self._cells.cell(struct.pack("<2sHI", b"db", len(segments), seg_list))
+
+    def _write_value(self, name, vtype, data):
+        raw_name, ascii_name = _encode_name(name)
+        offset = self._cells.alloc(0x14 + len(raw_name))
+        if len(data) <= 4:
+            size = len(data) | 0x80000000
+            inline = data.ljust(4, b"\x00")
+        else:
+            size = len(data)
+            inline = struct.pack("<I", self._write_data(data))
+        struct.pack_into("<2sHI4sIHH", self._cells.buf, offset + 4, b"vk", len(raw_name),
+                         size, inline, vtype, 1 if ascii_name else 0, 0)
+        self._cells.buf[offset + 0x18:offset + 0x18 + len(raw_name)] = raw_name
+        return offset
+
+    def _write_subkey_list(self, entries):
+        def lh(chunk):
+            payload = struct.pack("<2sH", b"lh", len(chunk))
+            for offset, name in chunk:
+                payload += struct.pack("<II", offset, _lh_hash(name))
+            return self._cells.cell(payload)
+
+        if len(entries) <= LH_MAX_ENTRIES:
+            return lh(entries)
+        lists = [lh(entries[i:i + LH_MAX_ENTRIES]) for i in range(0, len(entries), LH_MAX_ENTRIES)]
+        return self._cells.cell(struct.pack("<2sH%dI" % len(lists), b"ri", len(lists), *lists))
+
+    def _start_key(self, key, parent, sk_offset):
+        """Allocate the nk cell and write the values; subkeys come later."""
+        raw_name, ascii_name = _encode_name(key.name)
+        frame = _KeyFrame(key, parent, self._cells.alloc(0x4C + len(raw_name)))
+
+        self._cells.track = frame.cells
+        value_offsets = []
+        for name, (vtype, data) in key.values:
+            value_offsets.append(self._write_value(name, vtype, data))
+            frame.max_value_name = max(frame.max_value_name, len(name) * 2)
+            frame.max_value_data = max(frame.max_value_data, len(data))
+        frame.value_count = len(value_offsets)
+        if value_offsets:
+            frame.values_list = self._cells.cell(struct.pack("<%dI" % len(value_offsets), *value_offsets))
+        self._cells.track = None
+        frame.children = sorted(key.subkeys, key=lambda k: k.name.upper())
+        return frame
+
+    def _finish_key(self, frame, sk_offset):
+        """Write the subkey list and fill in the nk cell once all subkeys are written."""
+        key = frame.key
+        raw_name, ascii_name = _encode_name(key.name)
+        self._cells.track = frame.cells
+        subkey_list = self._write_subkey_list(frame.entries) if frame.entries else 0xFFFFFFFF
+        self._cells.track = None
+        max_subkey_name = max([len(child.name) * 2 for child in frame.children] or [0])
+
+        flags = 0x20 if ascii_name else 0
+        is_root = frame.parent is None
+        if is_root:
+            flags |= 0x0C
+        struct.pack_into("<2sHQIIIIIIIIIIIIIIIHH", self._cells.buf, frame.offset + 4,
+                         b"nk", flags, self._timestamp(key), 0,
+                         0xFFFFFFFF if is_root else frame.parent.offset,
+                         len(frame.entries), 0, subkey_list, 0xFFFFFFFF,
+                         frame.value_count, frame.values_list, sk_offset, 0xFFFFFFFF,
+                         max_subkey_name, 0, frame.max_value_name, frame.max_value_data, 0,
+                         len(raw_name), 0)
+        self._cells.buf[frame.offset + 0x50:frame.offset + 0x50 + len(raw_name)] = raw_name
+
+    def _write_tree(self, root, sk_offset):
+        ## depth-first with an explicit stack so deep hives need no recursion:
+        ## a (key, parent frame) pair starts a key, a _KeyFrame finishes it
+        root_offset = None
+        stack = [(root, None)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, _KeyFrame):
+                self._finish_key(item, sk_offset)
+                if item.parent is None:
+                    root_offset = item.offset
+                elif not item.deleted or item.parent.deleted:
+                    item.parent.entries.append((item.offset, item.key.name))
+                if item.deleted:
+                    for cell in item.cells:
+                        self._cells.free(cell)
+                continue
+            frame = self._start_key(item[0], item[1], sk_offset)
+            stack.append(frame)
+            stack.extend((child, frame) for child in reversed(frame.children))
+        return root_offset
+
+    def _write_security(self):
+        ## minimal self-referencing sk cell shared by every key
+        descriptor = struct.pack("<BBHIIII", 1, 0, 0x8004, 0, 0, 0, 0)
+        offset = self._cells.alloc(0x14 + len(descriptor))
+        struct.pack_into("<2sHIIII", self._cells.buf, offset + 4, b"sk", 0,
+                         offset, offset, 1, len(descriptor))
+        self._cells.buf[offset + 0x18:offset + 0x18 + len(descriptor)] = descriptor
+        return offset
+
+    def build(self, root):
+        sk_offset = self._write_security()
+        root_offset = self._write_tree(root, sk_offset)
+        hbins = self._cells.finish()
+
+        header = bytearray(0x1000)
+        struct.pack_into("<4sIIQIIIIIII", header, 0, b"regf", 1, 1, BASE_FILETIME,
+                         1, 5, 0, 1, root_offset, len(hbins), 1)
+        name = self.hive_name.encode("utf-16le")[:64]
+        header[0x30:0x30 + len(name)] = name
+        checksum = 0
+        for (dw,) in struct.iter_unpack("<I", bytes(header[:0x1FC])):
+            checksum ^= dw
+        if checksum == 0:
+            checksum = 1
+        elif checksum == 0xFFFFFFFF:
+            checksum = 0xFFFFFFFE
+        struct.pack_into("<I", header, 0x1FC, checksum)
+        return bytes(header) + hbins
+
+
+def write_hive(path, root, hive_name="SYNTHETIC"):
+    data = HiveWriter(hive_name).build(root)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+## --- layouts ---
+##
+## All layouts are deterministic: the same arguments always produce the
+## same bytes, so benchmark results and baselines are comparable.
+
+NETWORK_CLASS = "{4D36E972-E325-11CE-BFC1-08002BE10318}"
+
+
+def _guid(i):
+    return "{%08X-%04X-4000-8000-%012X}" % (i, i & 0xFFFF, i * 7919)
+
+
+def _text(rng, size):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789 ") for _ in range(size))
+
+
+def generic_tree(keys=10000, depth=6, fanout=8, values_per_key=4, value_size=32, big_values=0, seed=0):
+    """
+    keys keys laid out breadth-first with at most fanout subkeys per key and
+    depth levels, each with values_per_key values (string, DWORD and binary
+    of about value_size bytes). big_values keys also get a binary value
+    larger than one cell (stored as big data).
+    """
+    import random
+    from collections import deque
+
+    rng = random.Random(seed)
+    root = SynthKey("ROOT")
+    nodes = [root]
+    queue = deque([(root, 0)])
+    while queue and len(nodes) < keys:
+        parent, level = queue.popleft()
+        if level >= depth:
+            continue
+        for _ in range(fanout):
+            if len(nodes) >= keys:
+                break
+            child = parent.add("Key%06d" % len(nodes))
+            nodes.append(child)
+            queue.append((child, level + 1))
+
+    for index, key in enumerate(nodes):
+        for v in range(values_per_key):
+            kind = v % 3
+            if kind == 0:
+                key.values.append(("Str%d" % v, sz(_text(rng, max(value_size // 2, 1)))))
+            elif kind == 1:
+                key.values.append(("Num%d" % v, dword(rng.getrandbits(32))))
+            else:
+                key.values.append(("Bin%d" % v, binary(rng.getrandbits(8 * value_size).to_bytes(value_size, "little"))))
+    for index in range(min(big_values, len(nodes))):
+        ## 38400 bytes, more than one cell holds
+        pattern = bytes(rng.getrandbits(8) for _ in range(64))
+        nodes[index * len(nodes) // big_values].values.append(("BigData", binary(pattern * 600)))
+    return root
+
+
+def system_hive(services=500, interfaces=8, shares=4, filler_keys=0, seed=0):
+    """SYSTEM layout: Select, ControlSet001\\Services (Tcpip interfaces, LanmanServer shares) and Control\\Network."""
+    root = SynthKey("ROOT")
+    root.child("Select").values = [("Current", dword(1)), ("Default", dword(1)),
+                                   ("Failed", dword(0)), ("LastKnownGood", dword(1))]
+    services_key = root.child("ControlSet001\\Services")
+    for i in range(services):
+        driver = i % 3 == 0
+        image = ("\\SystemRoot\\System32\\drivers\\drv%04d.sys" % i if driver
+                 else "C:\\Program Files\\Vendor%d\\svc%04d.exe" % (i % 17, i))
+        service = services_key.add("Svc%04d" % i, values=[
+            ("Start", dword(i % 5)), ("Type", dword(1 if driver else 16)), ("ErrorControl", dword(1)),
+            ("ImagePath", expand_sz(image)), ("DisplayName", sz("Synthetic Service %d" % i)),
+            ("ObjectName", sz("LocalSystem")), ("Description", sz("Description of service %d" % i))])
+        if not driver:
+            service.add("Parameters", values=[("ServiceDll", expand_sz("%%SystemRoot%%\\System32\\svc%04d.dll" % i))])
+        service.add("Security", values=[("Security", binary(bytes(range(64)) * 2))])
+
+    shares_key = root.child("ControlSet001\\Services\\LanmanServer\\Shares")
+    shares_key.values = [("Share%d" % i, multi_sz(["CSCFlags=0", "MaxUses=4294967295", "Path=C:\\Share%d" % i, "Type=0"]))
+                         for i in range(shares)]
+    shares_key.add("Security")
+    for i in range(shares):
+        shares_key.add("Share%d" % i)
+
+    interfaces_key = root.child("ControlSet001\\Services\\Tcpip\\Parameters\\Interfaces")
+    network = root.child("ControlSet001\\Control\\Network\\" + NETWORK_CLASS)
+    for i in range(interfaces):
+        guid = _guid(i)
+        interfaces_key.add(guid, values=[
+            ("EnableDHCP", dword(1)), ("DhcpIPAddress", sz("10.%d.0.%d" % (i, 10 + i))),
+            ("DhcpSubnetMask", sz("255.255.255.0")), ("DhcpNameServer", sz("10.%d.0.1 8.8.8.8" % i)),
+            ("DhcpDefaultGateway", multi_sz(["10.%d.0.1" % i])),
+            ("DhcpGatewayHardware", binary(bytes([10, i, 0, 1, 6, 0, 0x00, 0x15, 0x5D, 0x01, 0x02, i & 0xFF])))])
+        network.child(guid + "\\Connection").values = [("Name", sz("Ethernet %d" % i)), ("PnpInstanceID", sz("PCI\\VEN_%04X" % i))]
+
+    if filler_keys:
+        root.child("ControlSet001\\Enum").subkeys = generic_tree(filler_keys, seed=seed).subkeys
+    return root
+
+
+def software_hive(apps=2000, profiles=10, filler_keys=0, seed=0):
+    """SOFTWARE layout: Windows NT\\CurrentVersion, ProfileList and the Uninstall key."""
+    root = SynthKey("ROOT")
+    current = root.child("Microsoft\\Windows NT\\CurrentVersion")
+    current.values = [("ProductName", sz("Windows 10 Pro")), ("RegisteredOwner", sz("Synthetic User")),
+                      ("CurrentBuild", sz("19045")), ("CurrentVersion", sz("6.3")),
+                      ("EditionID", sz("Professional")), ("InstallDate", dword(1577836800))]
+
+    profile_list = root.child("Microsoft\\Windows NT\\CurrentVersion\\ProfileList")
+    for sid, path in (("S-1-5-18", "%systemroot%\\system32\\config\\systemprofile"),
+                      ("S-1-5-19", "%systemroot%\\ServiceProfiles\\LocalService"),
+                      ("S-1-5-20", "%systemroot%\\ServiceProfiles\\NetworkService")):
+        profile_list.add(sid, values=[("ProfileImagePath", expand_sz(path)), ("Flags", dword(12))])
+    for i in range(profiles):
+        profile_list.add("S-1-5-21-1111111111-2222222222-3333333333-%d" % (1001 + i), values=[
+            ("ProfileImagePath", expand_sz("C:\\Users\\user%03d" % i)), ("Flags", dword(0)),
+            ("Sid", binary(bytes(range(28))))])
+
+    uninstall = root.child("Microsoft\\Windows\\CurrentVersion\\Uninstall")
+    for i in range(apps):
+        values = [("DisplayName", sz("Synthetic Application %d" % i)), ("Publisher", sz("Vendor %d" % (i % 37))),
+                  ("DisplayVersion", sz("%d.%d.%d" % (i % 9, i % 13, i))),
+                  ("InstallDate", sz("20%02d%02d%02d" % (15 + i % 9, i % 12 + 1, i % 28 + 1))),
+                  ("InstallLocation", sz("C:\\Program Files\\App%05d" % i)),
+                  ("UninstallString", sz("\"C:\\Program Files\\App%05d\\uninstall.exe\" /S" % i)),
+                  ("EstimatedSize", dword(1024 + i * 3)), ("NoModify", dword(1)), ("NoRepair", dword(1)),
+                  ("Language", dword(1033)), ("URLInfoAbout", sz("https://example.com/app/%d" % i))]
+        if i % 10 == 0:
+            ## some entries have no DisplayName, like system components
+            values = values[1:]
+        uninstall.add(_guid(i), values=values)
+
+    root.child("Microsoft\\Windows\\CurrentVersion\\App Paths")
+    if filler_keys:
+        root.child("Classes").subkeys = generic_tree(filler_keys, seed=seed).subkeys
+    return root
+
+
+def _sam_f(rid, i):
+    ## fixed 0x50 byte account record
+    stamp = BASE_FILETIME + i * 864000000000
+    data = bytearray(0x50)
+    struct.pack_into("<HH", data, 0x00, 2, 1)
+    struct.pack_into("<Q", data, 0x08, stamp + 36000000000)      ## last logon
+    struct.pack_into("<Q", data, 0x18, stamp)                    ## password last set
+    struct.pack_into("<Q", data, 0x20, 0x7FFFFFFFFFFFFFFF)       ## account expires (never)
+    struct.pack_into("<Q", data, 0x28, stamp + 18000000000)      ## last failed logon
+    struct.pack_into("<I", data, 0x30, rid)
+    struct.pack_into("<H", data, 0x38, 0x0211 if rid == 501 else 0x0210)   ## ACB flags
+    struct.pack_into("<HH", data, 0x40, i % 3, 10 + i)            ## failed / total logons
+    return bytes(data)
+
+
+def _sam_v(name, full_name, comment):
+    ## 17 (offset, length, unknown) entries, offsets relative to the end of the table
+    fields = [b""] * 17
+    fields[1] = name.encode("utf-16le")
+    fields[2] = full_name.encode("utf-16le")
+    fields[3] = comment.encode("utf-16le")
+    table = bytearray()
+    data = bytearray()
+    for field in fields:
+        table += struct.pack("<III", len(data), len(field), 0)
+        data += field + b"\x00" * (-len(field) % 4)
+    return bytes(table + data)
+
+
+def sam_hive(users=50):
+    """SAM layout: SAM\\Domains\\Account\\Users with F/V records and the Names index."""
+    root = SynthKey("ROOT")
+    account = root.child("SAM\\Domains\\Account")
+    account.values = [("F", binary(bytes(0x68))), ("V", binary(bytes(0x40)))]
+    users_key = account.child("Users")
+    names = users_key.child("Names")
+    accounts = [("Administrator", 500), ("Guest", 501), ("DefaultAccount", 503), ("WDAGUtilityAccount", 504)]
+    accounts += [("user%03d" % i, 1001 + i) for i in range(users)]
+    for i, (name, rid) in enumerate(accounts):
+        users_key.add("%08X" % rid, values=[
+            ("F", binary(_sam_f(rid, i))),
+            ("V", binary(_sam_v(name, "Synthetic %s" % name, "Account %d" % rid)))])
+        ## the default value's type is the RID, as Windows stores it
+        names.add(name, values=[("", (rid, b""))])
+    root.child("SAM\\Domains\\Builtin\\Aliases\\Names")
+    return root
+
+
+LAYOUTS = {
+    "generic": lambda scale: generic_tree(keys=5000 * scale, big_values=5 * scale),
+    "system": lambda scale: system_hive(services=300 * scale, interfaces=4 + scale, filler_keys=2000 * scale),
+    "software": lambda scale: software_hive(apps=1000 * scale, profiles=5 + scale, filler_keys=4000 * scale),
+    "sam": lambda scale: sam_hive(users=20 * scale),
+}
+
+
+def mark_deleted(root, every):
+    """Mark every Nth leaf key (in walk order) deleted. Returns how many."""
+    marked = 0
+    leaves = 0
+    stack = [root]
+    while stack:
+        key = stack.pop()
+        if not key.subkeys:
+            leaves += 1
+            if leaves % every == 0:
+                key.deleted = True
+                marked += 1
+        stack.extend(key.subkeys)
+    return marked
+
+
+## --- dirty hives ---
+##
+## A dirty hive is what a copy taken from a live system looks like: the
+## primary file still has old contents in the pages changed since the last
+## flush (here: random bytes), its sequence numbers differ, and the pages
+## as they should be are in the transaction logs beside it.
+
+def _base_block(data, primary_seq, secondary_seq, hbins_size=None, file_type=None):
+    header = bytearray(data[:0x1000])
+    struct.pack_into("<II", header, 4, primary_seq, secondary_seq)
+    if hbins_size is not None:
+        struct.pack_into("<I", header, 0x28, hbins_size)
+    if file_type is not None:
+        struct.pack_into("<I", header, 0x1C, file_type)
+    checksum = 0
+    for (dw,) in struct.iter_unpack("<I", bytes(header[:0x1FC])):
+        checksum ^= dw
+    struct.pack_into("<I", header, 0x1FC, 1 if checksum == 0 else 0xFFFFFFFE if checksum == 0xFFFFFFFF else checksum)
+    return header
+
+
+def _log_entry(seq, hbins_size, runs):
+    ## one HvLE entry: header, (offset, size) page references, the pages
+    from src.replay import marvin32
+    refs = b"".join(struct.pack("<II", offset - HBIN_SIZE, len(page)) for offset, page in runs)
+    body = refs + b"".join(page for _, page in runs)
+    size = -(-(40 + len(body)) // 0x200) * 0x200
+    entry = bytearray(size)
+    struct.pack_into("<4sIIIII", entry, 0, b"HvLE", size, 0, seq, hbins_size, len(runs))
+    entry[40:40 + len(body)] = body
+    struct.pack_into("<Q", entry, 24, marvin32(bytes(entry[40:])))
+    struct.pack_into("<Q", entry, 32, marvin32(bytes(entry[:32])))
+    return bytes(entry)
+
+
+def _runs(data, pages):
+    ## contiguous dirty pages as (file offset, bytes) runs
+    runs = []
+    for page in sorted(pages):
+        offset = HBIN_SIZE + page * HBIN_SIZE
+        if runs and runs[-1][0] + len(runs[-1][1]) == offset:
+            runs[-1] = (runs[-1][0], runs[-1][1] + data[offset:offset + HBIN_SIZE])
+        else:
+            runs.append((offset, data[offset:offset + HBIN_SIZE]))
+    return runs
+
+
+def write_dirty_hive(path, root, dirty_pages=64, entries=8, grow_pages=0, old_format=False,
+                     stale_entries=0, hive_name="SYNTHETIC", seed=0):
+    """
+    Write root as a dirty hive at path with its logs (<path>.LOG1/.LOG2):
+    dirty_pages random hbin pages of the primary are overwritten and the
+    right ones logged in entries HvLE entries split over the two logs, the
+    last grow_pages pages are only in the logs (the hive grew since its last
+    flush). old_format writes one .LOG1 with a DIRT sector bitmap instead,
+    stale_entries adds entries older than the primary that must be skipped.
+    Returns the clean hive's bytes, which replaying the logs gives back.
+    """
+    import random
+
+    rng = random.Random(seed)
+    clean = HiveWriter(hive_name).build(root)
+    hbins_size = len(clean) - HBIN_SIZE
+    page_count = hbins_size // HBIN_SIZE
+    grown = set(range(page_count - grow_pages, page_count))
+    pages = sorted(grown | set(rng.sample(range(page_count - grow_pages), min(dirty_pages, page_count - grow_pages))))
+    first_seq = 100
+    last_seq = first_seq + (1 if old_format else entries) - 1
+
+    primary = bytearray(clean[:len(clean) - grow_pages * HBIN_SIZE])
+    for page in pages:
+        offset = HBIN_SIZE + page * HBIN_SIZE
+        if offset < len(primary):
+            primary[offset:offset + HBIN_SIZE] = rng.randbytes(HBIN_SIZE)
+    primary[:0x1000] = _base_block(clean, last_seq + 1, first_seq, hbins_size - grow_pages * HBIN_SIZE)
+    with open(path, "wb") as f:
+        f.write(primary)
+
+    if old_format:
+        bitmap = bytearray(hbins_size // 0x200 // 8)
+        sectors = []
+        for page in pages:
+            for sector in range(page * 8, page * 8 + 8):
+                bitmap[sector // 8] |= 1 << (sector % 8)
+        for page in pages:
+            sectors.append(clean[HBIN_SIZE + page * HBIN_SIZE:HBIN_SIZE * 2 + page * HBIN_SIZE])
+        log = bytes(_base_block(clean, last_seq, last_seq, file_type=1)[:0x200]) + b"DIRT" + bytes(bitmap)
+        log += bytes(-len(log) % 0x200) + b"".join(sectors)
+        with open(path + ".LOG1", "wb") as f:
+            f.write(log)
+        return clean
+
+    log_header = bytes(_base_block(clean, last_seq, last_seq, file_type=6)[:0x200])
+    groups = [pages[i::entries] for i in range(entries)]
+    logs = [[log_header], [log_header]]
+    for index in range(stale_entries):
+        logs[0].append(_log_entry(first_seq - stale_entries + index, hbins_size,
+                                  [(HBIN_SIZE, rng.randbytes(HBIN_SIZE))]))
+    for index, group in enumerate(groups):
+        ## the first half of the entries in LOG1, the rest in LOG2
+        logs[0 if index < (entries + 1) // 2 else 1].append(_log_entry(first_seq + index, hbins_size, _runs(clean, group)))
+    for suffix, parts in zip((".LOG1", ".LOG2"), logs):
+        with open(path + suffix, "wb") as f:
+            f.write(b"".join(parts))
+    return clean
+
+
+def count_keys(root):
+    count = 0
+    stack = [root]
+    while stack:
+        key = stack.pop()
+        count += 1
+        stack.extend(key.subkeys)
+    return count
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic registry hive")
+    parser.add_argument("layout", choices=sorted(LAYOUTS))
+    parser.add_argument("output")
+    parser.add_argument("--scale", type=int, default=1, help="Size multiplier of the layout")
+    parser.add_argument("--delete-every", type=int, help="Delete every Nth leaf key (leaves its cells free, for carving)")
+    args = parser.parse_args()
+
+    root = LAYOUTS[args.layout](args.scale)
+    deleted = mark_deleted(root, args.delete_every) if args.delete_every else 0
+    size = write_hive(args.output, root, args.layout.upper())
+    print(f"{args.output}: {count_keys(root)} keys ({deleted} deleted), {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,33 @@
-import argparse
 import os
 import sys
 
-## import other files here
-from src.users import *
-from src.network import *
-from src.general import *
+from src.options import ARTIFACTS, BACKENDS, BINARY_ENCODINGS, SERVER_ENV, START_TYPES
+
+## hand the command line to a running `regpy.py serve` when one is named
+## with --server or $REGPY_SERVER, before importing anything else; without
+## an answer from the server the command runs here as usual
+if (__name__ == "__main__" and sys.argv[1:2] != ["serve"]
+        and (os.environ.get(SERVER_ENV) or any(arg.startswith("--server") for arg in sys.argv[1:]))):
+    from src.client import forward_cli, runs_locally, split_server_arg
+
+    _server, _argv = split_server_arg(sys.argv[1:])
+    _server = _server or os.environ.get(SERVER_ENV)
+    if _server and _argv and not runs_locally(_argv):
+        _status = forward_cli(_argv, _server)
+        if _status is not None:
+            sys.exit(_status)
+        print(f" [Info] No regpy server at {_server}, running locally", file=sys.stderr)
+        sys.argv[1:] = _argv
+
+import argparse
+from collections import OrderedDict, namedtuple
+import contextlib
+import datetime
+import itertools
+
+## nothing that parses hives is imported here: each command imports what it
+## needs when it runs (see COMMANDS), so --help and a single artifact only
+## pay for their own modules
 
 BANNER = r"""
 
@@ -21,7 +43,16 @@ Author: @jellibeantheargonaut
 =============================================
 """
 
-def main():
+HIVE_ARGS = ("sam", "system", "security", "software", "ntuser")
+
+
+def _utc_datetime(text):
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{text}', expected YYYY-MM-DD[THH:MM:SS]")
+
+def build_parser():
     parser = argparse.ArgumentParser(description='RegPy - A Python-based Registry Parser')
 
 
@@ -31,20 +62,50 @@ def main():
     parser.add_argument('--system', type=str, help='Path to SYSTEM hive file')
     parser.add_argument('--security', type=str, help='Path to SECURITY hive file')
     parser.add_argument('--software', type=str, help='Path to SOFTWARE hive file')
-    parser.add_argument('--ntuser', type=str, help='Path to NTUSER.DAT hive file')
+    parser.add_argument('--ntuser', type=str, action='append', help='Path to NTUSER.DAT hive file (repeatable for --timeline)')
     parser.add_argument('-k', '--key', type=str, help='Registry key to parse')
     parser.add_argument('-r', '--recursive', action='store_true', help='Recursively parse subkeys')
     parser.add_argument('--list-all-keys', action='store_true', help='Recursively list all keys in the hive')
     parser.add_argument('--subkeys', type=str, help='List all subkeys of the specified key')
     parser.add_argument('--get-values', action='store_true', help='Get all values under the specified key')
     parser.add_argument('--search', type=str, help='Search for keys/values containing the keyword')
-
-    ## to be implemented later
-    ## parser.add_argument('--regex', type=str, help='Regex pattern to filter keys/values')
-
-
-    ## parser.add_argument('--json', action='store_true', help='Output results in JSON format')
-    ## parser.add_argument('--csv', action='store_true', help='Output results in CSV format')
+    parser.add_argument('--max-depth', type=int, help='Only walk this many levels below the start key (--list-all-keys, --subkeys, --search)')
+    parser.add_argument('--max-keys', type=int, help='Stop walking after this many keys (--list-all-keys, --subkeys, --search)')
+    parser.add_argument('--jobs', type=int, help='Worker processes for whole-hive walks (--list-all-keys, --subkeys, --search; default 1) and for --batch (default: one per CPU)')
+    parser.add_argument('--batch', type=str, help='Run artifacts over every host collection in a directory tree, a triage archive or a JSON/CSV manifest')
+    parser.add_argument('--batch-output', type=str, help='Write batch results (one JSON line per host) to this file instead of stdout')
+    parser.add_argument('--artifacts', type=str, help=f"Comma separated artifacts for --batch (default: all of {', '.join(ARTIFACTS)})")
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'), help='Report added, removed and modified keys and values between two hives (from --key, default: the root)')
+    parser.add_argument('--timeline', action='store_true', help='LastWrite timeline of every key in the given hives (SAM, SYSTEM, SOFTWARE, SECURITY, NTUSER), oldest first')
+    parser.add_argument('--since', type=_utc_datetime, help='Only keys written at or after this UTC time (YYYY-MM-DD[THH:MM:SS])')
+    parser.add_argument('--until', type=_utc_datetime, help='Only keys written at or before this UTC time (YYYY-MM-DD[THH:MM:SS])')
+    parser.add_argument('--build-index', action='store_true', help='Build (or refresh) the persistent key/value index of the hive')
+    parser.add_argument('--use-index', action='store_true', help='Answer --search, --subkeys and --get-values from the persistent index, building it if missing or stale')
+    parser.add_argument('--snapshot', action='store_true', help='Answer --list-all-keys, --subkeys, --search, --query and --get-values from the compact in-memory snapshot of the hive, saved beside it and rebuilt when missing or stale')
+    parser.add_argument('--backend', choices=BACKENDS, default='registry', help='Hive parser: python-registry or the memory-mapped regf reader')
+    parser.add_argument('--replay-logs', action='store_true', help='Read dirty hives with the transaction logs beside them (.LOG1/.LOG2/.LOG) replayed in memory, the files are left untouched')
+    parser.add_argument('--verify-logs', action='store_true', help='With --replay-logs, check the hash of every log entry\'s data, not only the last one of each log (slower)')
+
+    parser.add_argument('--regex', type=str, action='append', help='Regex to match against key paths, value names and string data (repeatable)')
+    parser.add_argument('--ioc-file', type=str, help='File of indicators, one per line ("re:" prefix for regexes), matched in one pass over the hive')
+    parser.add_argument('--search-values', action='store_true', help='Also match the --search keyword against value names and string data')
+    parser.add_argument('--max-results', type=int, help='Stop searching after this many matches')
+    parser.add_argument('--query', type=str, help='Values matching a wildcard key path, e.g. "ControlSet00*\\Services\\*\\ImagePath" or "**\\Run\\*" (a trailing \\ lists the keys); relative to --key')
+
+
+    parser.add_argument('--json', action='store_true', help='Output results as NDJSON records (one JSON object per line)')
+    parser.add_argument('--csv', action='store_true', help='Output results as CSV rows')
+    parser.add_argument('--export', action='store_true', help='Export every key and value below --key (default: the whole hive) as NDJSON or CSV')
+    parser.add_argument('--recover', action='store_true', help='Carve deleted keys, values and security records from the free cells of the hive')
+    parser.add_argument('-o', '--output', type=str, help='Write --json/--csv/--export output to this file instead of stdout')
+    parser.add_argument('--binary', choices=BINARY_ENCODINGS, default='hex', help='Encoding of binary value data in structured output')
+
+    parser.add_argument('--no-cache', action='store_true', help='Do not answer artifact functions from the persistent result cache (~/.cache/regpy/results.sqlite) or add to it')
+    parser.add_argument('--cache-stats', action='store_true', help='Print result cache hits and misses to stderr')
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB', help='Size bound of the result cache, least recently used results are dropped first (default: 256)')
+    parser.add_argument('--profile', action='store_true', help='Print keys visited, values decoded, cells touched and the time of each phase to stderr')
+    parser.add_argument('--profile-json', type=str, help='Write the --profile metrics to this JSON file')
+    parser.add_argument('--profile-pstats', type=str, help='Also run under cProfile and write pstats data to this file')
 
     ## Windows specific options
     parser.add_argument('--winver', action='store_true', help="Get Windows version from the registry file")
@@ -63,12 +124,16 @@ def main():
 
     ## Windows user options
     parser.add_argument('--list-users', action='store_true', help="List all user accounts")
+    parser.add_argument('--list-accounts', action='store_true', help="Account records of every user (RID, names, logon and password times, logon counts, flags)")
     ## parser.add_argument('--user-details', type=str, help="Get details of a user by username")
     ## parser.add_argument('--list-autoruns', action='store_true', help="List all autorun entries")
     parser.add_argument('--list-installed-software', action='store_true', help="List all installed software")
     ## parser.add_argument('--software-details', type=str, help="Get details of installed software by name")
     parser.add_argument('--list-services', action='store_true', help="List all services")
     parser.add_argument('--service-details', type=str, help="Get details of a service by name")
+    parser.add_argument('--start', type=str, action='append', choices=sorted(START_TYPES.values(), key=list(START_TYPES.values()).index), help="With --list-services, only services with this start type (repeatable)")
+    parser.add_argument('--drivers-only', action='store_true', help="With --list-services, only kernel and file system drivers")
+    parser.add_argument('--image-outside', type=str, help="With --list-services, only services whose ImagePath is not under this directory (e.g. System32)")
 
 
     parser.add_argument('--list-drivers', action='store_true', help="List all drivers")
@@ -76,100 +141,521 @@ def main():
     parser.add_argument('--list-shares', action='store_true', help="List all shared folders")
     ## parser.add_argument('--list-mapped-drives', action='store_true', help="List all mapped network drives")
     parser.add_argument('--list-installed-applications', action='store_true', help="List all installed applications")
-    
 
+    ## forwarding to `regpy.py serve` is handled before parsing, see the top of this file
+    parser.add_argument('--server', type=str, help=f"Run this command on a running 'regpy.py serve' (default address: ${SERVER_ENV})")
+    return parser
+
+
+def build_serve_parser():
+    from src.client import DEFAULT_ADDRESS
+    from src.server import IDLE_TIMEOUT, MAX_CLIENTS
+
+    parser = argparse.ArgumentParser(prog='regpy.py serve', description='Keep hives parsed and answer queries over a local socket')
+    parser.add_argument('--listen', type=str, default=DEFAULT_ADDRESS, help=f'unix:/path/to.sock or 127.0.0.1:PORT, loopback addresses only (default: {DEFAULT_ADDRESS})')
+    parser.add_argument('--backend', choices=BACKENDS, default='registry', help='Hive parser used for every hive')
+    parser.add_argument('--replay-logs', action='store_true', help='Read dirty hives with their transaction logs replayed')
+    parser.add_argument('--verify-logs', action='store_true', help="With --replay-logs, check the hash of every log entry's data")
+    parser.add_argument('--max-open', type=int, default=8, help='Most hives kept parsed at once; the least recently used idle one is closed first')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT, help='Close hives unused for this many seconds (0: never)')
+    parser.add_argument('--max-clients', type=int, default=MAX_CLIENTS, help='Requests handled at the same time')
+    parser.add_argument('-V', '--verbose', action='store_true', help='Log every request to stderr')
+    for hive_arg in HIVE_ARGS:
+        parser.add_argument(f'--{hive_arg}', type=str, action='append', default=[], help=f'{hive_arg.upper()} hive to load at start-up and keep open (repeatable)')
+    return parser
+
+
+def main():
+    if sys.argv[1:2] == ["serve"]:
+        serve(build_serve_parser().parse_args(sys.argv[2:]))
+        return
+
+    parser = build_parser()
     if len(sys.argv) == 1:
         print(BANNER)
         parser.print_help()
         return
 
     args = parser.parse_args()
-
-    ## Test get_user_names_from_sam function
-    if args.list_users:
-        if not args.sam:
-            print("Please provide the SAM hive path with --sam to list user accounts.")
-            return
-        get_user_names(args.sam, verbose=args.verbose)
-
-    ## Test get_nic_names function
-    if args.list_nics:
-        if not args.system:
-            print("Please provide the SYSTEM hive path with --system to list network interfaces.")
-            return
-        nic_names = get_nic_names(args.system)
+    if args.json and args.csv:
+        parser.error("--json and --csv cannot be used together")
+
+    from src.session import HiveCache
+
+    if args.replay_logs:
+        from src import replay
+        replay.enable(verify_all=args.verify_logs)
+    profiling = args.profile or args.profile_json or args.profile_pstats
+    if profiling:
+        from src import metrics
+        metrics.enable()
+    ## profiles measure the parsing, so they never come from the cache
+    results = None
+    if not args.no_cache and not profiling:
+        from src import resultcache
+        results = resultcache.enable(resultcache.ResultCache(max_bytes=args.cache_size << 20))
+    try:
+        with contextlib.ExitStack() as stack:
+            hives = stack.enter_context(HiveCache(backend=args.backend))
+            run_cli(args, hives, stack, release=True)
+    finally:
+        if profiling:
+            _report_profile(args, metrics.disable())
+        if results is not None:
+            resultcache.disable()
+            if args.cache_stats:
+                print(results.report(), file=sys.stderr)
+            results.close()
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value] if value else []
+
+
+def run_cli(args, hives, stack, stdout=None, redirect_stdout=contextlib.redirect_stdout, release=False):
+    """
+    Open the hives named in args through hives (a HiveCache) and run every
+    flag. stdout is where structured records go (default: sys.stdout) and
+    redirect_stdout is used to send everything else to stderr. With release,
+    each hive is closed as soon as the last command reading it is done.
+    """
+    args.format = "csv" if args.csv else "ndjson" if (args.json or args.export) else None
+    profiling = args.profile or args.profile_json or args.profile_pstats
+
+    ## hives inside triage archives: a compressed tar is read in one pass
+    from src.archive import prefetch
+    prefetch([path for hive_arg in HIVE_ARGS for path in _as_list(getattr(args, hive_arg))])
+
+    ## every flag shares one parsed copy of each hive
+    for hive_arg in HIVE_ARGS:
+        value = getattr(args, hive_arg)
+        if isinstance(value, list):
+            setattr(args, hive_arg, [stack.enter_context(hives.checkout(path)) for path in value])
+        elif value:
+            setattr(args, hive_arg, stack.enter_context(hives.checkout(value)))
+    args.out = None
+    if args.format:
+        ## records go to the output, everything else that is printed
+        ## (headers, verbose info, errors) goes to stderr
+        if args.output:
+            args.out = stack.enter_context(open(args.output, "w", newline="", encoding="utf-8", buffering=1 << 16))
+        else:
+            args.out = stdout or sys.stdout
+            stack.enter_context(redirect_stdout(sys.stderr))
+    if args.verbose:
+        for hive_arg in HIVE_ARGS:
+            for session in _as_list(getattr(args, hive_arg)):
+                if session.logs:
+                    print(f" [Info] Transaction logs beside {session.hive_path}: {', '.join(session.logs)}")
+                    if session.replay is not None:
+                        print(f" [Info] {session.hive_path}: {session.replay.summary()}")
+    if profiling:
+        from src import metrics
+        ## time spent writing output is reported apart from parsing
+        stack.enter_context(redirect_stdout(metrics.TimedStream(sys.stdout)))
+        if args.out is not None:
+            args.out = metrics.TimedStream(args.out)
+    if args.profile_pstats:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(run_flags, args, release)
+        profiler.dump_stats(args.profile_pstats)
+    else:
+        run_flags(args, release)
+
+
+## arguments holding file paths, taken relative to the client's directory when served
+PATH_ARGS = HIVE_ARGS + ("diff", "ioc_file")
+## arguments that would write files (or run batches) as the server's user:
+## the output, the index, snapshot and digests saved beside the hives; a
+## served command line may not use them, its records come back in the reply
+LOCAL_ONLY_ARGS = ("output", "batch", "batch_output", "build_index", "use_index", "snapshot", "diff")
+
+
+def _served_cli(argv, cwd, hives, stdout, redirect_stdout):
+    """Run a command line forwarded by a client of `regpy.py serve`."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.json and args.csv:
+        parser.error("--json and --csv cannot be used together")
+    if args.profile or args.profile_json or args.profile_pstats:
+        parser.error("--profile options are not available through the server, run the command locally")
+    refused = [f"--{name.replace('_', '-')}" for name in LOCAL_ONLY_ARGS if getattr(args, name)]
+    if refused:
+        parser.error(f"{', '.join(refused)} cannot be used through the server, run the command locally")
+    if args.backend != hives.backend:
+        print(f" [Info] The server uses the {hives.backend} backend, --backend {args.backend} is ignored", file=sys.stderr)
+    from src import replay
+    if args.replay_logs and not replay.active():
+        print(" [Info] The server does not replay transaction logs (start it with --replay-logs), --replay-logs is ignored", file=sys.stderr)
+    for name in PATH_ARGS:
+        value = getattr(args, name)
+        if isinstance(value, list):
+            setattr(args, name, [os.path.join(cwd, path) for path in value])
+        elif value:
+            setattr(args, name, os.path.join(cwd, value))
+    with contextlib.ExitStack() as stack:
+        run_cli(args, hives, stack, stdout, redirect_stdout)
+    return 0
+
+
+def serve(args):
+    from src.server import RegPyServer
+    from src.session import HiveCache
+
+    if args.replay_logs:
+        from src import replay
+        replay.enable(verify_all=args.verify_logs)
+    hives = HiveCache(max_open=args.max_open, backend=args.backend)
+    server = RegPyServer(hives, run_cli=_served_cli, max_clients=args.max_clients,
+                         idle_timeout=args.idle_timeout, verbose=args.verbose)
+    with contextlib.ExitStack() as stack:
+        ## hives given at start-up are parsed now and stay checked out, so
+        ## neither the cap nor idle eviction closes them
+        for hive_arg in HIVE_ARGS:
+            for path in getattr(args, hive_arg):
+                session = stack.enter_context(hives.checkout(path))
+                try:
+                    session.registry
+                except Exception as e:
+                    print(f"Error loading {hive_arg.upper()} hive {path}: {e}")
+        try:
+            server.serve_forever(args.listen)
+        except OSError as e:
+            print(f"Error starting server: {e}")
+
+
+def _report_profile(args, collected):
+    if args.profile or not args.profile_json:
+        print(collected.report(), file=sys.stderr)
+    if args.profile_json:
+        try:
+            with open(args.profile_json, "w") as f:
+                f.write(collected.to_json())
+        except OSError as e:
+            print(f"Error writing profile: {e}", file=sys.stderr)
+
+
+def emit(args, artifact, result):
+    """
+    Write result as NDJSON/CSV records when --json, --csv or --export is given.
+    Returns True if it did, so the caller can skip its plain text output.
+    """
+    if not args.format:
+        return False
+    from src.export import write_artifact
+    write_artifact(artifact, result, args.out, args.format, binary=args.binary)
+    return True
+
+
+## --- commands ---
+##
+## Every artifact flag is a Command in COMMANDS: when(args) says whether it
+## was asked for, hive names the hive it reads ("sam", "system", "software";
+## "any" for the first of those given, "all" for every hive given, None for
+## none) and missing is printed, before anything runs, when that hive was
+## not given (None: the command is silently skipped instead). The handlers
+## import their modules themselves.
+
+Command = namedtuple("Command", "name when hive missing run")
+
+
+def _run_batch(args):
+    from src.batch import run_batch
+
+    artifacts = args.artifacts.split(",") if args.artifacts else None
+    try:
+        summary = run_batch(args.batch, artifacts, jobs=args.jobs, output=args.batch_output)
+    except (OSError, ValueError) as e:
+        print(f"Error running batch: {e}")
+        return
+    print(f"Processed {summary['hosts']} hosts in {summary['seconds']}s "
+          f"({summary['hosts_per_second']} hosts/s): {summary['ok']} ok, {summary['failed']} with errors", file=sys.stderr)
+    for host in summary["failed_hosts"]:
+        print(f"  failed: {host}", file=sys.stderr)
+
+
+## compare a baseline hive with a suspect one
+def _run_diff(args, hive):
+    from src.diff import iter_diff
+
+    old_hive, new_hive = args.diff
+    stats = {}
+    changes = iter_diff(old_hive, new_hive, args.key or "", binary=args.binary, stats=stats)
+    try:
+        if not emit(args, "diff", changes):
+            marks = {"added": "+", "removed": "-", "modified": "~"}
+            for change in changes:
+                mark = marks[change["change"]]
+                if change["kind"] == "key":
+                    stamps = " -> ".join(t for t in (change["old"], change["new"]) if t)
+                    print(f"{mark} {change['path']}  [{stamps}]")
+                elif change["change"] == "modified":
+                    print(f"{mark} {change['path']} : {change['value']} = {change['old']} -> {change['new']}")
+                else:
+                    data = change["new"] if change["change"] == "added" else change["old"]
+                    print(f"{mark} {change['path']} : {change['value']} = {data}")
+        print(f"Compared {stats['compared']} keys, skipped {stats['skipped']} unchanged subtrees", file=sys.stderr)
+    except Exception as e:
+        print(f"Error comparing hives: {e}")
+
+
+## LastWrite timeline over every hive given
+def _run_timeline(args, hives):
+    from src.timeline import hive_label, iter_timeline
+
+    sources = [(hive_label(kind, getattr(args, kind)), getattr(args, kind))
+               for kind in ("sam", "system", "software", "security") if getattr(args, kind)]
+    sources += [(hive_label("ntuser", hive), hive) for hive in args.ntuser or []]
+    try:
+        records = iter_timeline(sources, since=args.since, until=args.until)
+        if not emit(args, "timeline", records):
+            for record in records:
+                print(f"{record['timestamp']}  {record['hive']:<12} {record['path']}")
+    except Exception as e:
+        print(f"Error building timeline: {e}")
+
+
+def _run_list_users(args, hive):
+    from src.users import get_user_names
+
+    names = get_user_names(hive, verbose=args.verbose)
+    emit(args, "users", names)
+
+
+def _run_list_accounts(args, hive):
+    from src.users import get_user_accounts
+
+    accounts = get_user_accounts(hive, verbose=args.verbose)
+    if not emit(args, "accounts", accounts):
+        print("User Accounts:")
+        print(f"{'RID':>6}  {'Name':<24}{'Last logon':<21}{'Password set':<21}{'Logons':>7}  Flags")
+        for account in accounts:
+            times = [f"{account[field]:%Y-%m-%d %H:%M:%S}" if account[field] else "never"
+                     for field in ("last_logon", "password_last_set")]
+            print(f"{account['rid']:>6}  {account['name']:<24}{times[0]:<21}{times[1]:<21}"
+                  f"{account['logon_count']:>7}  {', '.join(account['flags'])}")
+
+
+def _run_list_nics(args, hive):
+    from src.network import get_nic_names
+
+    nic_names = get_nic_names(hive)
+    if not emit(args, "nics", nic_names):
         for guid, name in nic_names.items():
             print(f"{guid}: {name}")
 
-    ## Test get_nic_details function
-    if args.nic_details:
-        if not args.system:
-            print("Please provide the SYSTEM hive path with --system to get NIC details.")
-            return
-        ##print(BANNER)
-        details = get_nic_details(args.system, args.nic_details)
+
+def _run_nic_details(args, hive):
+    from src.network import get_nic_details
+
+    details = get_nic_details(hive, args.nic_details)
+    if not emit(args, "nic_details", dict({"guid": args.nic_details}, **details)):
         print(f"Details for NIC {args.nic_details}:")
         for k, v in details.items():
             print(f"{k}: {v}")
 
-    ## test for registry list
-    if args.list_all_keys and (args.sam or args.system or args.software):
-        ##print(BANNER)
-        keys = list_all_keys_recursive(args.sam or args.system or args.software)
+
+## keys are printed as the walk reaches them instead of after it
+## --snapshot: key walks, searches and values read the hive's saved snapshot;
+## when it cannot be read or built they read the hive itself, which reports
+## a missing or corrupt hive with the same error as without --snapshot
+def _key_source(args, hive):
+    if not args.snapshot:
+        return hive
+    from Registry import RegistryParse
+    from src.snapshot import open_snapshot
+    try:
+        return open_snapshot(hive, verbose=args.verbose)
+    except (OSError, ValueError, RegistryParse.RegistryException) as e:
+        if args.verbose:
+            print(f" [Info] Reading the hive without a snapshot: {e}")
+        return hive
+
+
+def _run_list_all_keys(args, hive):
+    from src.general import iter_all_keys
+
+    keys = iter_all_keys(_key_source(args, hive), max_depth=args.max_depth, max_keys=args.max_keys, jobs=args.jobs or 1)
+    if not emit(args, "keys", keys):
         print("Registry Keys:")
         for k in keys:
             print(k)
 
-    if args.subkeys and (args.sam or args.system or args.software):
-        ##print(BANNER)
-        if len(args.subkeys) == 0:
-            print("Please specify a key with --subkeys to list its subkeys.")
-            return
-        keys = list_all_keys_recursive(args.sam or args.system or args.software, args.subkeys)
+
+## stream every key and value below --key (or the whole hive)
+def _run_export(args, hive):
+    from src.export import export_hive
+
+    count = export_hive(hive, args.out, args.format, start_key=args.key or "",
+                        max_depth=args.max_depth, max_keys=args.max_keys, binary=args.binary)
+    print(f"Exported {count} keys", file=sys.stderr)
+
+
+## deleted keys and values carved from free cells
+def _run_recover(args, hive):
+    from src.carve import export_recovered, iter_recovered
+
+    stats = {}
+    if args.format:
+        count = export_recovered(hive, args.out, args.format, binary=args.binary, stats=stats)
+    else:
+        count = 0
+        for record in iter_recovered(hive, binary=args.binary, stats=stats):
+            count += 1
+            if record["record"] == "key":
+                print(f"{record['path']}  [{record['last_write']}]  (deleted, offset 0x{record['offset']:x})")
+            elif record["record"] == "value":
+                print(f"(no key)  (deleted value, offset 0x{record['offset']:x})")
+            else:
+                print(f"(security record)  refcount {record['refcount']}, offset 0x{record['offset']:x}: {record['descriptor']}")
+            for value in record["values"]:
+                print(f"    {value['name']} ({value['type']}, {value['status']}) = {value['data']}")
+    if stats.get("bytes"):
+        print(f"Recovered {stats['keys']} keys, {stats['values']} orphan values and {stats['sk']} security records "
+              f"from {stats['free_cells']} free cells ({stats['free_bytes']} of {stats['bytes']} bytes) "
+              f"in {stats['seconds']}s", file=sys.stderr)
+
+
+## build or refresh the persistent index
+def _run_build_index(args, hive):
+    import sqlite3
+    from Registry import RegistryParse
+    from src.index import build_index
+
+    try:
+        db_path = build_index(hive, verbose=args.verbose)
+    except (OSError, sqlite3.Error, RegistryParse.RegistryException) as e:
+        print(f"Error building index: {e}")
+        return
+    print(f"Index written to {db_path}")
+
+
+def _run_subkeys(args, hive):
+    if args.use_index:
+        from src.index import list_keys_from_index
+        keys = list_keys_from_index(hive, args.subkeys)
+    else:
+        from src.general import iter_all_keys
+        keys = iter_all_keys(_key_source(args, hive), args.subkeys, max_depth=args.max_depth, max_keys=args.max_keys, jobs=args.jobs or 1)
+    if not emit(args, "keys", keys):
         print(f"Subkeys of {args.subkeys}:")
         for k in keys:
             print(k)
 
 
-    ## get the values of a specific key
-    if args.key and args.get_values and (args.sam or args.system or args.software):
-        ##print(BANNER)
-        values = get_key_values(args.sam or args.system or args.software, args.key, verbose=args.verbose)
-        if values is None:
-            print(f"Key '{args.key}' not found.")
-        else:
-            print(f"Values under key '{args.key}':")
-            for name, val in values.items():
-                print(f"{name}: {val}")
-
-    ## test for registry search
-    ## this function only searches keys for now and not values inside the registry
-    if args.search and (args.sam or args.system or args.software):
-        ##print(BANNER)
-        matches = search_keys_by_keyword(args.sam or args.system or args.software, args.search)
-        if not matches:
+## get the values of a specific key
+def _run_get_values(args, hive):
+    if args.use_index:
+        from src.index import get_key_values_from_index
+        values = get_key_values_from_index(hive, args.key, verbose=args.verbose)
+    else:
+        from src.general import get_key_values
+        values = get_key_values(_key_source(args, hive), args.key, verbose=args.verbose)
+    if values is None:
+        print(f"Key '{args.key}' not found.")
+    elif not emit(args, "key_values", values):
+        print(f"Values under key '{args.key}':")
+        for name, val in values.items():
+            print(f"{name}: {val}")
+
+
+## plain --search matches key paths only, --regex/--ioc-file/--search-values
+## also look at value names and string data
+def _value_search(args):
+    return args.regex or args.ioc_file or args.search_values
+
+
+def _run_search(args, hive):
+    if args.use_index:
+        from src.index import search_keys_from_index
+        matches = search_keys_from_index(hive, args.search)
+    else:
+        from src.general import iter_search_keys
+        matches = iter_search_keys(_key_source(args, hive), args.search, max_depth=args.max_depth, max_keys=args.max_keys, jobs=args.jobs or 1)
+    if args.max_results:
+        matches = itertools.islice(matches, args.max_results)
+    if not emit(args, "keys", matches):
+        found = 0
+        for m in matches:
+            if not found:
+                print(f"Search results for '{args.search}':")
+            found += 1
+            print(m)
+        if not found:
             print(f"No matches found for '{args.search}'")
-        else:
-            print(f"Search results for '{args.search}':")
-            for m in matches:
-                print(m)
-    
-    ## test for get_user_sids function
-    if args.user_sids:
-        if not args.software:
-            print("Please provide the SOFTWARE hive path with --software to get user SIDs.")
+
+
+## wildcard path query, compiled into a plan that only enters matching keys
+def _run_query(args, hive):
+    from src.query import compile_query, iter_query
+
+    try:
+        plan = compile_query(args.query)
+    except ValueError as e:
+        print(f"Error in query: {e}")
+        return
+    if args.verbose:
+        print(f" [Info] Query plan: {plan.describe()}")
+    matches = iter_query(_key_source(args, hive), plan, start_key=args.key or "")
+    if args.max_results:
+        matches = itertools.islice(matches, args.max_results)
+    if args.format:
+        emit(args, "query", ({"path": path, "value": name, "data": data} for path, name, data in matches))
+        return
+    found = 0
+    for path, name, data in matches:
+        found += 1
+        print(path if name is None else f"{path} : {name} = {data}")
+    if not found:
+        print(f"No matches found for '{args.query}'")
+
+
+def _run_search_values(args, hive):
+    from src.search import iter_search_values, load_indicators
+
+    keywords = [args.search] if args.search else []
+    regexes = list(args.regex or [])
+    if args.ioc_file:
+        try:
+            ioc_keywords, ioc_regexes = load_indicators(args.ioc_file)
+        except OSError as e:
+            print(f"Error reading indicator file: {e}")
             return
-        user_sids = get_user_sids(args.software, verbose=args.verbose)
+        keywords += ioc_keywords
+        regexes += ioc_regexes
+    hits = iter_search_values(hive, keywords, regexes, max_results=args.max_results, max_depth=args.max_depth)
+    if not emit(args, "search", hits):
+        found = 0
+        for hit in hits:
+            if not found:
+                print("Search results:")
+            found += 1
+            if hit["field"] == "key":
+                print(f"{hit['path']}  <- {hit['indicator']}")
+            elif hit["field"] == "name":
+                print(f"{hit['path']} : {hit['value']}  <- {hit['indicator']}")
+            else:
+                print(f"{hit['path']} : {hit['value']} = {hit['text']}  <- {hit['indicator']}")
+        if not found:
+            print("No matches found")
+
+
+def _run_user_sids(args, hive):
+    from src.users import get_user_sids
+
+    user_sids = get_user_sids(hive, verbose=args.verbose)
+    if not emit(args, "user_sids", user_sids):
         print("User SIDs:")
         for username, sid in user_sids.items():
             print(f"{username}: {sid}")
 
-    ## test for get_installed_apps function
-    if args.list_installed_applications:
-        if not args.software:
-            print("Please provide the SOFTWARE hive path with --software to list installed applications.")
-            return
-        apps = get_installed_apps(args.software, verbose=args.verbose)
+
+def _run_installed_apps(args, hive):
+    from src.general import get_installed_apps
+
+    apps = get_installed_apps(hive, verbose=args.verbose)
+    if not emit(args, "installed_apps", apps):
         print("Installed Applications:")
         if args.verbose:
             # verbose: each app is a dict with details
@@ -186,80 +672,183 @@ def main():
             for name in apps:
                 print(name)
 
-    ## test for get_shares function
-    if args.list_shares:
-        if not args.system:
-            print("Please provide the SYSTEM hive path with --system to list shares.")
-            return
-        shares = get_shares(args.system, verbose=args.verbose)
+
+def _run_shares(args, hive):
+    from src.general import get_shares
+
+    shares = get_shares(hive, verbose=args.verbose)
+    if not emit(args, "shares", shares):
         print("Shared Folders:")
         for share in shares:
             print(f"- {share}")
 
-    ## test for get_services function
-    if args.list_services:
-        if not args.system:
-            print("Please provide the SYSTEM hive path with --system to list services.")
-            return
-        services = get_services(args.system, verbose=args.verbose)
-        print("Services:")
-        for service in services:
-            print(f"- {service}")
-
-    ## test for get_service_details function
-    if args.service_details:
-        if not args.system:
-            print("Please provide the SYSTEM hive path with --system to get service details.")
-            return
-        if len(args.service_details) == 0:
-            print("Please specify a service name with --service-details to get its details.")
-            return
-        details = get_service_details(args.system, args.service_details, verbose=args.verbose)
-        if details:
-            print(f"Details for service '{args.service_details}':")
-            for k, v in details.items():
-                print(f"{k}: {v}")
-            print()
-        else:
-            print(f"Service '{args.service_details}' not found or could not retrieve details.")
 
-    ## test for get_drivers function
-    ## verbose output to be added later
-    if  args.list_drivers:
-        if not args.system:
-            print("Please provide the SYSTEM hive path with --system to list drivers.")
-            return
-        drivers = get_drivers(args.system, verbose=args.verbose)
+def _run_services(args, hive):
+    if args.start or args.drivers_only or args.image_outside:
+        from src.general import find_services
+        services = find_services(hive, start=args.start, drivers=True if args.drivers_only else None,
+                                 image_outside=args.image_outside, verbose=args.verbose)
+        if not emit(args, "services", services):
+            print("Services:")
+            for service in services:
+                print(f"- {service['name']}  [{service['start']}, {'driver' if service['driver'] else 'service'}]  {service['image_path'] or ''}")
+    else:
+        from src.general import get_services
+        services = get_services(hive, verbose=args.verbose)
+        if not emit(args, "services", services):
+            print("Services:")
+            for service in services:
+                print(f"- {service}")
+
+
+def _run_service_details(args, hive):
+    from src.general import get_service_details
+
+    details = get_service_details(hive, args.service_details, verbose=args.verbose)
+    if not details:
+        print(f"Service '{args.service_details}' not found or could not retrieve details.")
+    elif not emit(args, "service_details", dict({"service": args.service_details}, **details)):
+        print(f"Details for service '{args.service_details}':")
+        for k, v in details.items():
+            print(f"{k}: {v}")
+        print()
+
+
+## verbose output to be added later
+def _run_drivers(args, hive):
+    from src.general import get_drivers
+
+    drivers = get_drivers(hive, verbose=args.verbose)
+    if not emit(args, "drivers", drivers):
         print("Drivers:")
         for driver in drivers:
             print(f"- {driver}")
 
-    ## test for get_windows_version function
 
-    if args.winver:
-        if not args.software:
-            print("Please provide the SOFTWARE hive path with --software to get Windows version.")
-            return
-        ##
+def _run_winver(args, hive):
+    from src.general import get_windows_version
+
+    if not args.format:
         print(BANNER)
-        data = get_windows_version(args.software, verbose=args.verbose)
-        if data:
-            print(f"Windows Version Information\n")
-            for k, v in data.items():
-                print(f"{k}: {v}")
-            print()
-        else:
-            print("Windows version information not found.")
+    data = get_windows_version(hive, verbose=args.verbose)
+    if not data:
+        print("Windows version information not found.")
+    elif not emit(args, "winver", data):
+        print(f"Windows Version Information\n")
+        for k, v in data.items():
+            print(f"{k}: {v}")
+        print()
 
-    ## test for get_dns_servers function
-    if args.list_dns:
-        if not args.system:
-            print("Please provide the SYSTEM hive path with --system to list DNS servers.")
-            return
-        dns_servers = get_dns_servers(args.system)
+
+def _run_dns(args, hive):
+    from src.network import get_dns_servers
+
+    dns_servers = get_dns_servers(hive)
+    if not emit(args, "dns", dns_servers):
         print("DNS Servers:")
         for guid, servers in dns_servers.items():
             print(f"{guid}: {', '.join(servers)}")
 
+
+def _missing(hive, action):
+    return f"Please provide the {hive.upper()} hive path with --{hive} to {action}."
+
+
+COMMANDS = (
+    Command("diff", lambda args: args.diff, None, None, _run_diff),
+    Command("timeline", lambda args: args.timeline, "all",
+            "Please provide at least one hive (--sam, --system, --software, --security, --ntuser) for --timeline.",
+            _run_timeline),
+    Command("users", lambda args: args.list_users, "sam", _missing("sam", "list user accounts"), _run_list_users),
+    Command("accounts", lambda args: args.list_accounts, "sam", _missing("sam", "list account records"),
+            _run_list_accounts),
+    Command("nics", lambda args: args.list_nics, "system", _missing("system", "list network interfaces"), _run_list_nics),
+    Command("nic_details", lambda args: args.nic_details, "system", _missing("system", "get NIC details"), _run_nic_details),
+    Command("keys", lambda args: args.list_all_keys, "any", None, _run_list_all_keys),
+    Command("export", lambda args: args.export, "any", None, _run_export),
+    Command("recover", lambda args: args.recover, "any", None, _run_recover),
+    Command("build_index", lambda args: args.build_index, "any", None, _run_build_index),
+    Command("subkeys", lambda args: args.subkeys, "any", None, _run_subkeys),
+    Command("key_values", lambda args: args.key and args.get_values, "any", None, _run_get_values),
+    Command("search", lambda args: args.search and not _value_search(args), "any", None, _run_search),
+    Command("search_values", _value_search, "any", None, _run_search_values),
+    Command("query", lambda args: args.query, "any", None, _run_query),
+    Command("user_sids", lambda args: args.user_sids, "software", _missing("software", "get user SIDs"), _run_user_sids),
+    Command("installed_apps", lambda args: args.list_installed_applications, "software",
+            _missing("software", "list installed applications"), _run_installed_apps),
+    Command("shares", lambda args: args.list_shares, "system", _missing("system", "list shares"), _run_shares),
+    Command("services", lambda args: args.list_services, "system", _missing("system", "list services"), _run_services),
+    Command("service_details", lambda args: args.service_details, "system",
+            _missing("system", "get service details"), _run_service_details),
+    Command("drivers", lambda args: args.list_drivers, "system", _missing("system", "list drivers"), _run_drivers),
+    Command("winver", lambda args: args.winver, "software", _missing("software", "get Windows version"), _run_winver),
+    Command("dns", lambda args: args.list_dns, "system", _missing("system", "list DNS servers"), _run_dns),
+)
+
+
+def _command_hive(args, kind):
+    if kind == "any":
+        return args.sam or args.system or args.software
+    if kind == "all":
+        hives = [getattr(args, name) for name in ("sam", "system", "software", "security") if getattr(args, name)]
+        return hives + list(args.ntuser or [])
+    return getattr(args, kind) if kind else None
+
+
+def _sessions(hive):
+    return hive if isinstance(hive, list) else [hive] if hive is not None else []
+
+
+def schedule_commands(args):
+    """
+    The commands asked for in args as a list of passes, each a list of
+    (command, hive): commands reading the same hive run together, in one
+    pass over it, and passes come in the order of their first command in
+    COMMANDS. Returns None if a command's hive is missing (after saying so).
+    """
+    passes = OrderedDict()
+    for command in COMMANDS:
+        if not command.when(args):
+            continue
+        hive = _command_hive(args, command.hive)
+        if command.hive and not hive:
+            if command.missing:
+                print(command.missing)
+                return None
+            continue
+        ## diff and timeline read several hives, they get a pass of their own
+        key = hive if command.hive in ("sam", "system", "software", "any") else command.name
+        passes.setdefault(key, []).append((command, hive))
+    return list(passes.values())
+
+
+def run_flags(args, release=False):
+    """
+    Run every command asked for in args, one pass per hive (see
+    schedule_commands). With release, a hive is closed after the last
+    pass that reads it.
+    """
+    ## batch mode over many host collections
+    if args.batch:
+        _run_batch(args)
+        return
+
+    passes = schedule_commands(args)
+    if passes is None:
+        return
+    last_pass = {}
+    for number, commands in enumerate(passes):
+        for _, hive in commands:
+            for session in _sessions(hive):
+                last_pass[session] = number
+    for number, commands in enumerate(passes):
+        for command, hive in commands:
+            command.run(args, hive)
+        if release:
+            for session, last in last_pass.items():
+                if last == number:
+                    session.close()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
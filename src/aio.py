@@ -0,0 +1,275 @@
+import asyncio
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import os
+import threading
+import time
+
+from src.options import load
+from src.session import HiveCache, HiveSession
+
+
+## asyncio facade over the artifact functions.
+##
+## The functions in src/ are blocking, so AsyncRegPy runs them in a bounded
+## thread pool (max_workers) and awaits the result; the event loop never
+## parses a hive itself. Hives are opened through one shared HiveCache, so
+## every call on the same file reuses one parse of it, and at most per_hive
+## calls run on a given hive at a time (an asyncio.Semaphore per file):
+## with hundreds of hives queried at once the pool is shared fairly instead
+## of being taken over by a single hive.
+##
+## Key walks, searches, diffs and timelines are async generators. A worker
+## thread runs the blocking generator and hands its items over in chunks
+## through a bounded asyncio.Queue: when the consumer falls behind, the
+## queue fills up and the worker blocks until there is room again, so
+## memory stays bounded however large the hive. A stream holds its worker
+## (and its hive's slot) until it is exhausted or closed: to stop early,
+## close it (aclose(), or `async with contextlib.aclosing(...)` around the
+## loop) rather than leaving it to the garbage collector.
+
+MAX_WORKERS = 8
+PER_HIVE = 2
+CHUNK_SIZE = 256
+MAX_PENDING = 8
+FLUSH_SECONDS = 0.05
+
+## method name -> ("module:function", number of leading hive arguments)
+AWAITABLE = {
+    "get_user_names": ("src.users:get_user_names", 1),
+    "get_user_accounts": ("src.users:get_user_accounts", 1),
+    "get_user_sids": ("src.users:get_user_sids", 1),
+    "get_nic_names": ("src.network:get_nic_names", 1),
+    "get_nic_details": ("src.network:get_nic_details", 1),
+    "get_dns_servers": ("src.network:get_dns_servers", 1),
+    "get_installed_apps": ("src.general:get_installed_apps", 1),
+    "get_shares": ("src.general:get_shares", 1),
+    "get_services": ("src.general:get_services", 1),
+    "find_services": ("src.general:find_services", 1),
+    "get_service_details": ("src.general:get_service_details", 1),
+    "get_drivers": ("src.general:get_drivers", 1),
+    "get_windows_version": ("src.general:get_windows_version", 1),
+    "get_key_values": ("src.general:get_key_values", 1),
+    "list_all_keys_recursive": ("src.general:list_all_keys_recursive", 1),
+    "search_keys_by_keyword": ("src.general:search_keys_by_keyword", 1),
+    "search_values": ("src.search:search_values", 1),
+    "query_values": ("src.query:query_values", 1),
+    "diff_hives": ("src.diff:diff_hives", 2),
+    "build_index": ("src.index:build_index", 1),
+    "list_keys_from_index": ("src.index:list_keys_from_index", 1),
+    "search_keys_from_index": ("src.index:search_keys_from_index", 1),
+    "get_key_values_from_index": ("src.index:get_key_values_from_index", 1),
+    "recover_deleted": ("src.carve:recover_deleted", 1),
+}
+
+## async generator name -> ("module:function", number of leading hive arguments)
+STREAMS = {
+    "iter_all_keys": ("src.general:iter_all_keys", 1),
+    "iter_search_keys": ("src.general:iter_search_keys", 1),
+    "iter_search_values": ("src.search:iter_search_values", 1),
+    "iter_query": ("src.query:iter_query", 1),
+    "iter_diff": ("src.diff:iter_diff", 2),
+    "iter_recovered": ("src.carve:iter_recovered", 1),
+}
+
+## end of a stream
+_DONE = object()
+
+
+class _Failed(object):
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _hive_key(hive):
+    return os.path.realpath(hive.hive_path if isinstance(hive, HiveSession) else hive)
+
+
+class AsyncRegPy(object):
+    """
+    Awaitable artifact functions over a shared HiveCache, e.g.
+
+        async with AsyncRegPy(max_workers=16) as regpy:
+            apps = await regpy.get_installed_apps("/cases/h1/SOFTWARE")
+            async for key in regpy.iter_all_keys("/cases/h1/SYSTEM"):
+                ...
+
+    Every function of AWAITABLE and STREAMS is a method taking the same
+    arguments as the blocking function, hives given as paths or HiveSessions.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, per_hive=PER_HIVE, max_open=64, backend="registry",
+                 chunk_size=CHUNK_SIZE, max_pending=MAX_PENDING):
+        self.per_hive = per_hive
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.hives = HiveCache(max_open=max_open, backend=backend)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="regpy-aio")
+        ## real path -> [semaphore, tasks using it]
+        self._slots = {}
+
+    ## --- per-hive limit ---
+
+    @contextlib.asynccontextmanager
+    async def _hive_slots(self, hives):
+        ## always taken in the same order, so two multi-hive calls never
+        ## wait on each other's hives
+        taken = []
+        try:
+            for key in sorted({_hive_key(hive) for hive in hives}):
+                slot = self._slots.setdefault(key, [asyncio.Semaphore(self.per_hive), 0])
+                slot[1] += 1
+                try:
+                    await slot[0].acquire()
+                except BaseException:
+                    self._unref(key)
+                    raise
+                taken.append(key)
+            yield
+        finally:
+            for key in reversed(taken):
+                self._slots[key][0].release()
+                self._unref(key)
+
+    def _unref(self, key):
+        slot = self._slots[key]
+        slot[1] -= 1
+        if not slot[1]:
+            del self._slots[key]
+
+    ## --- running blocking code ---
+
+    async def _submit(self, fn, *args):
+        future = self._executor.submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            if not future.done():
+                ## cancelled while running: the hive stays taken until the thread is done
+                await asyncio.wait([asyncio.wrap_future(future)])
+
+    def _call(self, fn, hives, args, kwargs):
+        with contextlib.ExitStack() as stack:
+            sessions = [stack.enter_context(self.hives.checkout(hive)) for hive in hives]
+            result = fn(*sessions, *args, **kwargs)
+            if isinstance(result, Iterator):
+                result = list(result)
+            return result
+
+    async def run(self, fn, hives, *args, **kwargs):
+        """
+        Await fn(*sessions, *args, **kwargs) on a worker thread, where
+        sessions are the HiveSessions of hives. fn is a function or a
+        "module:function" name; an iterator result is turned into a list.
+        """
+        if isinstance(fn, str):
+            fn = load(fn)
+        async with self._hive_slots(hives):
+            return await self._submit(self._call, fn, hives, args, kwargs)
+
+    def _produce(self, loop, queue, stop, fn, hives, args, kwargs):
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        try:
+            with contextlib.ExitStack() as stack:
+                sessions = [stack.enter_context(self.hives.checkout(hive)) for hive in hives]
+                items = fn(*sessions, *args, **kwargs)
+                stack.callback(getattr(items, "close", lambda: None))
+                chunk = []
+                flushed = time.monotonic()
+                for item in items:
+                    chunk.append(item)
+                    ## a slow walk still hands over what it has every FLUSH_SECONDS
+                    if len(chunk) >= self.chunk_size or time.monotonic() - flushed >= FLUSH_SECONDS:
+                        put(chunk)
+                        if stop.is_set():
+                            return
+                        chunk = []
+                        flushed = time.monotonic()
+                if chunk:
+                    put(chunk)
+            put(_DONE)
+        except Exception as e:
+            if not stop.is_set():
+                put(_Failed(e))
+
+    async def stream(self, fn, hives, *args, **kwargs):
+        """
+        Async generator over fn(*sessions, *args, **kwargs), run on a worker
+        thread with at most max_pending chunks of items waiting to be read.
+        """
+        if isinstance(fn, str):
+            fn = load(fn)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.max_pending)
+        stop = threading.Event()
+        async with self._hive_slots(hives):
+            producer = self._executor.submit(self._produce, loop, queue, stop, fn, hives, args, kwargs)
+            try:
+                while True:
+                    chunk = await queue.get()
+                    if chunk is _DONE:
+                        break
+                    if isinstance(chunk, _Failed):
+                        raise chunk.error
+                    for item in chunk:
+                        yield item
+            finally:
+                ## make room for the worker's last put, then wait for it to stop
+                stop.set()
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.wait([asyncio.wrap_future(producer)])
+
+    async def iter_timeline(self, hives, since=None, until=None, **kwargs):
+        """Async version of src.timeline.iter_timeline; hives is a list of (label, hive)."""
+        labels = [label for label, _ in hives]
+        iter_timeline = load("src.timeline:iter_timeline")
+
+        def timeline(*sessions):
+            return iter_timeline(list(zip(labels, sessions)), since=since, until=until, **kwargs)
+
+        async for record in self.stream(timeline, [hive for _, hive in hives]):
+            yield record
+
+    ## --- lifetime ---
+
+    def close(self):
+        """Wait for running calls and close every hive."""
+        self._executor.shutdown(wait=True)
+        self.hives.close()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+def _awaitable(name, target, hive_count):
+    async def method(self, *args, **kwargs):
+        return await self.run(target, args[:hive_count], *args[hive_count:], **kwargs)
+    method.__name__ = name
+    method.__doc__ = f"Awaitable {target.replace(':', '.')}."
+    return method
+
+
+def _async_stream(name, target, hive_count):
+    def method(self, *args, **kwargs):
+        return self.stream(target, args[:hive_count], *args[hive_count:], **kwargs)
+    method.__name__ = name
+    method.__doc__ = f"Async generator over {target.replace(':', '.')}."
+    return method
+
+
+for _name, (_target, _count) in AWAITABLE.items():
+    setattr(AsyncRegPy, _name, _awaitable(_name, _target, _count))
+for _name, (_target, _count) in STREAMS.items():
+    setattr(AsyncRegPy, _name, _async_stream(_name, _target, _count))
@@ -0,0 +1,292 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+
+## Hives read straight out of triage archives.
+##
+## A hive source "archive::member" names a member of a zip or tar (plain,
+## gz, bz2 or xz) archive, e.g.
+##
+##     --system triage.zip::C/Windows/System32/config/SYSTEM
+##
+## Members are matched with either slash and case-insensitively, as the
+## paths of a Windows collection are, and the drive folder collection tools
+## put on top ("C/", "C%3A/") may be left out. The member is decompressed
+## once into memory (up to MEMORY_LIMIT) or into an unnamed temporary file,
+## which the mmap backend maps like any hive file, and handed to the parser
+## without being extracted anywhere.
+##
+## Each archive is opened once per process and its member list kept, so
+## several hives of one archive share one open file. A compressed tar
+## cannot seek and listing it already decompresses all of it, so the hives
+## a run needs are announced first with prefetch() and kept from that one
+## listing pass; members nobody announced are read with a second pass.
+##
+## find_logs() returns the transaction logs (<hive>.LOG1, .LOG2, .LOG) that
+## sit beside a hive, in an archive or on disk, as sources of the same kind.
+
+SEPARATOR = "::"
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+MEMORY_LIMIT = 256 << 20
+COPY_CHUNK = 1 << 20
+LOG_SUFFIXES = (".LOG1", ".LOG2", ".LOG")
+
+## first bytes of the compressed tar formats
+_STREAM_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+
+_archives = {}
+_wanted = {}
+_lock = threading.Lock()
+
+
+def is_member(source):
+    return isinstance(source, str) and SEPARATOR in source
+
+
+def is_archive(path):
+    """True for a file whose name says it is an archive regpy can read hives from."""
+    return path.lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+
+def archive_stem(path):
+    """File name of an archive without its suffix, e.g. "HOST01" for HOST01.tar.gz."""
+    name = os.path.basename(path)
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def split_source(source):
+    """(archive path, member) of an "archive::member" source, (source, None) otherwise."""
+    if not is_member(source):
+        return source, None
+    archive, _, member = source.partition(SEPARATOR)
+    return archive, member
+
+
+def _normalize(name):
+    name = name.replace("\\", "/")
+    while name.startswith(("/", "./")):
+        name = name[2:] if name.startswith("./") else name[1:]
+    return name.lower()
+
+
+def _matches(name, wanted):
+    return name == wanted or name.endswith("/" + wanted)
+
+
+class MemberBuffer(object):
+    """An archive member read into memory; read() hands the bytes over without a copy."""
+
+    __slots__ = ("name", "_data")
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class Archive(object):
+    """
+    A zip or tar archive opened once: its member list and access to each
+    member. wanted are members (as given in sources) to keep from the
+    listing pass of a compressed tar.
+    """
+
+    def __init__(self, path, wanted=()):
+        import tarfile
+        import zipfile
+
+        self.path = path
+        st = os.stat(path)
+        self.version = (st.st_size, st.st_mtime_ns)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._zip = self._tar = None
+        self._kept = {}
+        ## member name -> (size, "identity" text used for fingerprints)
+        self.members = {}
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    self.members[info.filename] = (info.file_size, f"crc {info.CRC:08x} {info.date_time}")
+        else:
+            with open(path, "rb") as f:
+                sequential = f.read(6).startswith(_STREAM_MAGIC)
+            if sequential:
+                ## one streaming pass lists the archive and keeps the wanted hives
+                wanted = [_normalize(member) for member in wanted]
+                with tarfile.open(path, "r|*") as stream:
+                    for info in stream:
+                        if info.isfile():
+                            self.members[info.name] = (info.size, f"tar {info.chksum} {info.mtime}")
+                            name = _normalize(info.name)
+                            if any(_matches(name, member) for member in wanted):
+                                self._kept[info.name] = _copy(stream.extractfile(info), info.size)
+            else:
+                self._open_tar()
+        self._names = {}
+        for name in self.members:
+            self._names.setdefault(_normalize(name), name)
+
+    def _open_tar(self):
+        import tarfile
+        self._tar = tarfile.open(self.path, "r:*")
+        self._infos = {}
+        for info in self._tar.getmembers():
+            if info.isfile():
+                self._infos[info.name] = info
+                self.members[info.name] = (info.size, f"tar {info.chksum} {info.mtime}")
+
+    def resolve(self, member):
+        """
+        Stored name of a member given in any case, with / or \\ separators,
+        with or without the archive's top folder when only one member matches.
+        """
+        wanted = _normalize(member)
+        name = self._names.get(wanted)
+        if name is None:
+            matches = [stored for lowered, stored in self._names.items() if _matches(lowered, wanted)]
+            if len(matches) != 1:
+                reason = "is ambiguous" if matches else "not found"
+                raise FileNotFoundError(f"'{member}' {reason} in {self.path}")
+            name = matches[0]
+        return name
+
+    def names(self):
+        return list(self.members)
+
+    def read(self, name):
+        """The member's data, bytes or (above MEMORY_LIMIT) a temporary file."""
+        with self._lock:
+            data = self._kept.pop(name, None)
+            if data is not None:
+                return data
+            if self._zip is not None:
+                with self._zip.open(name) as f:
+                    return _copy(f, self.members[name][0])
+            if self._tar is None:
+                self._open_tar()
+            return _copy(self._tar.extractfile(self._infos[name]), self.members[name][0])
+
+    def close(self):
+        for f in (self._zip, self._tar):
+            if f is not None:
+                f.close()
+        self._kept.clear()
+
+
+def _copy(f, size):
+    if size <= MEMORY_LIMIT:
+        return f.read()
+    spool = tempfile.TemporaryFile(prefix="regpy-hive-")
+    shutil.copyfileobj(f, spool, COPY_CHUNK)
+    spool.seek(0)
+    return spool
+
+
+def open_archive(path):
+    """The Archive at path, opened on first use and kept until it changes on disk or close_archives()."""
+    key = os.path.realpath(path)
+    st = os.stat(key)
+    with _lock:
+        archive = _archives.get(key)
+        if archive is not None and archive.version == (st.st_size, st.st_mtime_ns) and archive.pid == os.getpid():
+            return archive
+        ## a pool worker forked after the parent opened it must not share
+        ## the parent's file offset
+        if archive is not None and archive.pid == os.getpid():
+            archive.close()
+        archive = _archives[key] = Archive(key, _wanted.pop(key, ()))
+        return archive
+
+
+def close_archives():
+    with _lock:
+        for archive in _archives.values():
+            if archive.pid == os.getpid():
+                archive.close()
+        _archives.clear()
+        _wanted.clear()
+
+
+def prefetch(sources):
+    """
+    Announce the archive members a run may read, before their archives are
+    opened, so that a compressed tar is decompressed only once.
+    """
+    with _lock:
+        for source in sources:
+            if is_member(source):
+                archive_path, member = split_source(source)
+                _wanted.setdefault(os.path.realpath(archive_path), set()).add(member)
+
+
+def read_member(source):
+    """Data of an "archive::member" source: bytes, or a temporary file for large members."""
+    archive_path, member = split_source(source)
+    archive = open_archive(archive_path)
+    return archive.read(archive.resolve(member))
+
+
+def open_source(source):
+    """
+    Something a parser can read a hive from: the path itself for a plain
+    file, a MemberBuffer or temporary file for an archive member.
+    """
+    if not is_member(source):
+        return source
+    data = read_member(source)
+    return MemberBuffer(source, data) if isinstance(data, bytes) else data
+
+
+def source_stat(source):
+    """os.stat of the file holding a hive: the archive for a member."""
+    return os.stat(split_source(source)[0])
+
+
+def member_size(source):
+    archive_path, member = split_source(source)
+    archive = open_archive(archive_path)
+    return archive.members[archive.resolve(member)][0]
+
+
+def member_digest(source):
+    """Digest of a member from the archive's own record of it (CRC or tar checksum), nothing is decompressed."""
+    archive_path, member = split_source(source)
+    archive = open_archive(archive_path)
+    name = archive.resolve(member)
+    size, identity = archive.members[name]
+    text = f"{name}|{size}|{identity}|{archive.version[0]}"
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def find_logs(source):
+    """Sources of the transaction logs beside a hive (LOG1, LOG2, LOG), in that order."""
+    archive_path, member = split_source(source)
+    logs = []
+    if member is None:
+        directory, base = os.path.split(os.path.abspath(source))
+        try:
+            names = {name.lower(): name for name in os.listdir(directory)}
+        except OSError:
+            return []
+        for suffix in LOG_SUFFIXES:
+            name = names.get((base + suffix).lower())
+            if name is not None:
+                logs.append(os.path.join(directory, name))
+        return logs
+    archive = open_archive(archive_path)
+    hive = _normalize(archive.resolve(member))
+    for suffix in LOG_SUFFIXES:
+        name = archive._names.get(hive + suffix.lower())
+        if name is not None:
+            logs.append(f"{archive_path}{SEPARATOR}{name}")
+    return logs
@@ -0,0 +1,206 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import sys
+import time
+
+from src.archive import SEPARATOR, archive_stem, close_archives, is_archive, open_archive, prefetch
+from src.export import utc_isoformat
+from src.options import ARTIFACTS, load
+from src.replay import close_views
+from src.session import HiveCache
+
+
+## Batch mode: run artifact extractors over many host collections at once.
+##
+## A collection is a directory holding one host's hives (anywhere below it,
+## e.g. Windows/System32/config/SYSTEM and Users/*/NTUSER.DAT), a zip or
+## tar triage package holding them (read in place, see src.archive) or an
+## entry in a JSON/CSV manifest. Hosts are processed in a process pool; each host
+## opens its hives once through a HiveCache, and anything an extractor
+## prints (errors included) is captured into that host's record instead of
+## the console. One JSON line per host goes to the output.
+
+HIVE_KINDS = ("sam", "system", "software", "security", "ntuser")
+HIVE_FILES = {"sam": "sam", "system": "system", "software": "software",
+              "security": "security", "ntuser.dat": "ntuser"}
+
+## artifact name -> (hive kind, "module:function"), see src.options
+EXTRACTORS = ARTIFACTS
+
+
+def _host_files(host):
+    ## (path, file name) of every file of a host directory or archive
+    if is_archive(host):
+        for name in sorted(open_archive(host).names()):
+            yield f"{host}{SEPARATOR}{name}", name.rsplit("/", 1)[-1]
+        return
+    for dirpath, dirnames, filenames in os.walk(host):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            yield os.path.join(dirpath, filename), filename
+
+
+def find_hives(host_dir):
+    """Map hive kind to path for every hive file below a host directory or inside a host archive."""
+    hives = {}
+    for path, filename in _host_files(host_dir):
+        kind = HIVE_FILES.get(filename.lower())
+        if kind is None:
+            continue
+        if kind == "ntuser":
+            hives.setdefault("ntuser", []).append(path)
+        else:
+            hives.setdefault(kind, path)
+    return hives
+
+
+def _manifest_hosts(manifest_path):
+    base = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        return path if os.path.isabs(path) else os.path.join(base, path)
+
+    if manifest_path.lower().endswith(".csv"):
+        with open(manifest_path, newline="") as f:
+            entries = list(csv.DictReader(f))
+    else:
+        with open(manifest_path) as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = [dict(hives, host=host) for host, hives in entries.items()]
+
+    hosts = []
+    for entry in entries:
+        hives = {}
+        for kind in HIVE_KINDS:
+            paths = entry.get(kind)
+            if not paths:
+                continue
+            if kind == "ntuser":
+                paths = paths if isinstance(paths, list) else paths.split(";")
+                hives[kind] = [resolve(p) for p in paths]
+            else:
+                hives[kind] = resolve(paths)
+        hosts.append((entry["host"], hives))
+    return hosts
+
+
+def discover_hosts(source):
+    """
+    Return [(host, {kind: path})] from a collections directory, a triage
+    archive or a manifest. A directory whose own tree holds hives and no host
+    subdirectories or archives is one host; an archive is named by its file name.
+    """
+    if os.path.isfile(source) and not is_archive(source):
+        return _manifest_hosts(source)
+    try:
+        return _collection_hosts(source)
+    finally:
+        ## the hosts open them again, announcing the hives they read first
+        close_archives()
+
+
+def _collection_hosts(source):
+    if is_archive(source):
+        return [(archive_stem(source), find_hives(source))]
+
+    hosts = []
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if os.path.isdir(path) or is_archive(path):
+            hives = find_hives(path)
+            if hives:
+                hosts.append((archive_stem(name) if is_archive(path) else name, hives))
+    if not hosts:
+        hives = find_hives(source)
+        if hives:
+            hosts.append((os.path.basename(os.path.abspath(source)), hives))
+    return hosts
+
+
+def run_host(host, hives, artifacts):
+    """
+    Run the selected extractors against one host. Never raises: failures are
+    recorded in the returned record.
+    """
+    record = {"host": host, "hives": hives, "results": {}, "skipped": [], "errors": [], "messages": ""}
+    start = time.perf_counter()
+    output = io.StringIO()
+    try:
+        prefetch(path for paths in hives.values() for path in (paths if isinstance(paths, list) else [paths]))
+        with HiveCache() as cache, contextlib.redirect_stdout(output):
+            for artifact in artifacts:
+                kind, target = EXTRACTORS[artifact]
+                hive_path = hives.get(kind)
+                if not hive_path:
+                    record["skipped"].append(f"{artifact}: no {kind.upper()} hive")
+                    continue
+                try:
+                    record["results"][artifact] = load(target)(cache.get(hive_path))
+                except Exception as e:
+                    record["errors"].append(f"{artifact}: {e}")
+    except Exception as e:
+        record["errors"].append(f"host: {e}")
+    finally:
+        close_views()
+        close_archives()
+    record["messages"] = output.getvalue()
+    ## the extractors report their own failures by printing "Error ..."
+    record["errors"].extend(line for line in record["messages"].splitlines() if line.startswith("Error"))
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _json_default(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.hex()
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return utc_isoformat(obj)
+    return str(obj)
+
+
+def run_batch(source, artifacts=None, jobs=None, output=None):
+    """
+    Run artifacts (default: all) over every host found in source and write one
+    JSON line per host to output (a path, a file object, or stdout), with
+    jobs worker processes (default: one per CPU). Returns a summary dict.
+    """
+    artifacts = list(artifacts or EXTRACTORS)
+    unknown = [a for a in artifacts if a not in EXTRACTORS]
+    if unknown:
+        raise ValueError(f"unknown artifacts: {', '.join(unknown)} (choose from {', '.join(EXTRACTORS)})")
+
+    hosts = discover_hosts(source)
+    jobs = jobs or os.cpu_count() or 1
+    summary = {"hosts": len(hosts), "ok": 0, "failed": 0, "failed_hosts": []}
+
+    out = open(output, "w", buffering=1 << 16) if isinstance(output, str) else (output or sys.stdout)
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(run_host, host, hives, artifacts): host for host, hives in hosts}
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except Exception as e:
+                    ## the worker itself died (e.g. out of memory)
+                    record = {"host": futures[future], "results": {}, "errors": [f"worker: {e}"]}
+                if record["errors"]:
+                    summary["failed"] += 1
+                    summary["failed_hosts"].append(record["host"])
+                else:
+                    summary["ok"] += 1
+                out.write(json.dumps(record, default=_json_default) + "\n")
+    finally:
+        if isinstance(output, str):
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    summary["seconds"] = round(elapsed, 3)
+    summary["hosts_per_second"] = round(len(hosts) / elapsed, 2) if elapsed else 0.0
+    return summary
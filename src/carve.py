@@ -0,0 +1,379 @@
+from bisect import bisect_right
+import struct
+import sys
+import time
+
+from Registry import RegistryParse
+
+from src.export import RecordWriter, encode_data, utc_isoformat
+from src.metrics import measured
+from src.regf import _TYPE_NAMES, HBIN_START, RegfError, RegfHive
+from src.session import open_hive
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+## Recovery of deleted keys and values from unallocated cells.
+##
+## A deleted key's cells are only marked free (their size turns positive)
+## and keep their bytes until they are reused, and Windows merges adjacent
+## free cells, so one free cell can hold several old records. Records start
+## 4 bytes into a cell and cells are 8-byte aligned, so old records can only
+## begin at offsets = 4 (mod 8).
+##
+## The scan has three steps:
+##   1. walk the cell headers of every hbin and collect the free cells;
+##   2. find the nk/vk/sk signatures at aligned offsets in the free bytes
+##      with whole-buffer operations (NumPy when it is installed, otherwise
+##      strided slices, bytes.translate and a big-int AND), never a Python
+##      loop per byte, over batches of about SCAN_CHUNK bytes so memory
+##      does not grow with the hive;
+##   3. validate each candidate against the bounds of its free cell (name
+##      lengths, timestamps, value types) and decode it in place.
+## Carved keys get the path of their parent chain (live or carved), or a
+## path starting with "[unknown]" where the chain is broken, and take the
+## carved values their value list still points to; the other carved values
+## are reported alone. Records have the layout of src.export's key records,
+## so they are written the same way as live keys.
+
+SIGNATURES = (b"nk", b"vk", b"sk")
+CSV_FIELDS = ("record", "offset", "path", "last_write", "value", "type", "data", "status", "refcount", "descriptor")
+UNKNOWN_PARENT = "[unknown]"
+MAX_PATH_DEPTH = 512
+## free cells are scanned this many bytes at a time: small cells are copied
+## end to end into one batch, a cell this big is scanned in place
+SCAN_CHUNK = 1 << 20
+
+## FILETIMEs of 1990-01-01 and 2100-01-01: carved keys outside are rejected
+_FILETIME_MIN = 119600064000000000
+_FILETIME_MAX = 159358464000000000
+
+_i32 = struct.Struct("<i").unpack_from
+_u16 = struct.Struct("<H").unpack_from
+_u32 = struct.Struct("<I").unpack_from
+_u64 = struct.Struct("<Q").unpack_from
+
+## bytes.translate tables for the pure-Python candidate scan
+_FIRST = bytes(1 if chr(b) in "nvs" else 0 for b in range(256))
+_SECOND = bytes(1 if b == ord("k") else 0 for b in range(256))
+
+
+def free_cells(buf):
+    """[(start, end)] absolute offsets of every free cell (header included), in file order."""
+    size = len(buf)
+    end = min(size, HBIN_START + _u32(buf, 0x28)[0]) if size >= 0x2C else size
+    cells = []
+    hbin = HBIN_START
+    while hbin + 0x20 <= end:
+        if buf[hbin:hbin + 4] != b"hbin":
+            ## damaged hbin header: try the next 4k page
+            hbin += 0x1000
+            continue
+        hbin_end = min(hbin + (_u32(buf, hbin + 8)[0] or 0x1000), end)
+        cell = hbin + 0x20
+        while cell + 4 <= hbin_end:
+            cell_size = _i32(buf, cell)[0]
+            length = abs(cell_size)
+            if length < 8 or length & 7 or cell + length > hbin_end:
+                break
+            if cell_size > 0:
+                cells.append((cell, cell + length))
+            cell += length
+        hbin = max(hbin_end, hbin + 0x1000)
+    return cells
+
+
+def _aligned_hits(data):
+    """Offsets = 4 (mod 8) in data where an nk/vk/sk signature starts."""
+    if numpy is not None:
+        array = numpy.frombuffer(data, dtype=numpy.uint8)
+        count = (len(array) - 4) // 8
+        first, second = array[4::8][:count], array[5::8][:count]
+        hits = numpy.flatnonzero((second == ord("k")) & numpy.isin(first, (ord("n"), ord("v"), ord("s"))))
+        return (hits * 8 + 4).tolist()
+    count = (len(data) - 4) // 8
+    if count <= 0:
+        return []
+    first = bytes(data[4::8][:count]).translate(_FIRST)
+    second = bytes(data[5::8][:count]).translate(_SECOND)
+    both = (int.from_bytes(first, "little") & int.from_bytes(second, "little")).to_bytes(count, "little")
+    hits = []
+    index = both.find(1)
+    while index >= 0:
+        hits.append(index * 8 + 4)
+        index = both.find(1, index + 1)
+    return hits
+
+
+def _scan_batch(view, cells, candidates):
+    ## the cells are copied end to end; every cell is 8-byte aligned and a
+    ## multiple of 8 long, so the copy keeps each record's alignment
+    starts = []
+    position = 0
+    for start, end in cells:
+        starts.append(position)
+        position += end - start
+    data = b"".join([view[start:end] for start, end in cells])
+    for hit in _aligned_hits(data):
+        index = bisect_right(starts, hit) - 1
+        start, end = cells[index]
+        candidates.append((start + hit - starts[index], end))
+
+
+def find_candidates(buf, cells):
+    """
+    [(offset, cell end)] for every aligned nk/vk/sk signature inside the
+    given free cells, offset being the absolute offset of the record.
+    """
+    view = memoryview(buf)
+    candidates = []
+    batch = []
+    size = 0
+    for start, end in cells:
+        if end - start >= SCAN_CHUNK:
+            ## in file order: the smaller cells before it go first
+            if batch:
+                _scan_batch(view, batch, candidates)
+                batch, size = [], 0
+            candidates.extend((start + hit, end) for hit in _aligned_hits(view[start:end]))
+            continue
+        batch.append((start, end))
+        size += end - start
+        if size >= SCAN_CHUNK:
+            _scan_batch(view, batch, candidates)
+            batch, size = [], 0
+    if batch:
+        _scan_batch(view, batch, candidates)
+    return candidates
+
+
+def _text(raw, compressed):
+    return raw.decode("windows-1252" if compressed else "utf-16le")
+
+
+class _Carver(object):
+    """Validates and decodes candidate records of one hive buffer."""
+
+    def __init__(self, regf):
+        self.regf = regf
+        self.buf = regf.buffer
+        self.size = len(self.buf)
+        self._paths = {}
+
+    def cell(self, relative):
+        offset = HBIN_START + relative + 4
+        return offset if relative != 0xFFFFFFFF and offset + 4 <= self.size else None
+
+    def nk(self, offset, end):
+        """(name, flags, timestamp) of a plausible nk record, else None."""
+        buf = self.buf
+        if offset + 0x4C > end:
+            return None
+        flags = _u16(buf, offset + 0x02)[0]
+        stamp = _u64(buf, offset + 0x04)[0]
+        length = _u16(buf, offset + 0x48)[0]
+        if not length or offset + 0x4C + length > end or not _FILETIME_MIN <= stamp <= _FILETIME_MAX:
+            return None
+        try:
+            name = _text(bytes(buf[offset + 0x4C:offset + 0x4C + length]), flags & 0x0020)
+        except UnicodeDecodeError:
+            return None
+        if "\\" in name or "\x00" in name:
+            return None
+        return name, flags, stamp
+
+    def vk(self, offset, end):
+        """True if offset holds a plausible vk record ending before end."""
+        buf = self.buf
+        if offset + 0x14 > end:
+            return False
+        length = _u16(buf, offset + 0x02)[0]
+        if offset + 0x14 + length > end:
+            return False
+        vtype = _u32(buf, offset + 0x0C)[0] & RegistryParse.DEVPROP_MASK_TYPE
+        if vtype not in _TYPE_NAMES:
+            return False
+        raw_length = _u32(buf, offset + 0x04)[0]
+        if raw_length & 0x80000000:
+            return raw_length & 0x7FFFFFFF <= 4
+        return raw_length < 5 or self.cell(_u32(buf, offset + 0x08)[0]) is not None
+
+    def sk(self, offset, end):
+        """True if offset holds an sk record whose self-relative descriptor fits before end."""
+        if offset + 0x14 > end:
+            return False
+        length = _u32(self.buf, offset + 0x10)[0]
+        return 20 <= length and offset + 0x14 + length <= end and self.buf[offset + 0x14] == 1
+
+    def value(self, offset, binary):
+        regf = self.regf
+        raw_length = _u32(self.buf, offset + 0x04)[0]
+        if raw_length & 0x80000000 or raw_length < 5:
+            status = "resident"
+        else:
+            ## data in a cell that is in use again belongs to something else now
+            data_cell = self.cell(_u32(self.buf, offset + 0x08)[0])
+            status = "overwritten" if _i32(self.buf, data_cell - 4)[0] < 0 else "recovered"
+        try:
+            name = regf.value_name(offset)
+            data = encode_data(regf.value_data(offset), binary) if status != "overwritten" else None
+        except Exception:
+            return None
+        return {"name": name, "type": regf.value_type_str(offset), "data": data, "status": status}
+
+    def key_path(self, nk):
+        """Backslash path of the key at nk, live or carved, from its parent chain."""
+        chain = []
+        seen = set()
+        while True:
+            if nk in self._paths:
+                prefix = self._paths[nk]
+                break
+            if nk is None or nk in seen or len(chain) > MAX_PATH_DEPTH or self.buf[nk:nk + 2] != b"nk":
+                prefix = UNKNOWN_PARENT
+                break
+            flags = _u16(self.buf, nk + 0x02)[0]
+            if flags & 0x0004:
+                ## the root's name is not part of paths, as in src.walk
+                prefix = self._paths[nk] = ""
+                break
+            length = _u16(self.buf, nk + 0x48)[0]
+            try:
+                name = _text(bytes(self.buf[nk + 0x4C:nk + 0x4C + length]), flags & 0x0020)
+            except UnicodeDecodeError:
+                prefix = UNKNOWN_PARENT
+                break
+            seen.add(nk)
+            chain.append((nk, name))
+            nk = self.cell(_u32(self.buf, nk + 0x10)[0])
+        for nk, name in reversed(chain):
+            prefix = self._paths[nk] = prefix + "\\" + name
+        return prefix
+
+    def value_offsets(self, offset):
+        buf = self.buf
+        count = _u32(buf, offset + 0x24)[0]
+        values = self.cell(_u32(buf, offset + 0x28)[0])
+        if values is None or not 0 < count < 0x10000 or values + 4 * count > self.size:
+            return ()
+        return [cell for cell in (self.cell(rel) for rel in struct.unpack_from(f"<{count}I", buf, values))
+                if cell is not None]
+
+
+def _regf(hive):
+    ## carving reads raw cells, so either backend is looked at through a RegfHive
+    if isinstance(hive, str):
+        return RegfHive(hive), True
+    registry = open_hive(hive)
+    if isinstance(registry, RegfHive):
+        return registry, False
+    return RegfHive(registry._buf), False
+
+
+@measured
+def iter_recovered(hive, binary="hex", stats=None):
+    """
+    Lazily yield the deleted keys, values and security records carved from
+    the free cells of a hive, as key records:
+        {"record": "key", "offset", "path", "last_write", "values": [{"name", "type", "data", "status"}]}
+    values the carved keys do not claim as {"record": "value", "path": None, ...}
+    and security records as {"record": "sk", "refcount", "descriptor", ...}.
+    A value's status says whether its data was "resident" in the vk record,
+    "recovered" from a free cell or "overwritten" by a cell in use again.
+    If stats is a dict, scan sizes, counts and timings are stored in it.
+    """
+    stats = {} if stats is None else stats
+    start = time.perf_counter()
+    try:
+        regf, owned = _regf(hive)
+    except (RegfError, RegistryParse.RegistryException, OSError, ValueError) as e:
+        print(f"Error carving hive: {e}", file=sys.stderr)
+        stats["seconds"] = round(time.perf_counter() - start, 4)
+        return
+    try:
+        buf = regf.buffer
+        cells = free_cells(buf)
+        walked = time.perf_counter()
+        candidates = find_candidates(buf, cells)
+        scanned = time.perf_counter()
+        stats.update(bytes=len(buf), free_cells=len(cells), free_bytes=sum(end - s for s, end in cells),
+                     candidates=len(candidates), keys=0, values=0, sk=0, rejected=0,
+                     walk_seconds=round(walked - start, 4), scan_seconds=round(scanned - walked, 4),
+                     numpy=numpy is not None)
+
+        carver = _Carver(regf)
+        keys, values, sks = [], {}, []
+        for offset, end in candidates:
+            signature = bytes(buf[offset:offset + 2])
+            if signature == b"nk":
+                key = carver.nk(offset, end)
+                if key is None:
+                    stats["rejected"] += 1
+                else:
+                    keys.append((offset, key))
+            elif signature == b"vk":
+                if carver.vk(offset, end):
+                    values[offset] = end
+                else:
+                    stats["rejected"] += 1
+            elif carver.sk(offset, end):
+                sks.append(offset)
+            else:
+                stats["rejected"] += 1
+
+        for offset, (name, flags, stamp) in keys:
+            key_values = []
+            for vk in carver.value_offsets(offset):
+                if values.pop(vk, None) is not None:
+                    value = carver.value(vk, binary)
+                    if value is not None:
+                        key_values.append(value)
+            stats["keys"] += 1
+            parent = "" if flags & 0x0004 else carver.key_path(carver.cell(_u32(buf, offset + 0x10)[0]))
+            yield {"record": "key", "offset": offset, "path": f"{parent}\\{name}",
+                   "last_write": utc_isoformat(RegistryParse.parse_windows_timestamp(stamp)), "values": key_values}
+
+        for offset in values:
+            value = carver.value(offset, binary)
+            if value is None:
+                stats["rejected"] += 1
+                continue
+            stats["values"] += 1
+            yield {"record": "value", "offset": offset, "path": None, "last_write": None, "values": [value]}
+
+        for offset in sks:
+            length = _u32(buf, offset + 0x10)[0]
+            stats["sk"] += 1
+            yield {"record": "sk", "offset": offset, "path": None, "last_write": None, "values": [],
+                   "refcount": _u32(buf, offset + 0x0C)[0],
+                   "descriptor": encode_data(bytes(buf[offset + 0x14:offset + 0x14 + length]), binary)}
+    except (RegfError, OSError, struct.error) as e:
+        print(f"Error carving hive: {e}", file=sys.stderr)
+    finally:
+        stats["seconds"] = round(time.perf_counter() - start, 4)
+        if owned:
+            regf.close()
+
+
+def recover_deleted(hive, binary="hex"):
+    """List version of iter_recovered."""
+    return list(iter_recovered(hive, binary=binary))
+
+
+def export_recovered(hive, output=None, fmt="ndjson", binary="hex", stats=None):
+    """
+    Write the carved records of a hive as NDJSON or CSV, the way export_hive
+    writes live keys. Returns the number of records written.
+    """
+    count = 0
+    try:
+        with RecordWriter(output, fmt, fieldnames=CSV_FIELDS if fmt == "csv" else None) as writer:
+            for record in iter_recovered(hive, binary=binary, stats=stats):
+                count += 1
+                writer.write_key(record)
+    except Exception as e:
+        print(f"Error exporting recovered records: {e}", file=sys.stderr)
+    return count
@@ -0,0 +1,178 @@
+import json
+import os
+import socket
+import sys
+
+from src.options import SERVER_ENV
+
+
+## Thin client for `regpy serve` (src/server.py).
+##
+## Only the standard library is imported here so that forwarding a command
+## line costs no more than starting Python: no parser and no hive is loaded
+## on the client side. Requests are JSON over HTTP, on a Unix socket
+## ("unix:/path/to.sock") or on localhost TCP ("127.0.0.1:8765").
+
+if hasattr(socket, "AF_UNIX"):
+    DEFAULT_ADDRESS = "unix:" + os.path.join(os.path.expanduser("~"), ".cache", "regpy", "serve.sock")
+else:
+    DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+
+## options the server refuses, see regpy.py LOCAL_ONLY_ARGS (-o is applied here instead)
+LOCAL_FLAGS = ("--batch", "--batch-output", "--build-index", "--use-index", "--snapshot", "--diff")
+
+
+class ServerError(Exception):
+    pass
+
+
+def parse_address(address):
+    """("unix", path) or ("tcp", (host, port)) for an address string."""
+    if address.startswith("unix:"):
+        return "unix", os.path.expanduser(address[len("unix:"):])
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"invalid server address '{address}', expected unix:/path or host:port")
+    return "tcp", (host.strip("[]"), int(port))
+
+
+def _connect(address, timeout):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(target)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    return socket.create_connection(target, timeout=timeout)
+
+
+def request(address, method, path, payload=None, timeout=None):
+    """
+    Send one request and return the decoded JSON reply. Connection errors
+    are OSErrors. Plain HTTP/1.0 over a socket: http.client would cost
+    more to import than the whole exchange.
+    """
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    head = (f"{method} {path} HTTP/1.0\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode("ascii")
+    with _connect(address, timeout) as sock:
+        sock.sendall(head + body)
+        chunks = []
+        while True:
+            chunk = sock.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    response = b"".join(chunks)
+    header, _, data = response.partition(b"\r\n\r\n")
+    if not header.startswith(b"HTTP/"):
+        raise ConnectionError(f"unexpected reply from {address}")
+    return json.loads(data.decode("utf-8") or "{}")
+
+
+def query(op, address=DEFAULT_ADDRESS, timeout=None, **params):
+    """
+    Run one query on the server and return its result, e.g.
+    query("call", function="get_services", hives=["/cases/SYSTEM"]).
+    Raises ServerError with the server's message if the query failed.
+    """
+    reply = request(address, "POST", "/query", dict(params, op=op), timeout)
+    if not reply.get("ok"):
+        raise ServerError(reply.get("error", "unknown error"))
+    return reply["result"]
+
+
+def status(address=DEFAULT_ADDRESS, timeout=None):
+    return request(address, "GET", "/status", timeout=timeout)
+
+
+def split_server_arg(argv):
+    """Take --server ADDR / --server=ADDR out of argv. Returns (address or None, rest)."""
+    rest = []
+    address = None
+    args = iter(argv)
+    for arg in args:
+        if arg == "--server":
+            address = next(args, None)
+        elif arg.startswith("--server="):
+            address = arg.split("=", 1)[1]
+        else:
+            rest.append(arg)
+    return address, rest
+
+
+def runs_locally(argv):
+    """True for command lines the server refuses (they write files or run batches): they are not forwarded."""
+    return any(arg.split("=", 1)[0] in LOCAL_FLAGS for arg in argv)
+
+
+def split_output_arg(argv):
+    """Take -o/--output FILE out of argv. Returns (file or None, rest)."""
+    rest = []
+    output = None
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-o", "--output"):
+            output = next(args, None)
+        elif arg.startswith("--output="):
+            output = arg.split("=", 1)[1]
+        elif arg.startswith("-o") and not arg.startswith("--"):
+            output = arg[2:]
+        else:
+            rest.append(arg)
+    return output, rest
+
+
+def forward_cli(argv, address=DEFAULT_ADDRESS):
+    """
+    Run a regpy command line on the server, writing its output to this
+    process's stdout/stderr, or for -o FILE the records to FILE: the server
+    never writes files for a client. Returns the exit status, or None if no
+    server answered at address (the caller then runs the command itself).
+    """
+    output, argv = split_output_arg(argv)
+    try:
+        reply = request(address, "POST", "/query", {"op": "run", "argv": argv, "cwd": os.getcwd()})
+    except (OSError, ValueError):
+        return None
+    if not reply.get("ok"):
+        print(f"Error from regpy server: {reply.get('error')}", file=sys.stderr)
+        return 1
+    result = reply["result"]
+    if output and result["status"] == 0:
+        try:
+            with open(output, "w", newline="", encoding="utf-8") as f:
+                f.write(result["stdout"])
+        except OSError as e:
+            print(f"Error writing {output}: {e}", file=sys.stderr)
+            return 1
+    else:
+        sys.stdout.write(result["stdout"])
+    sys.stderr.write(result["stderr"])
+    return result["status"]
+
+
+def main():
+    address, argv = split_server_arg(sys.argv[1:])
+    address = address or os.environ.get(SERVER_ENV) or DEFAULT_ADDRESS
+    if argv == ["--status"]:
+        try:
+            print(json.dumps(status(address), indent=1))
+        except OSError as e:
+            print(f"Error connecting to regpy server at {address}: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+    code = forward_cli(argv, address)
+    if code is None:
+        print(f"Error connecting to regpy server at {address}", file=sys.stderr)
+        code = 1
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from Registry import RegistryParse
+
+from src.export import encode_data, utc_isoformat
+from src.fingerprint import cache_path, fingerprint_matches, hive_file, hive_fingerprint
+from src.metrics import measured
+from src.regf import RegfHive
+
+
+## Hive diff.
+##
+## Every key gets two digests: its own (LastWrite time plus the name, type
+## and raw data of each value) and its subtree's (its own digest plus the
+## name and subtree digest of each subkey), i.e. a Merkle tree over the
+## hive. Both hives are then walked together from the top and any pair of
+## keys whose subtree digests match is skipped without looking further, so
+## the work is proportional to what changed rather than to the hive size.
+##
+## Digests are kept in <hive>.regpy-digests (SQLite, validated with the
+## hive fingerprint like the index), so a fixed baseline is hashed once.
+## Names are compared case-insensitively, as Windows does.
+
+SCHEMA_VERSION = 1
+DIGEST_SUFFIX = ".regpy-digests"
+DIGEST_SIZE = 16
+DIFF_FIELDS = ("change", "kind", "path", "value", "type", "old", "new")
+
+_SCHEMA = """
+CREATE TABLE meta (k TEXT PRIMARY KEY, v TEXT);
+CREATE TABLE digests (path TEXT PRIMARY KEY, subtree BLOB NOT NULL, own BLOB NOT NULL) WITHOUT ROWID;
+"""
+
+
+def _own_digest(regf, nk):
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    h.update(regf.key_timestamp(nk).to_bytes(8, "little"))
+    values = sorted((regf.value_name(vk).lower(), vk) for vk in regf.value_offsets(nk))
+    for name, vk in values:
+        try:
+            data = regf.value_raw_data(vk)
+        except RegistryParse.RegistryException:
+            data = b"\xff<unreadable>"
+        h.update(name.encode("utf-8") + b"\x00")
+        h.update(regf.value_type(vk).to_bytes(4, "little") + len(data).to_bytes(4, "little"))
+        h.update(data)
+    return h.digest()
+
+
+def compute_digests(hive_path):
+    """
+    Return {lowercase key path: (subtree digest, own digest)} for every key,
+    the root being "". One post-order walk over the memory-mapped hive.
+    """
+    digests = {}
+    with RegfHive(hive_path) as regf:
+        ## entries are (nk, path, child paths); child paths is None until the
+        ## key has been expanded, its digest is computed on the second visit
+        stack = [(regf.root_offset(), "", None)]
+        while stack:
+            nk, path, children = stack.pop()
+            if children is None:
+                prefix = path + "\\" if path else ""
+                subkeys = [(prefix + regf.key_name(sub).lower(), sub) for sub in regf.subkey_offsets(nk)]
+                stack.append((nk, path, sorted(child for child, _ in subkeys)))
+                stack.extend((sub, child, None) for child, sub in subkeys)
+                continue
+            own = _own_digest(regf, nk)
+            h = hashlib.blake2b(own, digest_size=DIGEST_SIZE)
+            for child in children:
+                h.update(child.rsplit("\\", 1)[-1].encode("utf-8") + b"\x00")
+                h.update(digests[child][0])
+            digests[path] = (h.digest(), own)
+    return digests
+
+
+def digest_cache_path(hive):
+    return cache_path(hive, DIGEST_SUFFIX)
+
+
+def load_digests(hive, cache=True):
+    """
+    Digests of a hive, read from its digest cache when that is still current,
+    otherwise computed (and written to the cache when cache is True).
+    """
+    hive_path = hive_file(hive)
+    db_path = digest_cache_path(hive_path)
+    if cache and os.path.exists(db_path):
+        db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            meta = {k: json.loads(v) for k, v in db.execute("SELECT k, v FROM meta")}
+            if meta.get("schema") == SCHEMA_VERSION and fingerprint_matches(meta, hive_path):
+                return {path: (subtree, own) for path, subtree, own in db.execute("SELECT path, subtree, own FROM digests")}
+        finally:
+            db.close()
+
+    fingerprint = hive_fingerprint(hive_path)
+    digests = compute_digests(hive_path)
+    if cache:
+        tmp_path = db_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.execute("PRAGMA journal_mode = OFF")
+            db.execute("PRAGMA synchronous = OFF")
+            db.executescript(_SCHEMA)
+            db.executemany("INSERT INTO digests VALUES (?, ?, ?)",
+                           ((path, subtree, own) for path, (subtree, own) in digests.items()))
+            meta = dict(fingerprint, schema=SCHEMA_VERSION, hive_path=os.path.abspath(hive_path))
+            db.executemany("INSERT INTO meta VALUES (?, ?)", [(k, json.dumps(v)) for k, v in meta.items()])
+            db.commit()
+        finally:
+            db.close()
+        os.replace(tmp_path, db_path)
+    return digests
+
+
+def _timestamp(regf, nk):
+    return utc_isoformat(RegistryParse.parse_windows_timestamp(regf.key_timestamp(nk)))
+
+
+def _values(regf, nk):
+    return {regf.value_name(vk).lower(): vk for vk in regf.value_offsets(nk)}
+
+
+def _value_record(change, regf, vk, path, old=None, new=None):
+    return {"change": change, "kind": "value", "path": path,
+            "value": regf.value_name(vk) or "(default)", "type": regf.value_type_str(vk),
+            "old": old, "new": new}
+
+
+def _decoded(regf, vk, binary):
+    try:
+        return encode_data(regf.value_data(vk), binary)
+    except RegistryParse.RegistryException as e:
+        return f"(unreadable: {e})"
+
+
+def _subtree_records(change, regf, nk, path, binary):
+    """Records for every key and value of a subtree that exists on one side only."""
+    stack = [(nk, path)]
+    while stack:
+        nk, path = stack.pop()
+        stamp = _timestamp(regf, nk)
+        yield {"change": change, "kind": "key", "path": path, "value": None, "type": None,
+               "old": stamp if change == "removed" else None, "new": stamp if change == "added" else None}
+        for vk in regf.value_offsets(nk):
+            data = _decoded(regf, vk, binary)
+            yield _value_record(change, regf, vk, path, old=data if change == "removed" else None,
+                                new=data if change == "added" else None)
+        for sub in reversed(regf.subkey_offsets(nk)):
+            stack.append((sub, f"{path}\\{regf.key_name(sub)}"))
+
+
+def _key_changes(old, old_nk, new, new_nk, path, binary):
+    old_stamp, new_stamp = _timestamp(old, old_nk), _timestamp(new, new_nk)
+    if old_stamp != new_stamp:
+        yield {"change": "modified", "kind": "key", "path": path, "value": None, "type": None,
+               "old": old_stamp, "new": new_stamp}
+    old_values, new_values = _values(old, old_nk), _values(new, new_nk)
+    for name in sorted(old_values.keys() | new_values.keys()):
+        old_vk, new_vk = old_values.get(name), new_values.get(name)
+        if new_vk is None:
+            yield _value_record("removed", old, old_vk, path, old=_decoded(old, old_vk, binary))
+        elif old_vk is None:
+            yield _value_record("added", new, new_vk, path, new=_decoded(new, new_vk, binary))
+        elif (old.value_type(old_vk) != new.value_type(new_vk)
+              or old.value_raw_data(old_vk) != new.value_raw_data(new_vk)):
+            yield _value_record("modified", new, new_vk, path, old=_decoded(old, old_vk, binary),
+                                new=_decoded(new, new_vk, binary))
+
+
+@measured
+def iter_diff(old_hive, new_hive, start_key="", cache=True, binary="hex", stats=None):
+    """
+    Yield one record per difference between two hives below start_key:
+        {"change": added|removed|modified, "kind": key|value, "path",
+         "value", "type", "old", "new"}
+    For keys, old/new are LastWrite times; for values, the decoded data.
+    Subtrees with equal digests are skipped. If a stats dict is given it is
+    filled with the number of key pairs compared and subtrees skipped.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(compared=0, skipped=0)
+    old_digests = load_digests(old_hive, cache)
+    new_digests = load_digests(new_hive, cache)
+
+    with RegfHive(hive_file(old_hive)) as old, RegfHive(hive_file(new_hive)) as new:
+        base = "\\".join(part for part in start_key.lower().split("\\") if part)
+        ## entries are ("both", old nk, new nk, lowercase path, path) for keys
+        ## present in both hives and (change, hive, nk, path) for one-sided ones
+        stack = [("both", old.open(start_key).offset() if start_key else old.root_offset(),
+                  new.open(start_key).offset() if start_key else new.root_offset(),
+                  base, start_key or "")]
+        while stack:
+            entry = stack.pop()
+            if entry[0] != "both":
+                yield from _subtree_records(*entry, binary)
+                continue
+            _, old_nk, new_nk, lower, path = entry
+            stats["compared"] += 1
+            old_digest, new_digest = old_digests[lower], new_digests[lower]
+            if old_digest[0] == new_digest[0]:
+                stats["skipped"] += 1
+                continue
+            if old_digest[1] != new_digest[1]:
+                yield from _key_changes(old, old_nk, new, new_nk, path, binary)
+
+            prefix = lower + "\\" if lower else ""
+            old_subkeys = {old.key_name(sub).lower(): sub for sub in old.subkey_offsets(old_nk)}
+            new_subkeys = {new.key_name(sub).lower(): sub for sub in new.subkey_offsets(new_nk)}
+            for name in sorted(old_subkeys.keys() | new_subkeys.keys(), reverse=True):
+                old_sub, new_sub = old_subkeys.get(name), new_subkeys.get(name)
+                if new_sub is None:
+                    stack.append(("removed", old, old_sub, f"{path}\\{old.key_name(old_sub)}"))
+                elif old_sub is None:
+                    stack.append(("added", new, new_sub, f"{path}\\{new.key_name(new_sub)}"))
+                else:
+                    stack.append(("both", old_sub, new_sub, prefix + name, f"{path}\\{new.key_name(new_sub)}"))
+
+
+def diff_hives(old_hive, new_hive, start_key="", cache=True, binary="hex"):
+    """List of the records iter_diff() yields."""
+    return list(iter_diff(old_hive, new_hive, start_key, cache=cache, binary=binary))
@@ -0,0 +1,212 @@
+import base64
+import csv
+import datetime
+import json
+import sys
+
+from src.metrics import measured
+from src.options import BINARY_ENCODINGS
+from src.walk import walk_keys
+
+
+## Structured (NDJSON / CSV) output.
+##
+## Whole-hive exports stream one record per key (NDJSON) or one row per value
+## (CSV) while the walk runs, through a buffered writer, so memory does not
+## grow with the size of the hive. Artifact results are turned into flat
+## records with the same encoding rules: binary data as hex or base64,
+## REG_MULTI_SZ as a list (a JSON array inside a CSV cell) and timestamps as
+## ISO 8601 in UTC with the offset spelled out ("2020-01-01T00:00:05+00:00"),
+## through utc_isoformat(), which timeline, diff and carve records use too.
+
+FORMATS = ("ndjson", "csv")
+CSV_FIELDS = ("path", "last_write", "value", "type", "data")
+WRITE_BUFFER = 1 << 16
+
+## artifact name -> how its result is laid out:
+##   ("list", column)            list of names (or of dicts, used as they are)
+##   ("mapping", key, column)    dict of key -> value, one record per item
+##   ("record",)                 one dict, one record
+ARTIFACT_LAYOUTS = {
+    "users": ("list", "name"),
+    "accounts": ("list", "rid"),
+    "user_sids": ("mapping", "sid", "user"),
+    "winver": ("record",),
+    "installed_apps": ("list", "name"),
+    "services": ("list", "name"),
+    "service_details": ("record",),
+    "drivers": ("list", "name"),
+    "shares": ("list", "name"),
+    "nics": ("mapping", "guid", "name"),
+    "nic_details": ("record",),
+    "dns": ("mapping", "guid", "servers"),
+    "keys": ("list", "path"),
+    "key_values": ("mapping", "value", "data"),
+    "search": ("list", "path"),
+    "query": ("list", "path"),
+    "diff": ("list", "path"),
+    "timeline": ("list", "path"),
+}
+
+
+def utc_isoformat(dt):
+    """
+    ISO 8601 text of a datetime with its UTC offset. Naive datetimes are
+    UTC, as the FILETIMEs of a hive decode to; dates stay dates.
+    """
+    if not isinstance(dt, datetime.datetime):
+        return dt.isoformat()
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc).isoformat()
+    return dt.astimezone(datetime.timezone.utc).isoformat()
+
+
+def encode_data(data, binary="hex"):
+    """Make value data JSON-safe: bytes become hex/base64 text, datetimes ISO 8601 in UTC."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
+        return base64.b64encode(data).decode("ascii") if binary == "base64" else data.hex()
+    if isinstance(data, (datetime.datetime, datetime.date)):
+        return utc_isoformat(data)
+    if isinstance(data, list):
+        return [encode_data(item, binary) for item in data]
+    return data
+
+
+def _csv_cell(data):
+    if data is None:
+        return ""
+    if isinstance(data, (list, dict)):
+        return json.dumps(data)
+    return data
+
+
+def iter_hive_records(hive, start_key="", max_depth=None, max_keys=None, binary="hex"):
+    """
+    Lazily yield one record per key below start_key:
+        {"path", "last_write", "values": [{"name", "type", "data"}]}
+    """
+    for path, key in walk_keys(hive, start_key, max_depth=max_depth, max_keys=max_keys):
+        values = []
+        for value in key.values():
+            try:
+                data = encode_data(value.value(), binary)
+            except Exception as e:
+                ## keep the rest of the key when a single value is corrupt
+                data = None
+                print(f"Error decoding value {path}\\{value.name()}: {e}", file=sys.stderr)
+            values.append({"name": value.name(), "type": value.value_type_str(), "data": data})
+        yield {"path": path, "last_write": utc_isoformat(key.timestamp()), "values": values}
+
+
+class RecordWriter(object):
+    """
+    Buffered NDJSON or CSV writer over a path or an open text stream.
+    CSV columns are fixed by the first record (or fieldnames) and missing
+    fields are left empty.
+    """
+
+    def __init__(self, output=None, fmt="ndjson", fieldnames=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown format '{fmt}' (choose from {', '.join(FORMATS)})")
+        self.fmt = fmt
+        self.fieldnames = list(fieldnames) if fieldnames else None
+        self.count = 0
+        self._owned = isinstance(output, str)
+        self._out = open(output, "w", newline="", encoding="utf-8", buffering=WRITE_BUFFER) if self._owned else (output or sys.stdout)
+        self._csv = None
+
+    def write(self, record):
+        if self.fmt == "ndjson":
+            self._out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            if self._csv is None:
+                self._csv = csv.DictWriter(self._out, fieldnames=self.fieldnames or list(record),
+                                           extrasaction="ignore", restval="")
+                self._csv.writeheader()
+            self._csv.writerow({k: _csv_cell(v) for k, v in record.items()})
+        self.count += 1
+
+    def write_key(self, record):
+        """
+        Write a key record ({"path", "last_write", "values", ...}): one NDJSON
+        line, or one CSV row per value with the key's fields repeated (one
+        row with empty value columns for keys without values).
+        """
+        if self.fmt == "ndjson":
+            self.write(record)
+            return
+        row = {k: v for k, v in record.items() if k != "values"}
+        if not record["values"]:
+            self.write(row)
+        for value in record["values"]:
+            self.write(dict(row, value=value["name"], type=value["type"], data=value["data"],
+                            **{k: v for k, v in value.items() if k not in ("name", "type", "data")}))
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self.count
+
+    def close(self):
+        if self._owned:
+            self._out.close()
+        else:
+            self._out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+@measured
+def export_hive(hive, output=None, fmt="ndjson", start_key="", max_depth=None, max_keys=None, binary="hex"):
+    """
+    Stream every key (and its values) below start_key to output as NDJSON
+    (one line per key) or CSV (one row per value, keys without values get
+    one row with empty value columns). Returns the number of keys written.
+    """
+    keys = 0
+    try:
+        with RecordWriter(output, fmt, fieldnames=CSV_FIELDS if fmt == "csv" else None) as writer:
+            for record in iter_hive_records(hive, start_key, max_depth=max_depth, max_keys=max_keys, binary=binary):
+                keys += 1
+                writer.write_key(record)
+    except Exception as e:
+        print(f"Error exporting hive: {e}", file=sys.stderr)
+    return keys
+
+
+def artifact_records(artifact, result, binary="hex"):
+    """Turn an artifact function's return value into flat records tagged with the artifact name."""
+    if result is None:
+        return
+    layout = ARTIFACT_LAYOUTS.get(artifact, ("record",) if isinstance(result, dict) else ("list", "value"))
+    if layout[0] == "list":
+        for item in result:
+            if isinstance(item, dict):
+                yield dict({"artifact": artifact}, **{k: encode_data(v, binary) for k, v in item.items()})
+            else:
+                yield {"artifact": artifact, layout[1]: encode_data(item, binary)}
+    elif layout[0] == "mapping":
+        for key, value in result.items():
+            yield {"artifact": artifact, layout[1]: key, layout[2]: encode_data(value, binary)}
+    else:
+        yield dict({"artifact": artifact}, **{k: encode_data(v, binary) for k, v in result.items()})
+
+
+def write_artifact(artifact, result, output=None, fmt="ndjson", binary="hex"):
+    """
+    Write an artifact result as NDJSON or CSV and return the record count.
+    Results that are generators are streamed; for lists and dicts the CSV
+    columns are the union of the fields of all records, in first-seen order.
+    """
+    records = artifact_records(artifact, result, binary)
+    fieldnames = None
+    if fmt == "csv" and isinstance(result, (list, dict)):
+        records = list(records)
+        fieldnames = list(dict.fromkeys(k for record in records for k in record))
+    with RecordWriter(output, fmt, fieldnames=fieldnames) as writer:
+        return writer.write_all(records)
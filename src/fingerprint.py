@@ -0,0 +1,97 @@
+import hashlib
+import os
+
+from src.archive import find_logs, is_member, member_digest, member_size, source_stat
+from src import replay
+
+## Cheap identity for a hive file, used to tell whether anything derived
+## from it (indexes, cached results) is still valid.
+##
+## Size and mtime catch almost every change. The digest covers the base
+## block, which Windows rewrites (sequence numbers, timestamp, checksum) on
+## every flush, plus the first and last hbin pages and a sparse sample in
+## between, so it stays cheap on multi-hundred-MB hives. For a hive inside
+## a triage archive ("archive::member", src.archive) size and mtime are the
+## member's and the archive's, and the digest is taken from the archive's
+## record of the member, so nothing is decompressed to check it. While
+## transaction logs are replayed (src.replay) the hive is what its logs
+## make of it, so the logs' digests are part of its own.
+
+BASE_BLOCK_SIZE = 0x1000
+SAMPLE_SIZE = 0x10000
+SAMPLE_COUNT = 16
+
+
+def hive_file(hive):
+    ## accepts a path or anything carrying one (HiveSession)
+    return getattr(hive, "hive_path", hive)
+
+
+def cache_path(hive, suffix):
+    """
+    Where a file derived from a hive is kept: beside it (<hive><suffix>) when
+    that directory is writable, otherwise in the user cache directory.
+    """
+    hive_path = os.path.abspath(hive_file(hive))
+    beside = hive_path + suffix
+    if not is_member(hive_path) and os.access(os.path.dirname(hive_path), os.W_OK):
+        return beside
+    cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "regpy")
+    os.makedirs(cache_dir, exist_ok=True)
+    name = hashlib.blake2b(hive_path.encode("utf-8"), digest_size=10).hexdigest()
+    return os.path.join(cache_dir, os.path.basename(hive_path) + "-" + name + suffix)
+
+
+def hive_digest(hive_path):
+    digest = _file_digest(hive_path)
+    if replay.active():
+        logs = find_logs(hive_path)
+        if logs:
+            h = hashlib.blake2b(digest.encode("ascii"), digest_size=16)
+            for log in logs:
+                h.update(_file_digest(log).encode("ascii"))
+            digest = h.hexdigest()
+    return digest
+
+
+def _file_digest(hive_path):
+    if is_member(hive_path):
+        return member_digest(hive_path)
+    size = os.path.getsize(hive_path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(size.to_bytes(8, "little"))
+    with open(hive_path, "rb") as f:
+        h.update(f.read(BASE_BLOCK_SIZE + SAMPLE_SIZE))
+        if size > BASE_BLOCK_SIZE + SAMPLE_SIZE:
+            stride = max((size - BASE_BLOCK_SIZE) // SAMPLE_COUNT, SAMPLE_SIZE)
+            for offset in range(BASE_BLOCK_SIZE + stride, size, stride):
+                f.seek(offset)
+                h.update(f.read(SAMPLE_SIZE))
+            f.seek(max(size - SAMPLE_SIZE, 0))
+            h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()
+
+
+def hive_size(hive_path, st):
+    return member_size(hive_path) if is_member(hive_path) else st.st_size
+
+
+def hive_fingerprint(hive):
+    """
+    Return {"size", "mtime_ns", "digest"} for a hive path or HiveSession.
+    """
+    hive_path = hive_file(hive)
+    st = source_stat(hive_path)
+    return {
+        "size": hive_size(hive_path, st),
+        "mtime_ns": st.st_mtime_ns,
+        "digest": hive_digest(hive_path),
+    }
+
+
+def fingerprint_matches(fingerprint, hive):
+    """True when a stored fingerprint still describes the hive file on disk."""
+    st = source_stat(hive_file(hive))
+    if hive_size(hive_file(hive), st) != fingerprint.get("size") or st.st_mtime_ns != fingerprint.get("mtime_ns"):
+        return False
+    return hive_digest(hive_file(hive)) == fingerprint.get("digest")
@@ -1,48 +1,80 @@
+import sys
+
 from Registry import Registry
+from src.metrics import measured
+from src.resultcache import cached
+from src.session import open_hive
+from src.values import KeyValues
+from src.walk import walk_keys
+
+
+## src.snapshot and src.services are imported by the functions that use
+## them, so `import src.general` stays cheap for the commands that do not
+
+def _is_snapshot(hive):
+    ## a HiveSnapshot only exists once src.snapshot has been imported
+    snapshot = sys.modules.get("src.snapshot")
+    return snapshot is not None and isinstance(hive, snapshot.HiveSnapshot)
+
 
-def list_all_keys_recursive(hive_path, start_key=""):
-    
-    keys = []
+@measured
+def iter_all_keys(hive_path, start_key="", max_depth=None, max_keys=None, jobs=1):
+    """
+    Yields the path of start_key and every key below it as the walk reaches them.
+    jobs > 1 splits the walk across that many processes (same output order).
+    """
     try:
-        registry = Registry.Registry(hive_path)
-        if start_key:
-            root = registry.open(start_key)
-        else:
-            root = registry.root()
-        def recurse(key, path):
-            keys.append(path)
-            for subkey in key.subkeys():
-                recurse(subkey, f"{path}\\{subkey.name()}")
-        recurse(root, start_key if start_key else "")
+        if _is_snapshot(hive_path):
+            yield from hive_path.iter_keys(start_key, max_depth=max_depth, max_keys=max_keys)
+            return
+        if jobs > 1:
+            from src.parallel import iter_keys_parallel
+            yield from iter_keys_parallel(hive_path, start_key, jobs=jobs, max_depth=max_depth, max_keys=max_keys)
+            return
+        for path, _ in walk_keys(hive_path, start_key, max_depth=max_depth, max_keys=max_keys):
+            yield path
     except Exception as e:
         print(f"Error listing keys: {e}")
-    return keys
 
-def search_keys_by_keyword(hive_path, keyword, start_key=""):
+@measured
+def list_all_keys_recursive(hive_path, start_key="", max_depth=None, max_keys=None, jobs=1):
+    return list(iter_all_keys(hive_path, start_key, max_depth=max_depth, max_keys=max_keys, jobs=jobs))
+
+@measured
+def iter_search_keys(hive_path, keyword, start_key="", max_depth=None, max_keys=None, jobs=1):
     """
-    Searches for registry keys containing the keyword in their path.
-    Returns a list of matching key paths.
+    Yields registry key paths containing the keyword as they are found.
+    max_keys bounds the number of keys visited, not the number of matches.
     """
-    matches = []
     try:
-        registry = Registry.Registry(hive_path)
-        if start_key:
-            root = registry.open(start_key)
-        else:
-            root = registry.root()
-        def recurse(key, path):
-            if keyword.lower() in path.lower():
-                matches.append(path)
-            for subkey in key.subkeys():
-                recurse(subkey, f"{path}\\{subkey.name()}")
-        recurse(root, start_key if start_key else "")
+        if _is_snapshot(hive_path):
+            yield from hive_path.search(keyword, start_key, max_depth=max_depth, max_keys=max_keys)
+            return
+        if jobs > 1:
+            from src.parallel import iter_keys_parallel
+            yield from iter_keys_parallel(hive_path, start_key, keyword=keyword, jobs=jobs,
+                                          max_depth=max_depth, max_keys=max_keys)
+            return
+        keyword = keyword.lower()
+        for path, _ in walk_keys(hive_path, start_key, max_depth=max_depth, max_keys=max_keys):
+            if keyword in path.lower():
+                yield path
     except Exception as e:
         print(f"Error searching keys: {e}")
-    return matches
+
+@measured
+def search_keys_by_keyword(hive_path, keyword, start_key="", max_depth=None, max_keys=None, jobs=1):
+    """
+    Searches for registry keys containing the keyword in their path.
+    Returns a list of matching key paths.
+    """
+    return list(iter_search_keys(hive_path, keyword, start_key, max_depth=max_depth, max_keys=max_keys, jobs=jobs))
 
 
 ## function for getting list of user installed applications from SAM hive
 
+@measured
+@cached
 def get_installed_apps(hive_path,verbose=False):
     root_key = "Microsoft\\Windows\\CurrentVersion\\Uninstall"
 
@@ -50,29 +82,31 @@ def get_installed_apps(hive_path,verbose=False):
 
     apps = []
     try:
-        registry = Registry.Registry(hive_path)
+        registry = open_hive(hive_path)
         reg = registry.open(root_key)
 
         for subkey in reg.subkeys():
             try:
                 info = {}
                 info["KeyName"] = subkey.name()
+                ## the value list is read once per subkey, data decoded on use
+                values = KeyValues(subkey)
                 
                 # If verbose, try to get all available values
                 if verbose:
                     # Helper function to safely get value
-                    def safe_get_value(key, value_name):
+                    def safe_get_value(value_name):
                         try:
-                            return key.value(value_name).value()
-                        except:
+                            return values.get(value_name, "(not set)")
+                        except Exception:
                             return "(not set)"
                     
-                    info["DisplayName"] = safe_get_value(subkey, "DisplayName")
-                    info["Publisher"] = safe_get_value(subkey, "Publisher")
-                    info["DisplayVersion"] = safe_get_value(subkey, "DisplayVersion")
+                    info["DisplayName"] = safe_get_value("DisplayName")
+                    info["Publisher"] = safe_get_value("Publisher")
+                    info["DisplayVersion"] = safe_get_value("DisplayVersion")
                     
                     # Format InstallDate as YYYY-MM-DD if possible
-                    install_date = safe_get_value(subkey, "InstallDate")
+                    install_date = safe_get_value("InstallDate")
                     if install_date != "(not set)" and len(install_date) == 8:
                         # Format YYYYMMDD to YYYY-MM-DD
                         try:
@@ -82,23 +116,19 @@ def get_installed_apps(hive_path,verbose=False):
                     else:
                         info["InstallDate"] = install_date
                     
-                    info["InstallLocation"] = safe_get_value(subkey, "InstallLocation")
-                    info["UninstallString"] = safe_get_value(subkey, "UninstallString")
+                    info["InstallLocation"] = safe_get_value("InstallLocation")
+                    info["UninstallString"] = safe_get_value("UninstallString")
                     
                     # EstimatedSize is DWORD, handle differently
-                    try:
-                        size_kb = subkey.value("EstimatedSize").value()
-                        info["EstimatedSizeKB"] = str(size_kb)
-                    except:
-                        info["EstimatedSizeKB"] = "(not set)"
+                    info["EstimatedSizeKB"] = str(safe_get_value("EstimatedSize"))
                     
                     apps.append(info)
                 else:
                     # Non-verbose: try DisplayName first, fall back to KeyName
                     try:
-                        name = subkey.value("DisplayName").value()
-                    except:
-                        name = info.get("KeyName")
+                        name = values.get("DisplayName", info["KeyName"])
+                    except Exception:
+                        name = info["KeyName"]
                     apps.append(name)
             except Exception:
                 # skip problematic entries
@@ -109,10 +139,12 @@ def get_installed_apps(hive_path,verbose=False):
 
 ## function to get list of shrares from system hive
 
+@measured
+@cached
 def get_shares(hive_path, verbose=False):
     shares = []
     try:
-        registry = Registry.Registry(hive_path)
+        registry = open_hive(hive_path)
         shares_key = registry.open("ControlSet001\\Services\\LanmanServer\\Shares")
 
         if verbose:
@@ -128,68 +160,96 @@ def get_shares(hive_path, verbose=False):
 
 
 ## function to get drivers 
+@measured
+@cached
 def get_drivers(hive_path, verbose=False):
     drivers = []
     try:
-        registry = Registry.Registry(hive_path)
-        drivers_key = registry.open("ControlSet001\\Services")
+        from src.services import service_catalog
+        catalog = service_catalog(hive_path)
 
         if verbose:
-            print(" [Info] Parsing Key : ControlSet001\\Services")
+            print(f" [Info] Parsing Key : {catalog.key_path}")
 
-        for subkey in drivers_key.subkeys():
-            try:
-                if verbose:
-                    print(f" [Info] Found Driver: {subkey.name()}")
-                start_value = subkey.value("Start")
-
-                if verbose:
-                    print(f" [Info] Value Name: Start, Value Type: DWORD ( {subkey.value('Start').value_type_str()} )")
-                    print(f" [Info] Value Data: {start_value.value()}")
-                # Consider drivers with Start type 0, 1, or 2 as loaded drivers
-                if start_value.value() in (0, 1, 2):
-                    drivers.append(subkey.name())
-            except Exception:
+        for service in catalog:
+            if verbose:
+                print(f" [Info] Found Driver: {service.name}")
+            if service.start is None:
                 continue
+
+            if verbose:
+                print(f" [Info] Value Name: Start, Value Type: DWORD ( {service.value_type('Start')} )")
+                print(f" [Info] Value Data: {service.start}")
+            # Consider drivers with Start type 0, 1, or 2 as loaded drivers
+            if service.start in (0, 1, 2):
+                drivers.append(service.name)
     except Exception as e:
         print(f"Error accessing SYSTEM hive for drivers: {e}")
     return drivers
 
 
 ## function to get the services from system hive
+@measured
+@cached
 def get_services(hive_path, verbose=False):
     services = []
     try:
-        registry = Registry.Registry(hive_path)
-        services_key = registry.open("ControlSet001\\Services")
+        from src.services import service_catalog
+        catalog = service_catalog(hive_path)
 
         if verbose:
-            print(" [Info] Parsing Key : ControlSet001\\Services")
+            print(f" [Info] Parsing Key : {catalog.key_path}")
 
-        for subkey in services_key.subkeys():
+        for service in catalog:
             if verbose:
-                print(f" [Info] Found Service: Key : ControlSet001\\Services\\{subkey.name()}")
-            services.append(subkey.name())
+                print(f" [Info] Found Service: Key : {catalog.key_path}\\{service.name}")
+            services.append(service.name)
+    except Exception as e:
+        print(f"Error accessing SYSTEM hive for services: {e}")
+    return services
+
+## function to filter services by start type, driver/service and image location
+@measured
+@cached
+def find_services(hive_path, start=None, drivers=None, image_outside=None, verbose=False):
+    services = []
+    try:
+        from src.services import service_catalog
+        catalog = service_catalog(hive_path)
+
+        if verbose:
+            print(f" [Info] Parsing Key : {catalog.key_path}")
+
+        for service in catalog.select(start=start, drivers=drivers, image_outside=image_outside):
+            if verbose:
+                print(f" [Info] Matched Service: {service.name} ({service.start_type}, {service.image_path})")
+            services.append(service.summary())
     except Exception as e:
         print(f"Error accessing SYSTEM hive for services: {e}")
     return services
 
 ## function to get the details of a specific service by name
+@measured
+@cached
 def get_service_details(hive_path, service_name, verbose=False):
     try:
-        registry = Registry.Registry(hive_path)
-        service_key_path = f"ControlSet001\\Services\\{service_name}"
-        service_key = registry.open(service_key_path)
+        from src.services import service_catalog
+        catalog = service_catalog(hive_path)
+        service_key_path = f"{catalog.key_path}\\{service_name}"
+        service = catalog.get(service_name)
+        if service is None:
+            raise Registry.RegistryKeyNotFoundException(service_key_path)
 
         if verbose:
             print(f" [Info] Parsing Key : {service_key_path}")
 
         details = {}
-        for value in service_key.values():
-            details[value.name()] = value.value()
+        values = service.values
+        for name, data in values.items():
+            details[name] = data
             if verbose:
-                print(f" [Info] Value Name: {value.name()}, Value Type: {value.value_type_str()}")
-                print(f" [Info] Value Data: {value.value()}")
+                print(f" [Info] Value Name: {name}, Value Type: {values.type_str(name)}")
+                print(f" [Info] Value Data: {data}")
         return details
     except Exception as e:
         print(f"Error accessing SYSTEM hive for service details: {e}")
@@ -204,10 +264,12 @@ def _convert_install_time(val):
     return human_readable
 
 ## function to get the windows version from SYSTEM hive
+@measured
+@cached
 def get_windows_version(hive_path, verbose=False):
     try:
         data = {}
-        registry = Registry.Registry(hive_path)
+        registry = open_hive(hive_path)
         current_version_key = registry.open('Microsoft\\Windows NT\\CurrentVersion')
 
         ## verbose output
@@ -261,23 +323,26 @@ def get_windows_version(hive_path, verbose=False):
 ## function to list the values under a given key
 ## fucntion to get the values under a given key or a specific value in a key
 
+@measured
 def get_key_values(hive_path, key_path, verbose=False):
     values_dict = {}
     try:
-        registry = Registry.Registry(hive_path)
-        key = registry.open(key_path)
+        if _is_snapshot(hive_path):
+            values = hive_path.key_values(key_path)
+        else:
+            values = KeyValues(open_hive(hive_path).open(key_path))
 
         if verbose:
             print(f" [Info] Parsing Key : {key_path}")
 
-        for value in key.values():
-            values_dict[value.name()] = value.value()
+        for name, data in values.items():
+            values_dict[name] = data
             if verbose:
-                print(f" [Info] Value Name: {value.name()}, Value Type: {value.value_type_str()}")
-                print(f" [Info] Value Data: {value.value()}")
+                print(f" [Info] Value Name: {name}, Value Type: {values.type_str(name)}")
+                print(f" [Info] Value Data: {data}")
     except Exception as e:
         print(f"Error accessing hive for key values: {e}")
     return values_dict
 
 
-## function to export the whole hive in a csv, or json format
\ No newline at end of file
+## exporting the whole hive as json/csv lives in src/export.py (export_hive)
\ No newline at end of file
@@ -0,0 +1,321 @@
+import datetime
+import json
+import os
+import sqlite3
+
+from Registry import Registry, RegistryParse
+
+from src.fingerprint import cache_path, fingerprint_matches, hive_file, hive_fingerprint
+from src.metrics import measured
+from src.regf import RegfHive, RegfValue
+
+
+## Persistent key/value index for a hive.
+##
+## One walk over the hive writes every key path (in depth-first order, the
+## same order list_all_keys_recursive and search_keys_by_keyword produce),
+## its LastWrite time, and each value's name, type and data when the data
+## is small. Keys are numbered in pre-order and store the last number in
+## their subtree, so a subtree is one primary-key range scan. Substring
+## search over paths goes through an FTS5 trigram index when SQLite has it.
+##
+## The index lives next to the hive as <hive>.regpy-index, or under
+## ~/.cache/regpy when the evidence directory is read-only, and is rebuilt
+## when the hive's size, mtime or content digest no longer match.
+
+SCHEMA_VERSION = 1
+INDEX_SUFFIX = ".regpy-index"
+MAX_VALUE_SIZE = 4096
+BATCH_SIZE = 5000
+
+_SCHEMA = """
+CREATE TABLE meta (k TEXT PRIMARY KEY, v TEXT);
+CREATE TABLE keys (
+    id INTEGER PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    path_lower TEXT NOT NULL,
+    last_write INTEGER NOT NULL
+);
+CREATE INDEX keys_path ON keys (path_lower);
+CREATE TABLE vals (
+    key_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    data
+);
+CREATE INDEX vals_key ON vals (key_id);
+"""
+
+_FTS_SCHEMA = "CREATE VIRTUAL TABLE keys_fts USING fts5(path, content='', tokenize='trigram')"
+
+
+def index_path(hive):
+    """
+    Where the index for a hive is kept: beside it when that directory is
+    writable, otherwise in the user cache directory.
+    """
+    return cache_path(hive, INDEX_SUFFIX)
+
+
+def _encode_value(hive, vk, max_value_size):
+    """Return (kind, data) for storage, data is None when it was too big or not decodable."""
+    size = hive.value_data_length(vk)
+    if size > max_value_size:
+        return "large", None
+    try:
+        data = hive.value_data(vk)
+    except RegistryParse.RegistryException:
+        return "error", None
+    if isinstance(data, str):
+        return "str", data
+    if isinstance(data, bytes):
+        return "bytes", data
+    if isinstance(data, int):
+        ## QWORDs can overflow SQLite's signed 64-bit integers
+        return ("int", data) if data < 2 ** 63 else ("bigint", str(data))
+    if isinstance(data, list) and all(isinstance(s, str) for s in data):
+        return "list", json.dumps(data)
+    if isinstance(data, datetime.datetime):
+        return "datetime", data.isoformat()
+    return "other", None
+
+
+def _decode_value(kind, data):
+    if kind == "list":
+        return json.loads(data)
+    if kind == "bigint":
+        return int(data)
+    if kind == "datetime":
+        return datetime.datetime.fromisoformat(data)
+    return data
+
+
+@measured
+def build_index(hive, db_path=None, max_value_size=MAX_VALUE_SIZE, verbose=False):
+    """
+    Walk the hive once and write a fresh index. Returns the index path.
+    """
+    hive_path = hive_file(hive)
+    db_path = db_path or index_path(hive_path)
+    fingerprint = hive_fingerprint(hive_path)
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    if verbose:
+        print(f" [Info] Building index for {hive_path} -> {db_path}")
+
+    db = sqlite3.connect(tmp_path)
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.executescript(_SCHEMA)
+        try:
+            db.execute(_FTS_SCHEMA)
+            fts = True
+        except sqlite3.OperationalError:
+            fts = False
+
+        key_rows = []
+        value_rows = []
+
+        def flush():
+            db.executemany("INSERT INTO keys VALUES (?, ?, ?, ?, ?)", key_rows)
+            if fts:
+                db.executemany("INSERT INTO keys_fts (rowid, path) VALUES (?, ?)",
+                               [(row[0], "\\" + row[2]) for row in key_rows])
+            db.executemany("INSERT INTO vals VALUES (?, ?, ?, ?, ?, ?)", value_rows)
+            key_rows.clear()
+            value_rows.clear()
+
+        with RegfHive(hive_path) as regf:
+            ## explicit pre-order walk; open_keys holds keys whose subtree is not
+            ## finished yet, a key row is written once its last_id is known
+            next_id = 0
+            open_keys = []
+            stack = [(regf.root_offset(), "", 0)]
+            while stack:
+                nk, path, depth = stack.pop()
+                key_id = next_id
+                next_id += 1
+                while open_keys and open_keys[-1][3] >= depth:
+                    done = open_keys.pop()
+                    key_rows.append((done[0], key_id - 1, done[1], done[1].lower(), done[2]))
+                open_keys.append((key_id, path, regf.key_timestamp(nk), depth))
+
+                for vk in regf.value_offsets(nk):
+                    kind, data = _encode_value(regf, vk, max_value_size)
+                    value_rows.append((key_id, regf.value_name(vk), RegfValue(regf, vk).value_type_str(),
+                                       kind, regf.value_data_length(vk), data))
+
+                prefix = path + "\\" if path else ""
+                for sub in reversed(regf.subkey_offsets(nk)):
+                    stack.append((sub, prefix + regf.key_name(sub), depth + 1))
+
+                if len(key_rows) + len(value_rows) >= BATCH_SIZE:
+                    flush()
+            for done in open_keys:
+                key_rows.append((done[0], next_id - 1, done[1], done[1].lower(), done[2]))
+            flush()
+
+        meta = dict(fingerprint, schema=SCHEMA_VERSION, fts=int(fts), hive_path=os.path.abspath(hive_path),
+                    keys=next_id, max_value_size=max_value_size)
+        db.executemany("INSERT INTO meta VALUES (?, ?)", [(k, json.dumps(v)) for k, v in meta.items()])
+        db.commit()
+    except BaseException:
+        ## no half-written index is left beside the hive
+        db.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        db.close()
+    os.replace(tmp_path, db_path)
+
+    if verbose:
+        print(f" [Info] Indexed {next_id} keys")
+    return db_path
+
+
+class HiveIndex(object):
+    """
+    Read access to an index built by build_index().
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        self.meta = {k: json.loads(v) for k, v in self._db.execute("SELECT k, v FROM meta")}
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def is_current(self, hive):
+        """True when the index still describes the hive file on disk."""
+        if self.meta.get("schema") != SCHEMA_VERSION:
+            return False
+        return fingerprint_matches(self.meta, hive)
+
+    def find_key(self, key_path):
+        """Return (id, last_id, path) of a key, matched case-insensitively."""
+        key_path = key_path.strip("\\").lower()
+        return self._db.execute(
+            "SELECT id, last_id, path FROM keys WHERE path_lower = ? ORDER BY id LIMIT 1", (key_path,)
+        ).fetchone()
+
+    def _subtree(self, start_key):
+        if not start_key:
+            return 0, self.meta["keys"] - 1, ""
+        row = self.find_key(start_key)
+        if row is None:
+            raise Registry.RegistryKeyNotFoundException(start_key)
+        return row
+
+    def _display(self, start_key, base, path):
+        ## rebuild the path exactly as the live walkers print it
+        if path == base:
+            return start_key
+        rest = path[len(base) + 1:] if base else path
+        return f"{start_key}\\{rest}"
+
+    def list_keys(self, start_key=""):
+        first, last, base = self._subtree(start_key)
+        rows = self._db.execute("SELECT path FROM keys WHERE id BETWEEN ? AND ? ORDER BY id", (first, last))
+        return [self._display(start_key, base, path) for (path,) in rows]
+
+    def search_keys(self, keyword, start_key=""):
+        first, last, base = self._subtree(start_key)
+        needle = keyword.lower()
+        if self.meta.get("fts") and len(needle) >= 3:
+            rows = self._db.execute(
+                "SELECT k.path FROM keys_fts f JOIN keys k ON k.id = f.rowid "
+                "WHERE keys_fts MATCH ? AND k.id BETWEEN ? AND ? ORDER BY k.id",
+                ('"' + keyword.replace('"', '""') + '"', first, last))
+        else:
+            rows = self._db.execute("SELECT path FROM keys WHERE id BETWEEN ? AND ? ORDER BY id", (first, last))
+        matches = []
+        for (path,) in rows:
+            display = self._display(start_key, base, path)
+            if needle in display.lower():
+                matches.append(display)
+        return matches
+
+    def key_values(self, key_path):
+        """
+        Return ({name: data}, complete) for a key. complete is False when some
+        value data was too large to keep in the index.
+        """
+        row = self.find_key(key_path)
+        if row is None:
+            raise Registry.RegistryKeyNotFoundException(key_path)
+        values = {}
+        complete = True
+        for name, kind, data in self._db.execute(
+                "SELECT name, kind, data FROM vals WHERE key_id = ? ORDER BY rowid", (row[0],)):
+            if kind in ("large", "error", "other"):
+                complete = False
+                continue
+            values[name or "(default)"] = _decode_value(kind, data)
+        return values, complete
+
+
+def open_index(hive, rebuild=True, verbose=False):
+    """
+    Open the index of a hive, building or rebuilding it first when it is
+    missing or stale. With rebuild=False a missing or stale index returns None.
+    """
+    db_path = index_path(hive)
+    if os.path.exists(db_path):
+        index = HiveIndex(db_path)
+        if index.is_current(hive):
+            return index
+        index.close()
+        if verbose:
+            print(f" [Info] Index {db_path} is stale")
+    if not rebuild:
+        return None
+    build_index(hive, db_path, verbose=verbose)
+    return HiveIndex(db_path)
+
+
+## index-backed versions of the key functions in src/general.py, same
+## arguments and same results
+
+def list_keys_from_index(hive, start_key=""):
+    try:
+        with open_index(hive) as index:
+            return index.list_keys(start_key)
+    except Exception as e:
+        print(f"Error listing keys from index: {e}")
+        return []
+
+
+def search_keys_from_index(hive, keyword, start_key=""):
+    try:
+        with open_index(hive) as index:
+            return index.search_keys(keyword, start_key)
+    except Exception as e:
+        print(f"Error searching keys from index: {e}")
+        return []
+
+
+def get_key_values_from_index(hive, key_path, verbose=False):
+    try:
+        with open_index(hive) as index:
+            values, complete = index.key_values(key_path)
+    except Exception as e:
+        print(f"Error reading key values from index: {e}")
+        return {}
+    if not complete:
+        ## some value data was too large to index, read this key live
+        from src.general import get_key_values
+        return get_key_values(hive, key_path, verbose=verbose)
+    return values
@@ -0,0 +1,247 @@
+import functools
+import time
+
+
+## Run-time metrics for profiling slow hives.
+##
+## Nothing is measured until enable() is called. Counting works by swapping
+## the hot methods of both backends (key listing, value decoding, cell
+## parsing) for counting wrappers while metrics are enabled and putting the
+## originals back on disable(), so a normal run executes exactly the same
+## code as before. Artifact functions are marked with @measured, which costs
+## one global check per call when disabled; when enabled, every outermost
+## call is recorded as a phase with its time, the time spent decoding
+## values and writing output, and the counters it moved.
+
+COUNTERS = ("keys_visited", "values_decoded", "bytes_read", "cells_touched", "output_bytes")
+
+_current = None
+
+
+class Metrics(object):
+    """
+    Counters plus per-phase totals. on_phase, if given, is called with a
+    dict for every finished phase call.
+    """
+
+    def __init__(self, on_phase=None):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.decode_seconds = 0.0
+        self.output_seconds = 0.0
+        self.phases = {}
+        self.on_phase = on_phase
+        self._depth = 0
+
+    def _snapshot(self):
+        return (time.perf_counter(), self.decode_seconds, self.output_seconds, dict(self.counters))
+
+    def _delta(self, start, into=None):
+        now, decode, output, counters = self._snapshot()
+        delta = into if into is not None else dict.fromkeys(("seconds", "decode_seconds", "output_seconds") + COUNTERS, 0)
+        delta["seconds"] += now - start[0]
+        delta["decode_seconds"] += decode - start[1]
+        delta["output_seconds"] += output - start[2]
+        for k in COUNTERS:
+            delta[k] += counters[k] - start[3][k]
+        return delta
+
+    def _record(self, name, delta):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = dict(dict.fromkeys(delta, 0), calls=0)
+        phase["calls"] += 1
+        for k, v in delta.items():
+            phase[k] += v
+        if self.on_phase is not None:
+            self.on_phase(dict(delta, phase=name))
+
+    def to_dict(self):
+        return {"counters": dict(self.counters), "decode_seconds": self.decode_seconds,
+                "output_seconds": self.output_seconds, "phases": self.phases}
+
+    def to_json(self):
+        import json
+        return json.dumps(self.to_dict(), indent=1)
+
+    def report(self):
+        """Summary table, one row per phase."""
+        lines = [f"{'phase':<28}{'calls':>6}{'total s':>9}{'decode s':>10}{'output s':>10}{'other s':>9}"
+                 f"{'keys':>9}{'values':>9}{'cells':>10}{'bytes':>11}"]
+        for name, p in sorted(self.phases.items(), key=lambda item: -item[1]["seconds"]):
+            other = p["seconds"] - p["decode_seconds"] - p["output_seconds"]
+            lines.append(f"{name:<28}{p['calls']:>6}{p['seconds']:>9.3f}{p['decode_seconds']:>10.3f}"
+                         f"{p['output_seconds']:>10.3f}{other:>9.3f}{p['keys_visited']:>9}"
+                         f"{p['values_decoded']:>9}{p['cells_touched']:>10}{p['bytes_read']:>11}")
+        c = self.counters
+        lines.append(f"total: {c['keys_visited']} keys, {c['values_decoded']} values decoded, "
+                     f"{c['cells_touched']} cells, {c['bytes_read']} value bytes, {c['output_bytes']} output bytes, "
+                     f"{self.decode_seconds:.3f}s decoding, {self.output_seconds:.3f}s writing output")
+        return "\n".join(lines)
+
+
+## --- counting wrappers, installed only while enabled ---
+
+def _count_result(*names):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            result = fn(*args, **kwargs)
+            counters = _current.counters
+            for name in names:
+                counters[name] += len(result)
+            return result
+        return wrapper
+    return wrap
+
+
+def _count_call(name):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            _current.counters[name] += 1
+            return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def _timed_decode(length):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args):
+            metrics = _current
+            start = time.perf_counter()
+            try:
+                return fn(self, *args)
+            finally:
+                metrics.decode_seconds += time.perf_counter() - start
+                metrics.counters["values_decoded"] += 1
+                metrics.counters["bytes_read"] += length(self, *args)
+        return wrapper
+    return wrap
+
+
+def _patches():
+    ## imported here: every artifact module imports this one for @measured
+    from Registry import Registry, RegistryParse
+    from src.regf import RegfHive
+    from src.session import CachedRegistry
+
+    return (
+        ## the mmap backend computes nk/vk offsets inline, so cells reached
+        ## through subkey and value lists are counted from the list lengths
+        (RegfHive, "subkey_offsets", _count_result("keys_visited", "cells_touched")),
+        (RegfHive, "value_offsets", _count_result("cells_touched")),
+        (RegfHive, "open", _count_call("keys_visited")),
+        (RegfHive, "cell", _count_call("cells_touched")),
+        (RegfHive, "value_data", _timed_decode(lambda hive, vk: hive.value_data_length(vk))),
+        (Registry.RegistryKey, "subkeys", _count_result("keys_visited")),
+        (Registry.Registry, "open", _count_call("keys_visited")),
+        (CachedRegistry, "open", _count_call("keys_visited")),
+        (RegistryParse.RegistryBlock, "__init__", _count_call("cells_touched")),
+        (Registry.RegistryValue, "value", _timed_decode(lambda value: value._vkrecord.data_length())),
+    )
+
+_originals = []
+
+
+def enable(on_phase=None):
+    """Start collecting metrics into a new Metrics object and return it."""
+    global _current
+    if _current is not None:
+        disable()
+    _current = Metrics(on_phase)
+    for owner, attr, wrap in _patches():
+        original = owner.__dict__[attr]
+        _originals.append((owner, attr, original))
+        setattr(owner, attr, wrap(original))
+    return _current
+
+
+def disable():
+    """Stop collecting and restore the original methods. Returns the Metrics."""
+    global _current
+    metrics = _current
+    while _originals:
+        owner, attr, original = _originals.pop()
+        setattr(owner, attr, original)
+    _current = None
+    return metrics
+
+
+def current():
+    return _current
+
+
+class TimedStream(object):
+    """Text stream proxy that books write time and size as output."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        metrics = _current
+        if metrics is None:
+            return self._stream.write(text)
+        start = time.perf_counter()
+        try:
+            return self._stream.write(text)
+        finally:
+            metrics.output_seconds += time.perf_counter() - start
+            metrics.counters["output_bytes"] += len(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+CO_GENERATOR = 0x20
+
+
+def measured(fn):
+    """
+    Record calls to fn as a phase named after it while metrics are enabled.
+    Generator functions are measured across all of their resumptions, not
+    including the time the consumer spends between items.
+    """
+    name = fn.__name__
+
+    ## every artifact module applies this at import time, so it tests the
+    ## code flag itself rather than importing inspect for it
+    if fn.__code__.co_flags & CO_GENERATOR:
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            if _current is None or _current._depth:
+                yield from fn(*args, **kwargs)
+                return
+            metrics = _current
+            gen = fn(*args, **kwargs)
+            delta = None
+            try:
+                while True:
+                    start = metrics._snapshot()
+                    metrics._depth += 1
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        metrics._depth -= 1
+                        delta = metrics._delta(start, delta)
+                    yield item
+            finally:
+                gen.close()
+                metrics._record(name, delta)
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current is None or _current._depth:
+            return fn(*args, **kwargs)
+        metrics = _current
+        start = metrics._snapshot()
+        metrics._depth += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics._depth -= 1
+            metrics._record(name, metrics._delta(start))
+    return wrapper
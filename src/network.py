@@ -1,10 +1,15 @@
 from Registry import Registry
+from src.metrics import measured
+from src.resultcache import cached
+from src.session import open_hive
 import ipaddress, binascii
 
+@measured
+@cached
 def get_nic_names(system_path, verbose=False):
     nic_names = {}
     try:
-        registry = Registry.Registry(system_path)
+        registry = open_hive(system_path)
         interfaces_key = registry.open("ControlSet001\\Services\\Tcpip\\Parameters\\Interfaces")
         for nic_key in interfaces_key.subkeys():
             guid = nic_key.name()
@@ -20,10 +25,12 @@ def get_nic_names(system_path, verbose=False):
     return nic_names
 
 
+@measured
+@cached
 def get_nic_details(system_path, guid, verbose=False):
     details = {}
     try:
-        registry = Registry.Registry(system_path)
+        registry = open_hive(system_path)
         interface_key_path = f"ControlSet001\\Services\\Tcpip\\Parameters\\Interfaces\\{guid}"
         interface_key = registry.open(interface_key_path)
         for value in interface_key.values():
@@ -46,6 +53,8 @@ def get_nic_details(system_path, guid, verbose=False):
 
 
 ### function to get the list of dns servers for all nics
+@measured
+@cached
 def get_dns_servers(system_path, verbose=False):
 
     """
@@ -55,7 +64,7 @@ def get_dns_servers(system_path, verbose=False):
 
     dns_servers = {}
     try:
-        registry = Registry.Registry(system_path)
+        registry = open_hive(system_path)
         interfaces_key = registry.open("ControlSet001\\Services\\Tcpip\\Parameters\\Interfaces")
         for nic_key in interfaces_key.subkeys():
             guid = nic_key.name()
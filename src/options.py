@@ -0,0 +1,35 @@
+import importlib
+
+
+## Names shared by the command line and the modules behind it.
+##
+## Building the argument parser (and answering --help) needs the choices of
+## a few options but none of the parsing code, so they live here, in a
+## module that imports nothing heavy. The modules that use them import them
+## from here as well. Artifact functions are named by "module:function" and
+## only imported by load(), the first time one of them is actually run.
+
+BACKENDS = ("registry", "mmap")
+BINARY_ENCODINGS = ("hex", "base64")
+START_TYPES = {0: "boot", 1: "system", 2: "auto", 3: "demand", 4: "disabled"}
+SERVER_ENV = "REGPY_SERVER"
+
+## artifact name -> (hive kind, "module:function")
+ARTIFACTS = {
+    "users": ("sam", "src.users:get_user_names"),
+    "accounts": ("sam", "src.users:get_user_accounts"),
+    "user_sids": ("software", "src.users:get_user_sids"),
+    "winver": ("software", "src.general:get_windows_version"),
+    "installed_apps": ("software", "src.general:get_installed_apps"),
+    "services": ("system", "src.general:get_services"),
+    "drivers": ("system", "src.general:get_drivers"),
+    "shares": ("system", "src.general:get_shares"),
+    "nics": ("system", "src.network:get_nic_names"),
+    "dns": ("system", "src.network:get_dns_servers"),
+}
+
+
+def load(target):
+    """The function named by "module:function", importing its module if needed."""
+    module, _, name = target.partition(":")
+    return getattr(importlib.import_module(module), name)
@@ -0,0 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from src.fingerprint import hive_file
+from src.session import HiveSession, open_hive
+from src.walk import walk_keys
+
+
+## Whole-hive walks spread across processes.
+##
+## The parent expands the top levels of the tree until there are enough
+## subtrees to keep every worker busy, producing a plan: the keys above the
+## split (printed by the parent) interleaved, in pre-order, with subtree
+## tasks. Each worker opens its own read-only handle to the hive once and
+## walks the subtrees it is handed. Results are consumed in plan order, so
+## the output is exactly what the single-process walk produces.
+
+SUBTREES_PER_JOB = 8
+MAX_SPLIT_DEPTH = 4
+
+_worker_session = None
+
+
+def _init_worker(hive_path, backend):
+    global _worker_session
+    _worker_session = HiveSession(hive_path, backend=backend)
+
+
+def _walk_subtree(task):
+    key_path, display, keyword, max_depth = task
+    prefix_len = len(key_path)
+    out = []
+    for path, _ in walk_keys(_worker_session, key_path, max_depth=max_depth):
+        path = display + path[prefix_len:]
+        if keyword is None or keyword in path.lower():
+            out.append(path)
+    return out
+
+
+def _plan(registry, start_key, jobs, max_depth):
+    """
+    Split the tree below start_key into ("key", display) and
+    ("subtree", key path, display, depth) entries in pre-order.
+    """
+    root = registry.open(start_key) if start_key else registry.root()
+    key_path = start_key.strip("\\")
+    plan = [("subtree", key_path, start_key or "", 0, root)]
+    target = max(jobs, 1) * SUBTREES_PER_JOB
+
+    for _ in range(MAX_SPLIT_DEPTH):
+        if sum(1 for entry in plan if entry[0] == "subtree") >= target:
+            break
+        expanded = []
+        grew = False
+        for entry in plan:
+            if entry[0] != "subtree" or (max_depth is not None and entry[3] >= max_depth):
+                expanded.append(entry)
+                continue
+            _, path, display, depth, key = entry
+            expanded.append(("key", display))
+            for subkey in key.subkeys():
+                name = subkey.name()
+                expanded.append(("subtree", f"{path}\\{name}" if path else name,
+                                 f"{display}\\{name}", depth + 1, subkey))
+            grew = True
+        plan = expanded
+        if not grew:
+            break
+    return [entry[:4] for entry in plan]
+
+
+def iter_keys_parallel(hive, start_key="", keyword=None, jobs=None, max_depth=None, max_keys=None):
+    """
+    Yield the same paths as walk_keys (filtered by keyword, if given) using
+    `jobs` worker processes. Walks that stop early (max_keys) or hives with
+    no file path behind them run in this process instead.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    needle = keyword.lower() if keyword is not None else None
+    hive_path = hive_file(hive)
+    backend = getattr(hive, "backend", "registry")
+
+    if jobs <= 1 or max_keys is not None or not isinstance(hive_path, (str, os.PathLike)):
+        for path, _ in walk_keys(hive, start_key, max_depth=max_depth, max_keys=max_keys):
+            if needle is None or needle in path.lower():
+                yield path
+        return
+
+    plan = _plan(open_hive(hive), start_key, jobs, max_depth)
+    tasks = [(path, display, needle, None if max_depth is None else max_depth - depth)
+             for _, path, display, depth in (entry for entry in plan if entry[0] == "subtree")]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(hive_path, backend)) as pool:
+        results = pool.map(_walk_subtree, tasks)
+        for entry in plan:
+            if entry[0] == "subtree":
+                yield from next(results)
+            elif needle is None or needle in entry[1].lower():
+                yield entry[1]
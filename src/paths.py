@@ -0,0 +1,54 @@
+## Key path resolution cache.
+##
+## Opening "A\B\C" descends from the root one subkey-list lookup per
+## component, and artifact functions open many paths that share long
+## prefixes (ControlSet001\Services\..., ...\Control\Network\{...}\<guid>).
+## A KeyPathCache is a trie of the components already resolved, each node
+## holding the key it led to, so a repeated or sibling path only looks up
+## the components that were never seen before. Components are matched
+## case-insensitively, as Windows does. Hives are read-only here, so entries
+## never go stale; the trie is simply dropped when an open() starts while it
+## holds max_nodes keys (so it may grow past that by one path's components).
+
+MAX_NODES = 100000
+
+
+class KeyPathCache(object):
+    """
+    Resolves backslash separated key paths below root. child(key, name)
+    returns the subkey of key called name or raises the backend's
+    RegistryKeyNotFoundException; it is only called on a cache miss.
+    """
+
+    __slots__ = ("_root", "_child", "_size", "max_nodes")
+
+    def __init__(self, root, child, max_nodes=MAX_NODES):
+        ## a node is [key, {lowercase name: node}]
+        self._root = [root, {}]
+        self._child = child
+        self._size = 0
+        self.max_nodes = max_nodes
+
+    def __len__(self):
+        return self._size
+
+    def clear(self):
+        self._root[1] = {}
+        self._size = 0
+
+    def open(self, path):
+        ## dropped only here, before the descent: clearing halfway down would
+        ## leave the nodes added below in a subtree nothing points to
+        if self._size >= self.max_nodes:
+            self.clear()
+        node = self._root
+        for part in path.split("\\"):
+            if not part:
+                continue
+            children = node[1]
+            child = children.get(part.lower())
+            if child is None:
+                child = children[part.lower()] = [self._child(node[0], part), {}]
+                self._size += 1
+            node = child
+        return node[0]
@@ -0,0 +1,243 @@
+import fnmatch
+import itertools
+import re
+
+from src.metrics import measured
+from src.regf import RegfHive
+from src.session import open_hive
+from src.snapshot import HiveSnapshot
+
+
+## Wildcard path queries.
+##
+##   ControlSet00*\Services\*\ImagePath    ImagePath of every service of every control set
+##   **\Run\*                              every value of every Run key
+##   Microsoft\Windows NT\CurrentVersion\  the key itself (a trailing \ selects keys)
+##
+## A query is split on "\": every component but the last matches a key
+## name, the last one a value name ("(default)" for the unnamed value), or
+## nothing after a trailing "\", and then the matched keys are the result.
+## Matching is case-insensitive, as in Windows. compile_query() turns the
+## components into a plan of steps, so a query only enters keys that can
+## still match:
+##
+##   lookup  a name without wildcards: one subkey lookup (by lh name hash on
+##           the mmap backend, through the wide-key map of a snapshot), the
+##           sibling keys are never read
+##   glob    *, ? and [...]: the subkey list is read and only the children
+##           whose names match are entered
+##   any     "**", zero or more levels of keys: the only step that walks a
+##           whole subtree
+##
+## The plan runs over offsets of a RegfHive, over the python-registry
+## buffer for that backend (as CachedRegistry does for its lookups), or
+## over a HiveSnapshot. Value data is decoded only for values that match.
+## Paths have the form of the key walkers' (src.walk): the start key, then
+## "\<name>" per level.
+
+DEFAULT_VALUE = "(default)"
+
+
+class QueryStep(object):
+    """One component of a query: kind is "lookup", "glob" or "any"."""
+
+    __slots__ = ("kind", "text", "lower", "_glob")
+
+    def __init__(self, text):
+        self.text = text
+        self.lower = text.lower()
+        self._glob = None
+        if text == "**":
+            self.kind = "any"
+        elif any(ch in text for ch in "*?["):
+            self.kind = "glob"
+            self._glob = re.compile(fnmatch.translate(text), re.IGNORECASE | re.DOTALL).match
+        else:
+            self.kind = "lookup"
+
+    def matches(self, name):
+        if self._glob is not None:
+            return self._glob(name) is not None
+        return self.kind == "any" or name.lower() == self.lower
+
+    def __repr__(self):
+        return f"{self.text} ({self.kind})"
+
+
+class QueryPlan(object):
+    """
+    A compiled query: key steps, then the value step (None when the query
+    selects keys).
+    """
+
+    def __init__(self, query, steps, value):
+        self.query = query
+        self.steps = steps
+        self.value = value
+
+    def __repr__(self):
+        return f"<QueryPlan {self.describe()}>"
+
+    def describe(self):
+        parts = [repr(step) for step in self.steps]
+        parts.append(f"value {self.value!r}" if self.value is not None else "keys")
+        return " > ".join(parts)
+
+
+def compile_query(query):
+    """QueryPlan of a query string; ValueError if it has no components."""
+    parts = query.replace("/", "\\").strip("\\").split("\\") if query.strip("\\/") else []
+    select_keys = not parts or query.endswith(("\\", "/"))
+    if any(not part for part in parts):
+        raise ValueError(f"empty component in query '{query}'")
+    steps = []
+    for part in (parts if select_keys else parts[:-1]):
+        ## "**\**" is one "**"
+        if part == "**" and steps and steps[-1].kind == "any":
+            continue
+        steps.append(QueryStep(part))
+    if select_keys:
+        return QueryPlan(query, steps, None)
+    value = parts[-1]
+    if value == "**":
+        raise ValueError(f"'**' cannot stand for a value name in query '{query}'")
+    return QueryPlan(query, steps, QueryStep(value))
+
+
+class _RegfTree(object):
+    ## nk offsets of a RegfHive
+    def __init__(self, regf):
+        self.regf = regf
+
+    def open(self, key_path):
+        return self.regf.open(key_path).offset() if key_path else self.regf.root_offset()
+
+    def name(self, key):
+        return self.regf.key_name(key)
+
+    def lookup(self, key, name):
+        return self.regf.find_subkey(key, name)
+
+    def children(self, key):
+        return self.regf.subkey_offsets(key)
+
+    def values(self, key):
+        return self.regf.value_offsets(key)
+
+
+class _SnapshotTree(object):
+    ## key numbers of a HiveSnapshot, values from its RegfHive
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    @property
+    def regf(self):
+        return self.snapshot.regf
+
+    def open(self, key_path):
+        return self.snapshot.find(key_path)
+
+    def name(self, key):
+        return self.snapshot.name(key)
+
+    def lookup(self, key, name):
+        return self.snapshot.subkey(key, name)
+
+    def children(self, key):
+        end = self.snapshot.end
+        child = key + 1
+        while child < end[key]:
+            yield child
+            child = end[child]
+
+    def values(self, key):
+        return self.snapshot.value_offsets(key)
+
+
+def _tree(hive):
+    if isinstance(hive, HiveSnapshot):
+        return _SnapshotTree(hive)
+    registry = open_hive(hive)
+    if isinstance(registry, RegfHive):
+        return _RegfTree(registry)
+    return _RegfTree(RegfHive(registry._buf))
+
+
+def _run_plan(tree, plan, start_key):
+    ## depth-first over (key, path, steps): the numbers of the steps the key
+    ## is at, so a key is entered once however many ways a query reaches
+    ## it; a key at the number past the last step is a match
+    steps, last = plan.steps, len(plan.steps)
+    closures = {}
+
+    def closure(indexes):
+        ## "**" also matches zero keys: being at it means being past it too
+        found = closures.get(indexes)
+        if found is None:
+            found, pending = set(), list(indexes)
+            while pending:
+                index = pending.pop()
+                if index not in found:
+                    found.add(index)
+                    if index < last and steps[index].kind == "any":
+                        pending.append(index + 1)
+            found = closures[indexes] = (last in found, tuple(sorted(i for i in found if i < last)))
+        return found
+
+    stack = [(tree.open(start_key), start_key or "", frozenset((0,)))]
+    while stack:
+        key, path, indexes = stack.pop()
+        matched, active = closure(indexes)
+        if matched:
+            yield key, path
+        if not active:
+            continue
+        entered = []
+        if all(steps[index].kind == "lookup" for index in active):
+            ## literal names only: direct lookups, siblings are never read
+            for text in dict.fromkeys(steps[index].lower for index in active):
+                child = tree.lookup(key, text)
+                if child is not None:
+                    nxt = frozenset(i + 1 for i in active if steps[i].lower == text)
+                    entered.append((child, f"{path}\\{tree.name(child)}", nxt))
+        else:
+            for child in tree.children(key):
+                name = tree.name(child)
+                ## "**" stays where it is, other steps move on
+                nxt = frozenset(i if steps[i].kind == "any" else i + 1 for i in active if steps[i].matches(name))
+                if nxt:
+                    entered.append((child, f"{path}\\{name}", nxt))
+        stack.extend(reversed(entered))
+
+
+@measured
+def iter_query(hive, query, start_key=""):
+    """
+    Lazily yield (key path, value name, data) for every value matched by a
+    wildcard query (see compile_query), or (key path, None, None) for every
+    key when the query ends with "\\". hive is a path, HiveSession, parsed
+    hive or HiveSnapshot; the query is relative to start_key.
+    """
+    try:
+        plan = query if isinstance(query, QueryPlan) else compile_query(query)
+        tree = _tree(hive)
+        value = plan.value
+        for key, path in _run_plan(tree, plan, start_key):
+            if value is None:
+                yield path, None, None
+                continue
+            regf = tree.regf
+            for vk in tree.values(key):
+                name = regf.value_name(vk) or DEFAULT_VALUE
+                if value.matches(name):
+                    yield path, name, regf.value_data(vk)
+    except Exception as e:
+        print(f"Error running query '{getattr(query, 'query', query)}': {e}")
+
+
+def query_values(hive, query, start_key="", max_results=None):
+    """
+    List of the (key path, value name, data) matches of a wildcard query,
+    at most max_results of them.
+    """
+    return list(itertools.islice(iter_query(hive, query, start_key), max_results))
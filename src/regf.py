@@ -0,0 +1,446 @@
+import mmap
+import struct
+
+from Registry import Registry, RegistryParse, SettingsParse
+
+from src.archive import MemberBuffer
+from src.paths import KeyPathCache
+from src.replay import open_source
+
+
+## Memory-mapped regf reader.
+##
+## Cells are decoded in place from a memoryview over the mapped hive with
+## struct.unpack_from. Keys and values are small handles holding only an
+## offset, so walking the tree never copies cell bytes or builds the
+## record objects python-registry creates for every nk/vk/list cell.
+## The handles expose the same methods the functions in src/ already use
+## (root/open, name/path/subkeys/values/value, value_type_str/value), so
+## either backend can be passed around through a HiveSession.
+
+HBIN_START = 0x1000
+BIG_DATA_LIMIT = 0x3fd8
+
+_u16 = struct.Struct("<H").unpack_from
+_u32 = struct.Struct("<I").unpack_from
+_u64 = struct.Struct("<Q").unpack_from
+
+## nk fields that are read together on every visit: flags, subkey count,
+## subkey list, value count, value list
+_NK_FLAGS = 0x02
+_NK_TIMESTAMP = 0x04
+_NK_PARENT = 0x10
+_NK_SUBKEY_COUNT = 0x14
+_NK_SUBKEY_LIST = 0x1C
+_NK_VALUE_COUNT = 0x24
+_NK_VALUE_LIST = 0x28
+_NK_NAME_LENGTH = 0x48
+_NK_NAME = 0x4C
+
+_TYPE_NAMES = {
+    getattr(RegistryParse, name): name
+    for name in dir(RegistryParse)
+    if name.startswith("Reg") and isinstance(getattr(RegistryParse, name), int)
+}
+
+_RAW_TYPES = (
+    RegistryParse.RegLink, RegistryParse.RegResourceList,
+    RegistryParse.RegFullResourceDescriptor, RegistryParse.RegResourceRequirementsList,
+)
+_COMPOSITE_TYPES = frozenset(t for t in _TYPE_NAMES if 0x101 <= t <= 0x11F)
+_SIZED_TYPES = frozenset((RegistryParse.RegBin, RegistryParse.RegNone) + _RAW_TYPES) | _COMPOSITE_TYPES
+
+
+def lh_hash(name):
+    """Name hash stored in lh subkey lists: h = h * 37 + upper(c), 32 bit."""
+    h = 0
+    for c in name.upper():
+        h = (h * 37 + ord(c)) & 0xFFFFFFFF
+    return h
+
+
+class RegfError(RegistryParse.RegistryException):
+    def __str__(self):
+        return f"regf parse error: {self._value}"
+
+
+class RegfHive(object):
+    """
+    A registry hive read through a read-only memory map.
+    `source` is a hive path, an open binary file, or any bytes-like buffer.
+    """
+
+    def __init__(self, source):
+        self._mmap = None
+        self._file = None
+        self._paths = None
+        if isinstance(source, str):
+            ## "archive::member", read out of a triage archive (src.archive),
+            ## or a dirty hive with its transaction logs replayed (src.replay)
+            source = open_source(source)
+            if isinstance(source, MemberBuffer):
+                source = source.read()
+            elif not isinstance(source, str):
+                self._file = source
+        if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            buf = source
+        elif hasattr(source, "read"):
+            try:
+                self._mmap = buf = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                ## in-memory streams have nothing to map
+                buf = source.read()
+        else:
+            self._file = open(source, "rb")
+            self._mmap = buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(buf)
+
+        if len(self._buf) < HBIN_START + 0x20 or self._buf[0:4] != b"regf":
+            self.close()
+            raise RegfError("Invalid REGF ID")
+        self._root = self.cell(_u32(self._buf, 0x24)[0])
+        if self._buf[self._root:self._root + 2] != b"nk":
+            self.close()
+            raise RegfError(f"root key at 0x{self._root:x} is not an nk record")
+
+    def close(self):
+        buf, self._buf = getattr(self, "_buf", None), None
+        if buf is not None:
+            buf.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def buffer(self):
+        return self._buf
+
+    def hive_name(self):
+        return str(self._buf[0x30:0x70], "utf-16le").rstrip("\x00")
+
+    def cell(self, hbin_offset):
+        """Absolute offset of the data of the cell at an hbin-relative offset."""
+        return HBIN_START + hbin_offset + 4
+
+    ## --- raw nk access, used directly by hot traversal loops ---
+
+    def root_offset(self):
+        return self._root
+
+    def key_name(self, nk):
+        buf = self._buf
+        length = _u16(buf, nk + _NK_NAME_LENGTH)[0]
+        start = nk + _NK_NAME
+        if _u16(buf, nk + _NK_FLAGS)[0] & 0x0020:
+            return str(buf[start:start + length], "windows-1252")
+        return str(buf[start:start + length], "utf-16le")
+
+    def key_timestamp(self, nk):
+        return _u64(self._buf, nk + _NK_TIMESTAMP)[0]
+
+    def subkey_count(self, nk):
+        count = _u32(self._buf, nk + _NK_SUBKEY_COUNT)[0]
+        return 0 if count == 0xFFFFFFFF else count
+
+    def value_count(self, nk):
+        count = _u32(self._buf, nk + _NK_VALUE_COUNT)[0]
+        return 0 if count == 0xFFFFFFFF else count
+
+    def parent_offset(self, nk):
+        if _u16(self._buf, nk + _NK_FLAGS)[0] & 0x0004:
+            return None
+        return self.cell(_u32(self._buf, nk + _NK_PARENT)[0])
+
+    def subkey_offsets(self, nk):
+        """Offsets of the nk records of every subkey, in subkey list order."""
+        if not self.subkey_count(nk):
+            return []
+        out = []
+        self._read_subkey_list(self.cell(_u32(self._buf, nk + _NK_SUBKEY_LIST)[0]), out)
+        return out
+
+    def _read_subkey_list(self, list_off, out):
+        buf = self._buf
+        sig = bytes(buf[list_off:list_off + 2])
+        count = _u16(buf, list_off + 2)[0]
+        if sig in (b"lf", b"lh"):
+            entries = struct.unpack_from(f"<{count * 2}I", buf, list_off + 4)[::2]
+        elif sig in (b"li", b"ri"):
+            entries = struct.unpack_from(f"<{count}I", buf, list_off + 4)
+        else:
+            raise RegfError(f"unsupported subkey list {sig!r} at 0x{list_off:x}")
+
+        if sig == b"ri":
+            for rel in entries:
+                self._read_subkey_list(self.cell(rel), out)
+        else:
+            out.extend(HBIN_START + rel + 4 for rel in entries)
+
+    def value_offsets(self, nk):
+        count = self.value_count(nk)
+        if not count:
+            return ()
+        list_off = self.cell(_u32(self._buf, nk + _NK_VALUE_LIST)[0])
+        return tuple(HBIN_START + rel + 4 for rel in struct.unpack_from(f"<{count}I", self._buf, list_off))
+
+    def find_subkey(self, nk, name):
+        """
+        Offset of the subkey called name (case-insensitive), or None. lh
+        lists are searched by name hash, so only the nk records whose hash
+        matches have their names decoded.
+        """
+        if not self.subkey_count(nk):
+            return None
+        name_hash = lh_hash(name) if name.isascii() else None
+        return self._find_in_list(self.cell(_u32(self._buf, nk + _NK_SUBKEY_LIST)[0]), name.lower(), name_hash)
+
+    def _find_in_list(self, list_off, lower, name_hash):
+        buf = self._buf
+        sig = bytes(buf[list_off:list_off + 2])
+        count = _u16(buf, list_off + 2)[0]
+        if sig == b"ri":
+            for rel in struct.unpack_from(f"<{count}I", buf, list_off + 4):
+                found = self._find_in_list(self.cell(rel), lower, name_hash)
+                if found is not None:
+                    return found
+            return None
+        if sig in (b"lf", b"lh"):
+            entries = struct.unpack_from(f"<{count * 2}I", buf, list_off + 4)
+            if sig == b"lh" and name_hash is not None:
+                ## entries alternate cell offset, name hash
+                candidates = [entries[i - 1] for i in range(1, count * 2, 2) if entries[i] == name_hash]
+            else:
+                candidates = entries[::2]
+        elif sig == b"li":
+            candidates = struct.unpack_from(f"<{count}I", buf, list_off + 4)
+        else:
+            raise RegfError(f"unsupported subkey list {sig!r} at 0x{list_off:x}")
+        for rel in candidates:
+            off = HBIN_START + rel + 4
+            if self.key_name(off).lower() == lower:
+                return off
+        return None
+
+    ## --- raw vk access ---
+
+    def value_name(self, vk):
+        buf = self._buf
+        length = _u16(buf, vk + 0x02)[0]
+        if not length:
+            return ""
+        if _u16(buf, vk + 0x10)[0] & 1:
+            return str(buf[vk + 0x14:vk + 0x14 + length], "windows-1252")
+        return str(buf[vk + 0x14:vk + 0x14 + length], "utf-16le")
+
+    def value_data_length(self, vk):
+        return _u32(self._buf, vk + 0x04)[0] & 0x7FFFFFFF
+
+    def value_type(self, vk):
+        return _u32(self._buf, vk + 0x0C)[0] & RegistryParse.DEVPROP_MASK_TYPE
+
+    def value_type_str(self, vk):
+        vtype = self.value_type(vk)
+        return _TYPE_NAMES.get(vtype, f"Unknown type: {hex(vtype)}")
+
+    def _big_data(self, cell_off, length):
+        buf = self._buf
+        if buf[cell_off:cell_off + 2] != b"db":
+            return bytes(buf[cell_off:cell_off + length])
+        count, seg_list = struct.unpack_from("<HI", buf, cell_off + 2)
+        seg_list = self.cell(seg_list)
+        chunks = []
+        for rel in struct.unpack_from(f"<{count}I", buf, seg_list):
+            if length <= 0:
+                break
+            size = min(BIG_DATA_LIMIT, length)
+            seg = self.cell(rel)
+            chunks.append(buf[seg:seg + size])
+            length -= size
+        return b"".join(chunks)
+
+    def value_raw_data(self, vk):
+        """Raw value bytes, following python-registry's rules for each type."""
+        buf = self._buf
+        raw_length = _u32(buf, vk + 0x04)[0]
+        vtype = self.value_type(vk)
+        inline = raw_length >= 0x80000000
+        length = raw_length & 0x7FFFFFFF
+        field = vk + 0x08
+
+        if vtype == RegistryParse.RegDWord:
+            return bytes(buf[field:field + 4])
+        if inline or raw_length < 5:
+            if vtype in (RegistryParse.RegSZ, RegistryParse.RegExpandSZ):
+                return bytes(buf[field:field + 4])
+            if vtype == RegistryParse.RegMultiSZ:
+                return b""
+            if vtype in _SIZED_TYPES:
+                if inline:
+                    return bytes(buf[field:field + length])
+            elif vtype not in (RegistryParse.RegQWord, RegistryParse.RegBigEndian, RegistryParse.RegFileTime):
+                ## unknown types keep their data in the offset field
+                return bytes(buf[field:field + 4])
+
+        data = self.cell(_u32(buf, field)[0])
+        if vtype == RegistryParse.RegQWord:
+            return bytes(buf[data:data + 8])
+        if vtype == RegistryParse.RegBigEndian:
+            return bytes(buf[data:data + 4])
+        if BIG_DATA_LIMIT < length:
+            return self._big_data(data, length)
+        return bytes(buf[data:data + length])
+
+    def value_data(self, vk):
+        """Decoded value data, identical to python-registry's RegistryValue.value()."""
+        vtype = self.value_type(vk)
+        d = self.value_raw_data(vk)
+        if vtype in (RegistryParse.RegSZ, RegistryParse.RegExpandSZ):
+            return RegistryParse.decode_utf16le(d)
+        if vtype in (RegistryParse.RegBin, RegistryParse.RegNone) or vtype in _RAW_TYPES:
+            return d
+        if vtype == RegistryParse.RegDWord:
+            return _u32(d, 0)[0]
+        if vtype == RegistryParse.RegMultiSZ:
+            return d.decode("utf16").split("\x00")
+        if vtype == RegistryParse.RegQWord:
+            return _u64(d, 0)[0]
+        if vtype == RegistryParse.RegBigEndian:
+            return struct.unpack_from(">I", d, 0)[0]
+        if vtype in _COMPOSITE_TYPES:
+            d = d[0:-8]
+            return SettingsParse.ParseAppDataCompositeValue(vtype & 0xEFF, d, len(d))
+        if vtype == RegistryParse.RegFileTime:
+            return RegistryParse.parse_windows_timestamp(_u64(d, 0)[0])
+        raw_length = _u32(self._buf, vk + 0x04)[0]
+        if raw_length < 5 or raw_length >= 0x80000000:
+            return _u32(d, 0)[0]
+        raise RegistryParse.UnknownTypeException(f"Unknown VK Record type 0x{vtype:x} at 0x{vk:x}")
+
+    ## --- python-registry compatible surface ---
+
+    def root(self):
+        return RegfKey(self, self._root)
+
+    def open(self, path):
+        ## resolved paths are kept in a trie, see src.paths
+        if self._paths is None:
+            self._paths = KeyPathCache(self.root(), RegfKey.subkey)
+        return self._paths.open(path)
+
+
+class RegfKey(object):
+    __slots__ = ("_hive", "_nk")
+
+    def __init__(self, hive, nk):
+        self._hive = hive
+        self._nk = nk
+
+    def __repr__(self):
+        return f"<RegfKey {self.path()} at 0x{self._nk:x}>"
+
+    def offset(self):
+        return self._nk
+
+    def name(self):
+        return self._hive.key_name(self._nk)
+
+    def path(self):
+        hive = self._hive
+        parts = []
+        seen = set()
+        nk = self._nk
+        while nk is not None:
+            if nk in seen:
+                parts.append("[path cycle]")
+                break
+            seen.add(nk)
+            parts.append(hive.key_name(nk))
+            nk = hive.parent_offset(nk)
+        return "\\".join(reversed(parts))
+
+    def timestamp(self):
+        return RegistryParse.parse_windows_timestamp(self._hive.key_timestamp(self._nk))
+
+    def parent(self):
+        parent = self._hive.parent_offset(self._nk)
+        if parent is None:
+            raise Registry.RegistryKeyHasNoParentException(self.name())
+        return RegfKey(self._hive, parent)
+
+    def subkeys_number(self):
+        return self._hive.subkey_count(self._nk)
+
+    def values_number(self):
+        return self._hive.value_count(self._nk)
+
+    def subkeys(self):
+        hive = self._hive
+        return [RegfKey(hive, off) for off in hive.subkey_offsets(self._nk)]
+
+    def subkey(self, name):
+        off = self._hive.find_subkey(self._nk, name)
+        if off is None:
+            raise Registry.RegistryKeyNotFoundException(self.path() + "\\" + name)
+        return RegfKey(self._hive, off)
+
+    def find_key(self, path):
+        key = self
+        for part in path.split("\\"):
+            if part:
+                key = key.subkey(part)
+        return key
+
+    def values(self):
+        hive = self._hive
+        return [RegfValue(hive, off) for off in hive.value_offsets(self._nk)]
+
+    def value(self, name):
+        if name == "(default)":
+            name = ""
+        wanted = name.lower()
+        hive = self._hive
+        for off in hive.value_offsets(self._nk):
+            if hive.value_name(off).lower() == wanted:
+                return RegfValue(hive, off)
+        raise Registry.RegistryValueNotFoundException(self.path() + " : " + name)
+
+    def __getitem__(self, name):
+        return self.value(name)
+
+
+class RegfValue(object):
+    __slots__ = ("_hive", "_vk")
+
+    def __init__(self, hive, vk):
+        self._hive = hive
+        self._vk = vk
+
+    def __repr__(self):
+        return f"<RegfValue {self.name()} ({self.value_type_str()}) at 0x{self._vk:x}>"
+
+    def offset(self):
+        return self._vk
+
+    def name(self):
+        return self._hive.value_name(self._vk) or "(default)"
+
+    def value_type(self):
+        return self._hive.value_type(self._vk)
+
+    def value_type_str(self):
+        return self._hive.value_type_str(self._vk)
+
+    def raw_data(self):
+        return self._hive.value_raw_data(self._vk)
+
+    def value(self):
+        return self._hive.value_data(self._vk)
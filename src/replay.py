@@ -0,0 +1,438 @@
+from array import array
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from src.archive import MemberBuffer, find_logs, is_member, open_source as archive_source, read_member, source_stat
+
+
+## Transaction log replay for dirty hives.
+##
+## A hive copied off a running system is often "dirty": its base block's
+## primary and secondary sequence numbers differ and the latest changes
+## are only in <hive>.LOG1/.LOG2 (or .LOG). Once enable() is called, every
+## hive opened by path (src.regf, src.session and everything built on them)
+## is checked, and a dirty one with logs beside it is read through a
+## replayed view:
+##
+##   - the primary file is mapped copy-on-write (mmap ACCESS_COPY, a
+##     private mapping), so the pages the logs overwrite are the only ones
+##     the process holds a copy of; the rest is the page cache's
+##   - new-format logs (Windows 8.1+) are sequences of HvLE entries, each a
+##     list of dirty page references and the pages. Entries are applied in
+##     sequence number order, from the log holding the earliest ones,
+##     skipping those the primary already has and stopping at the first
+##     gap. Every entry's header hash (Marvin32) is checked, the hash over
+##     its page data only for the last entry of each log, where a torn
+##     write would be, unless verify_all is set: hashing is most of the cost
+##   - old-format logs hold a base block, a "DIRT" bitmap of dirty 512-byte
+##     sectors and the sectors
+##   - a log that grows the hive past the end of the primary file cannot be
+##     laid over a mapping of it; then (and for hives read out of archives,
+##     already in memory) the view is a private copy
+##
+## Views are kept per process, keyed by the primary's and the logs' size
+## and mtime, so every function and session reading the hive shares one.
+## Nothing is written back to the hive or the logs.
+
+BASE_BLOCK_SIZE = 0x200
+HBIN_START = 0x1000
+SECTOR = 0x200
+PAGE = mmap.PAGESIZE
+MARVIN_SEED = 0x82EF4D887A4E55C5
+
+## regf base block: signature, primary and secondary sequence numbers,
+## timestamp, major, minor, file type, format, root cell, hive bins size
+_BASE_BLOCK = struct.Struct("<4sIIQIIIIII")
+_CHECKSUM = 0x1FC
+## HvLE entry: signature, size, flags, sequence number, hive bins size,
+## dirty page count, hash-1, hash-2
+_LOG_ENTRY = struct.Struct("<4sIIIIIQQ")
+_PAGE_REF = struct.Struct("<II")
+
+FILE_TYPES_OLD_LOG = (1, 2)
+
+_active = None
+_views = {}
+_lock = threading.Lock()
+
+
+def enable(verify_all=False):
+    """Replay the transaction logs of dirty hives opened from now on."""
+    global _active
+    _active = {"verify_all": verify_all}
+
+
+def disable():
+    global _active
+    _active = None
+
+
+def active():
+    return _active is not None
+
+
+## --- checks ---
+
+def marvin32(data, seed=MARVIN_SEED):
+    """Marvin32 hash of data (bytes-like), as the HvLE entry hashes use it."""
+    lo, hi = seed & 0xFFFFFFFF, seed >> 32
+    whole = len(data) & ~3
+    words = array("I")
+    words.frombytes(data[:whole])
+    if sys.byteorder == "big":
+        words.byteswap()
+    tail = bytes(data[whole:]) + b"\x80"
+    for w in (*words, int.from_bytes(tail, "little"), 0):
+        lo = (lo + w) & 0xFFFFFFFF
+        hi ^= lo
+        lo = ((lo << 20) | (lo >> 12)) & 0xFFFFFFFF
+        lo = (lo + hi) & 0xFFFFFFFF
+        hi = ((hi << 9) | (hi >> 23)) & 0xFFFFFFFF
+        hi ^= lo
+        lo = ((lo << 27) | (lo >> 5)) & 0xFFFFFFFF
+        lo = (lo + hi) & 0xFFFFFFFF
+        hi = ((hi << 19) | (hi >> 13)) & 0xFFFFFFFF
+    return (hi << 32) | lo
+
+
+def base_block_checksum(block):
+    words = array("I")
+    words.frombytes(bytes(block[:_CHECKSUM]))
+    if sys.byteorder == "big":
+        words.byteswap()
+    checksum = 0
+    for w in words:
+        checksum ^= w
+    return 1 if checksum == 0 else 0xFFFFFFFE if checksum == 0xFFFFFFFF else checksum
+
+
+def read_base_block(buf):
+    """
+    {"valid", "primary_seq", "secondary_seq", "file_type", "hbins_size"} of
+    the base block at the start of buf; valid means the signature and
+    checksum are right. None if buf is too short to hold one.
+    """
+    if len(buf) < BASE_BLOCK_SIZE:
+        return None
+    signature, primary, secondary, _, _, _, file_type, _, _, hbins_size = _BASE_BLOCK.unpack_from(buf, 0)
+    valid = signature == b"regf" and struct.unpack_from("<I", buf, _CHECKSUM)[0] == base_block_checksum(buf)
+    return {"valid": valid, "primary_seq": primary, "secondary_seq": secondary,
+            "file_type": file_type, "hbins_size": hbins_size}
+
+
+def is_dirty(buf):
+    """True when a hive's base block is damaged or its sequence numbers differ."""
+    block = read_base_block(buf)
+    return block is not None and (not block["valid"] or block["primary_seq"] != block["secondary_seq"])
+
+
+## --- logs ---
+
+class LogEntry(object):
+    """One HvLE entry: sequence number, hive bins size and (offset, data) pages."""
+
+    __slots__ = ("seq", "hbins_size", "pages", "start", "size")
+
+    def __init__(self, seq, hbins_size, pages, start, size):
+        self.seq = seq
+        self.hbins_size = hbins_size
+        self.pages = pages
+        self.start = start
+        self.size = size
+
+
+def read_log_entries(buf):
+    """
+    The HvLE entries of a new-format log, in file order, up to the first
+    one that is not well formed or whose header hash is wrong. Page data
+    are memoryviews into buf.
+    """
+    entries = []
+    offset = BASE_BLOCK_SIZE
+    view = memoryview(buf)
+    while offset + _LOG_ENTRY.size <= len(buf):
+        signature, size, _, seq, hbins_size, count, _, hash2 = _LOG_ENTRY.unpack_from(buf, offset)
+        if signature != b"HvLE" or size < _LOG_ENTRY.size or size % SECTOR or offset + size > len(buf):
+            break
+        if marvin32(view[offset:offset + 32]) != hash2:
+            break
+        refs = offset + _LOG_ENTRY.size
+        data = refs + count * _PAGE_REF.size
+        pages = []
+        for i in range(count):
+            page_offset, page_size = _PAGE_REF.unpack_from(buf, refs + i * _PAGE_REF.size)
+            pages.append((page_offset, view[data:data + page_size]))
+            data += page_size
+        if data > offset + size:
+            break
+        entries.append(LogEntry(seq, hbins_size, pages, offset, size))
+        offset += size
+    return entries
+
+
+def _entry_complete(buf, entry):
+    ## hash-1: Marvin32 of everything after the 40-byte header
+    hash1 = _LOG_ENTRY.unpack_from(buf, entry.start)[6]
+    return marvin32(memoryview(buf)[entry.start + _LOG_ENTRY.size:entry.start + entry.size]) == hash1
+
+
+def read_dirty_sectors(buf, hbins_size):
+    """(offset, data) runs of the dirty sectors of an old-format ("DIRT") log."""
+    if bytes(buf[BASE_BLOCK_SIZE:BASE_BLOCK_SIZE + 4]) != b"DIRT":
+        return []
+    bitmap = bytes(buf[BASE_BLOCK_SIZE + 4:BASE_BLOCK_SIZE + 4 + hbins_size // SECTOR // 8])
+    data = -(-(BASE_BLOCK_SIZE + 4 + len(bitmap)) // SECTOR) * SECTOR
+    view = memoryview(buf)
+    runs = []
+    for index, byte in enumerate(bitmap):
+        if not byte:
+            continue
+        for bit in range(8):
+            if byte >> bit & 1:
+                if data + SECTOR > len(buf):
+                    ## the log ends early: what is there is applied
+                    return [(offset, chunk) for offset, chunk, _ in runs]
+                sector = (index * 8 + bit) * SECTOR
+                if runs and runs[-1][0] + len(runs[-1][1]) == sector and runs[-1][2] + len(runs[-1][1]) == data:
+                    start, _, from_data = runs[-1]
+                    runs[-1] = (start, view[from_data:data + SECTOR], from_data)
+                else:
+                    runs.append((sector, view[data:data + SECTOR], data))
+                data += SECTOR
+    return [(offset, chunk) for offset, chunk, _ in runs]
+
+
+def _plan_new(primary, logs, verify_all):
+    ## (log entries to apply, in order, [(source, buf)] of the logs they come from)
+    chains = []
+    for source, buf in logs:
+        entries = read_log_entries(buf)
+        if entries:
+            chains.append((entries[0].seq, source, buf, entries))
+    if not chains:
+        return [], []
+    chains.sort(key=lambda chain: chain[0])
+    if primary is None or not primary["valid"]:
+        ## nothing to go by but the logs: only the one with the latest entries
+        chains = chains[-1:]
+        floor = None
+    else:
+        floor = primary["secondary_seq"]
+    applied, used = [], []
+    for _, source, buf, entries in chains:
+        taken = []
+        for entry in entries:
+            ## already in the primary, or in the log applied before
+            if floor is not None and entry.seq < floor:
+                continue
+            previous = taken[-1] if taken else applied[-1] if applied else None
+            if previous is not None and entry.seq != previous.seq + 1:
+                break
+            if verify_all and not _entry_complete(buf, entry):
+                break
+            taken.append(entry)
+        if taken and not verify_all and not _entry_complete(buf, taken[-1]):
+            taken.pop()
+        if taken:
+            applied.extend(taken)
+            used.append((source, buf))
+            floor = taken[-1].seq + 1
+    return applied, used
+
+
+class ReplayedView(object):
+    """
+    A dirty hive with its logs laid over it. buffer is the replayed hive
+    (a private mmap or, when it had to be copied, a bytearray or anonymous
+    mmap); the counters say what was replayed.
+    """
+
+    def __init__(self, source, logs):
+        self.source = source
+        self.logs = []
+        self.buffer = None
+        self.format = None
+        self.entries = 0
+        self.pages = 0
+        self.bytes = 0
+        self.touched = 0
+        self.copied = False
+        self.seconds = 0.0
+        self._file = None
+        start = time.perf_counter()
+        log_buffers = [(log, _read_log(log)) for log in logs]
+        primary = self._open_primary(source)
+        block = read_base_block(primary)
+        writes, base, hbins_size = self._plan(block, log_buffers)
+        if writes:
+            self._apply(primary, writes, base, hbins_size)
+        else:
+            self.buffer = primary
+        self.seconds = time.perf_counter() - start
+
+    def _open_primary(self, source):
+        data = archive_source(source)
+        if isinstance(data, MemberBuffer):
+            ## already in memory, unpacked from an archive
+            return data.read()
+        if isinstance(data, str):
+            data = open(data, "rb")
+        self._file = data
+        return mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def _plan(self, block, log_buffers):
+        ## ([(hive bins offset, data)], base block to use or None, hive bins size)
+        verify_all = bool(_active and _active["verify_all"])
+        entries, used = _plan_new(block, log_buffers, verify_all)
+        if entries:
+            self.format = "new"
+            self.logs = [source for source, _ in used]
+            self.entries = len(entries)
+            base = None
+            if block is None or not block["valid"]:
+                base = bytes(used[-1][1][:BASE_BLOCK_SIZE])
+            writes = [page for entry in entries for page in entry.pages]
+            return writes, base, entries[-1].hbins_size
+        ## old format: the valid log with the highest sequence number
+        best = None
+        for source, buf in log_buffers:
+            log_block = read_base_block(buf)
+            if (log_block and log_block["valid"] and log_block["file_type"] in FILE_TYPES_OLD_LOG
+                    and (best is None or log_block["primary_seq"] > best[2]["primary_seq"])):
+                best = (source, buf, log_block)
+        if best is None:
+            return [], None, None
+        source, buf, log_block = best
+        writes = read_dirty_sectors(buf, log_block["hbins_size"])
+        if not writes:
+            return [], None, None
+        self.format = "old"
+        self.logs = [source]
+        self.entries = 1
+        return writes, bytes(buf[:BASE_BLOCK_SIZE]), log_block["hbins_size"]
+
+    def _apply(self, primary, writes, base, hbins_size):
+        end = max([HBIN_START + hbins_size] + [HBIN_START + offset + len(data) for offset, data in writes])
+        if isinstance(primary, bytes):
+            primary = bytearray(primary)
+            primary.extend(bytes(max(0, end - len(primary))))
+            self.copied = True
+        elif end > len(primary):
+            ## grown past the primary file: a mapping of it cannot hold the result
+            grown = mmap.mmap(-1, end)
+            grown[:len(primary)] = primary
+            self._release(primary)
+            primary = grown
+            self.copied = True
+        pages = set()
+        for offset, data in writes:
+            start = HBIN_START + offset
+            primary[start:start + len(data)] = data
+            pages.update(range(start // PAGE, (start + len(data) - 1) // PAGE + 1))
+            self.bytes += len(data)
+        self.pages = len(writes)
+        self.touched = len(pages) * PAGE
+        ## the base block a clean hive would have
+        if base is not None:
+            primary[:BASE_BLOCK_SIZE] = base
+        seq = struct.unpack_from("<I", primary, 4)[0]
+        struct.pack_into("<II", primary, 4, seq, seq)
+        struct.pack_into("<I", primary, 0x28, hbins_size)
+        struct.pack_into("<I", primary, _CHECKSUM, base_block_checksum(primary))
+        self.buffer = primary
+
+    def _release(self, buf):
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        buf, self.buffer = self.buffer, None
+        if buf is not None:
+            self._release(buf)
+
+    def summary(self):
+        if not self.entries:
+            return f"no usable log entries for {self.source}"
+        entries = f"{self.entries} log entr{'y' if self.entries == 1 else 'ies'}"
+        held = "copied in full" if self.copied else f"{self.touched / 1024:.0f} KB of pages held"
+        return (f"replayed {entries} ({self.format} format, {self.pages} runs, {self.bytes / 1024:.0f} KB) "
+                f"from {', '.join(os.path.basename(log) for log in self.logs)} in {self.seconds * 1000:.1f} ms, {held}")
+
+
+def _read_log(source):
+    if is_member(source):
+        data = read_member(source)
+        return data if isinstance(data, bytes) else data.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+## --- views ---
+
+def log_versions(source):
+    """(path, size, mtime) of the hive and its logs while replay is on, None otherwise."""
+    if _active is None:
+        return None
+    versions = []
+    for path in [source] + find_logs(source):
+        st = source_stat(path)
+        versions.append((os.path.abspath(path), st.st_size, st.st_mtime_ns))
+    return tuple(versions)
+
+
+def _primary_dirty(source):
+    if is_member(source):
+        return None
+    with open(source, "rb") as f:
+        return is_dirty(f.read(BASE_BLOCK_SIZE))
+
+
+def replayed(source):
+    """
+    The ReplayedView of a hive path or archive member, shared by every
+    caller until the hive or its logs change; None when replay is off, the
+    hive has no logs or (for a file) nothing in them applies.
+    """
+    versions = log_versions(source)
+    if versions is None or len(versions) < 2:
+        return None
+    with _lock:
+        view = _views.get(versions)
+        if view is not None:
+            return view
+        ## a member's base block is only known once it is unpacked
+        if _primary_dirty(source) is False:
+            return None
+        view = ReplayedView(source, [path for path, _, _ in versions[1:]])
+        if not view.entries and not is_member(source):
+            view.close()
+            return None
+        ## a member is kept either way, it cannot be read again for free
+        _views[versions] = view
+        return view
+
+
+def open_source(source):
+    """Like src.archive.open_source, with the logs of a dirty hive replayed while replay is on."""
+    view = replayed(source) if _active is not None else None
+    if view is None:
+        return archive_source(source)
+    return MemberBuffer(source, view.buffer)
+
+
+def close_views():
+    """Drop every view; those still in use are closed when their last reader goes."""
+    with _lock:
+        for view in _views.values():
+            try:
+                view.close()
+            except BufferError:
+                pass
+        _views.clear()
@@ -0,0 +1,238 @@
+import functools
+import os
+import threading
+import time
+
+
+## Persistent cache of artifact function results.
+##
+## Functions marked @cached (the extractors: Windows version, installed
+## apps, services, DNS servers, ...) look their result up in a SQLite file,
+## ~/.cache/regpy/results.sqlite by default, before touching the hive. The
+## key is the hive's fingerprint (size, mtime and the sampled content
+## digest of src.fingerprint), the function and its arguments, so a hive
+## that changes misses by itself and nothing has to be invalidated. Hive
+## sessions parse lazily, so a run answered from the cache never parses a
+## hive at all; the only file reads are the digest samples, done once per
+## hive file per process.
+##
+## Like src.metrics, nothing happens until enable() is called: a @cached
+## function costs one global check per call until then, and SQLite, pickle,
+## json, hashlib and the fingerprinting modules are only imported once the
+## cache is used. Calls with verbose=True always run (their printed details
+## are the point of them), and empty results are not stored, since the
+## functions return them on errors too.
+## Entries record their size and last use; once the file holds more than
+## max_bytes of results the least recently used are dropped.
+
+CACHE_VERSION = 1
+MAX_BYTES = 256 << 20
+CACHE_FILE = "results.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    function TEXT NOT NULL,
+    hive_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+_active = None
+
+
+def default_path():
+    return os.path.join(os.path.expanduser("~"), ".cache", "regpy", CACHE_FILE)
+
+
+class ResultCache(object):
+    """
+    On-disk LRU of function results, bounded to max_bytes of pickled data.
+    stats counts hits, misses, stores and evictions, in total and per
+    function. Safe to use from several threads and processes.
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        self.path = path or default_path()
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "functions": {}}
+        self._db = None
+        self._pid = None
+        self._digests = {}
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        ## one connection per process: a pool worker forked after the parent
+        ## opened it must not share it
+        if self._db is None or self._pid != os.getpid():
+            import sqlite3
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    ## --- keys ---
+
+    def fingerprint(self, hive_path):
+        """(size, mtime_ns, digest) of a hive file; the digest is read once per file version."""
+        from src.archive import source_stat
+        from src.fingerprint import hive_digest, hive_size
+        from src.replay import log_versions
+
+        st = source_stat(hive_path)
+        ## the logs too while they are replayed (src.replay)
+        version = (os.path.realpath(hive_path), st.st_size, st.st_mtime_ns, log_versions(hive_path))
+        digest = self._digests.get(version)
+        if digest is None:
+            digest = self._digests[version] = hive_digest(hive_path)
+        return hive_size(hive_path, st), st.st_mtime_ns, digest
+
+    def key(self, function, hive_path, args=(), kwargs=None):
+        """Cache key of function(hive, *args, **kwargs); TypeError for arguments JSON cannot hold."""
+        import hashlib
+        import json
+        arguments = json.dumps([list(args), sorted((kwargs or {}).items())])
+        text = json.dumps([CACHE_VERSION, function, self.fingerprint(hive_path), arguments])
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=20).hexdigest()
+
+    ## --- entries ---
+
+    def _count(self, function, stat):
+        self.stats[stat] += 1
+        if function:
+            counts = self.stats["functions"].setdefault(function, {"hits": 0, "misses": 0})
+            counts[stat] += 1
+
+    def get(self, key, function=""):
+        """(True, result) for a stored key, (False, None) otherwise."""
+        import pickle
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT data FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                try:
+                    result = pickle.loads(row[0])
+                except Exception:
+                    row = None
+            if row is None:
+                self._count(function, "misses")
+                return False, None
+            db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._count(function, "hits")
+            return True, result
+
+    def put(self, key, function, hive_path, result):
+        import pickle
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, function, os.path.abspath(hive_path), len(data), time.time(), data))
+            self.stats["stores"] += 1
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        dropped = []
+        for key, size in db.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            dropped.append((key,))
+            total -= size
+        db.executemany("DELETE FROM results WHERE key = ?", dropped)
+        self.stats["evictions"] += len(dropped)
+
+    def call(self, fn, function, hive, args, kwargs):
+        """fn(hive, *args, **kwargs), answered from the cache when it can be."""
+        from src.fingerprint import hive_file
+
+        hive_path = hive_file(hive)
+        if not isinstance(hive_path, str):
+            return fn(hive, *args, **kwargs)
+        try:
+            key = self.key(function, hive_path, args, kwargs)
+            found, result = self.get(key, function)
+        except Exception:
+            ## unreadable hive file, arguments that are not JSON, a locked
+            ## or damaged cache file: just run the function
+            return fn(hive, *args, **kwargs)
+        if found:
+            return result
+        result = fn(hive, *args, **kwargs)
+        if result:
+            try:
+                self.put(key, function, hive_path, result)
+            except Exception:
+                pass
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM results")
+
+    def usage(self):
+        """{"entries", "bytes", "max_bytes", "path"} of the cache file."""
+        with self._lock:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "path": self.path}
+
+    def report(self):
+        """One line of hit/miss counts, plus one per function that was called."""
+        s = self.stats
+        lines = [f"Result cache {self.path}: {s['hits']} hits, {s['misses']} misses, "
+                 f"{s['stores']} stored, {s['evictions']} evicted"]
+        for function, counts in sorted(s["functions"].items()):
+            lines.append(f"  {function:<40}{counts['hits']:>6} hits{counts['misses']:>6} misses")
+        return "\n".join(lines)
+
+
+def enable(cache=None):
+    """Answer @cached functions from cache (a new default ResultCache if None). Returns it."""
+    global _active
+    _active = cache if cache is not None else ResultCache()
+    return _active
+
+
+def disable():
+    """Stop caching. Returns the cache that was active, if any."""
+    global _active
+    cache, _active = _active, None
+    return cache
+
+
+def active():
+    return _active
+
+
+def cached(fn):
+    """Mark an artifact function, whose first argument is a hive, as cacheable."""
+    function = f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(hive, *args, **kwargs):
+        cache = _active
+        if cache is None or kwargs.get("verbose"):
+            return fn(hive, *args, **kwargs)
+        return cache.call(fn, function, hive, args, kwargs)
+    return wrapper
@@ -0,0 +1,163 @@
+from collections import deque
+import re
+
+from src.metrics import measured
+from src.walk import walk_keys
+
+
+## Indicator search over key paths, value names and string value data.
+##
+## Literal indicators are compiled into one Aho-Corasick automaton, so every
+## string in the hive is scanned once no matter how many indicators there
+## are; regexes are compiled once and run alongside it. Only REG_SZ,
+## REG_EXPAND_SZ and REG_MULTI_SZ data is decoded, other values are skipped
+## without reading their data. Matching is case-insensitive like --search.
+
+STRING_TYPES = ("RegSZ", "RegExpandSZ", "RegMultiSZ")
+FIELDS = ("key", "name", "data")
+
+
+class AhoCorasick(object):
+    """
+    Multi-pattern substring matcher. search() returns the indexes of every
+    pattern that occurs in the text in one pass over it.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] = self._out[state] + (index,)
+
+        ## breadth-first pass to set failure links and merge outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text):
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class IndicatorMatcher(object):
+    """
+    Literal keywords (matched through Aho-Corasick) plus regular expressions.
+    match(text) returns the indicators found in text, in indicator order.
+    """
+
+    def __init__(self, keywords=(), regexes=()):
+        self.keywords = [k for k in dict.fromkeys(keywords) if k]
+        self._automaton = AhoCorasick([k.lower() for k in self.keywords])
+        self.regexes = [(r, re.compile(r, re.IGNORECASE)) for r in dict.fromkeys(regexes) if r]
+
+    def __bool__(self):
+        return bool(self.keywords or self.regexes)
+
+    def match(self, text):
+        hits = [self.keywords[i] for i in sorted(self._automaton.search(text.lower()))] if self.keywords else []
+        for source, pattern in self.regexes:
+            if pattern.search(text):
+                hits.append(source)
+        return hits
+
+
+def load_indicators(path):
+    """
+    Read an indicator file: one literal per line, "re:" prefixes a regex,
+    blank lines and lines starting with # are ignored.
+    Returns (keywords, regexes).
+    """
+    keywords = []
+    regexes = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("re:"):
+                regexes.append(line[3:])
+            else:
+                keywords.append(line)
+    return keywords, regexes
+
+
+def _value_strings(value):
+    if value.value_type_str() not in STRING_TYPES:
+        return ()
+    data = value.value()
+    if isinstance(data, list):
+        return [s for s in data if s]
+    return (data,) if data else ()
+
+
+@measured
+def iter_search_values(hive_path, keywords=(), regexes=(), start_key="", fields=FIELDS,
+                       max_results=None, max_depth=None):
+    """
+    Walk the hive once and yield a hit dict for every indicator found in a
+    key path, value name or string value data:
+        {"path", "value", "field", "indicator", "text"}
+    "value" is None for key path hits. Stops after max_results hits.
+    """
+    matcher = IndicatorMatcher(keywords, regexes)
+    if not matcher:
+        return
+    count = 0
+    try:
+        for path, key in walk_keys(hive_path, start_key, max_depth=max_depth):
+            hits = []
+            if "key" in fields:
+                hits.extend((None, "key", indicator, path) for indicator in matcher.match(path))
+            if "name" in fields or "data" in fields:
+                for value in key.values():
+                    name = value.name()
+                    if "name" in fields:
+                        hits.extend((name, "name", indicator, name) for indicator in matcher.match(name))
+                    if "data" in fields:
+                        for text in _value_strings(value):
+                            hits.extend((name, "data", indicator, text) for indicator in matcher.match(text))
+            for value_name, field, indicator, text in hits:
+                yield {"path": path, "value": value_name, "field": field, "indicator": indicator, "text": text}
+                count += 1
+                if max_results is not None and count >= max_results:
+                    return
+    except Exception as e:
+        print(f"Error searching values: {e}")
+
+
+def search_values(hive_path, keywords=(), regexes=(), start_key="", fields=FIELDS,
+                  max_results=None, max_depth=None):
+    return list(iter_search_values(hive_path, keywords, regexes, start_key, fields,
+                                   max_results=max_results, max_depth=max_depth))
@@ -0,0 +1,295 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextlib
+import io
+import ipaddress
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+
+from src.carve import recover_deleted
+from src.client import DEFAULT_ADDRESS, parse_address, request
+from src.export import encode_data
+from src.general import (find_services, get_drivers, get_installed_apps, get_key_values, get_service_details,
+                         get_services, get_shares, get_windows_version, list_all_keys_recursive,
+                         search_keys_by_keyword)
+from src.network import get_dns_servers, get_nic_details, get_nic_names
+from src.query import query_values
+from src.search import search_values
+from src.session import HiveCache
+from src.users import get_user_accounts, get_user_names, get_user_sids
+
+
+## Query daemon: `regpy serve`.
+##
+## Hives are parsed once and kept in a HiveCache shared by every request,
+## so repeated queries pay neither interpreter start-up nor parsing. The
+## server speaks JSON over HTTP on a Unix socket or on localhost TCP and
+## handles each client in its own thread (at most max_clients at a time).
+## Sessions are checked out for the length of a request, so the open-hive
+## cap and idle eviction never close a hive that is being read.
+##
+## Requests are POST /query with {"op": ...}:
+##   call      {"function", "hives": [paths], "kwargs"}: any function in FUNCTIONS
+##   keys, values, search, search_values, query: shortcuts for call, with the
+##             function's keyword arguments given at the top level
+##   run       {"argv", "cwd"}: a regpy command line, answered with its
+##             stdout, stderr and exit status (what the thin client sends)
+## and GET /status lists the open hives. Everything a function prints
+## (errors included) comes back in "messages".
+##
+## Nothing a client sends makes the server write a file: no function in
+## FUNCTIONS writes one (build_index, the *_from_index functions and
+## diff_hives are left out, they save an index or digests beside the
+## hive), and command lines with -o, --batch, --batch-output,
+## --build-index, --use-index, --snapshot or --diff are refused. Results
+## always come back in the reply; the only file the server itself keeps
+## is its own result cache, when started with one.
+
+MAX_CLIENTS = 8
+IDLE_TIMEOUT = 600
+
+FUNCTIONS = {fn.__name__: fn for fn in (
+    list_all_keys_recursive, search_keys_by_keyword, get_key_values, search_values,
+    get_installed_apps, get_shares, get_drivers, get_services, find_services, get_service_details,
+    get_windows_version, get_nic_names, get_nic_details, get_dns_servers, get_user_names, get_user_sids,
+    recover_deleted, get_user_accounts, query_values,
+)}
+ALIASES = {"keys": "list_all_keys_recursive", "values": "get_key_values",
+           "search": "search_keys_by_keyword", "search_values": "search_values", "query": "query_values"}
+
+
+class _ThreadStreams(object):
+    """
+    Stands in for sys.stdout/sys.stderr while serving: each request thread
+    writes to its own buffer, everything else to the original stream.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def target(self):
+        return getattr(self._local, "stream", None) or self._default
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        self.target().flush()
+
+    @contextlib.contextmanager
+    def redirect(self, stream):
+        ## per-thread replacement for contextlib.redirect_stdout
+        previous = getattr(self._local, "stream", None)
+        self._local.stream = stream.target() if isinstance(stream, _ThreadStreams) else stream
+        try:
+            yield stream
+        finally:
+            self._local.stream = previous
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+
+def _json_default(data):
+    if isinstance(data, (set, frozenset, tuple)):
+        return list(data)
+    encoded = encode_data(data)
+    if encoded is data:
+        return str(data)
+    return encoded
+
+
+class RegPyServer(object):
+    """
+    The daemon. hives is a HiveCache; run_cli(argv, cwd, hives, stdout,
+    redirect_stdout) runs a command line for "run" requests and returns
+    its exit status (regpy.py passes its own).
+    """
+
+    def __init__(self, hives, run_cli=None, max_clients=MAX_CLIENTS, idle_timeout=IDLE_TIMEOUT, verbose=False):
+        self.hives = hives
+        self.run_cli = run_cli
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+        self.started = time.time()
+        self.requests = 0
+        self._clients = threading.BoundedSemaphore(max_clients)
+        self._last_sweep = time.monotonic()
+        self._stdout = _ThreadStreams(sys.stdout)
+        self._stderr = _ThreadStreams(sys.stderr)
+
+    ## --- request handling ---
+
+    def handle_query(self, payload):
+        with self._clients:
+            self.requests += 1
+            op = payload.get("op")
+            stdout, stderr = io.StringIO(), io.StringIO()
+            with self._stdout.redirect(stdout), self._stderr.redirect(stderr):
+                if op == "run":
+                    result = self._run(payload, stdout, stderr)
+                elif op == "call" or op in ALIASES:
+                    result = self._call(payload, op)
+                else:
+                    raise ValueError(f"unknown op '{op}'")
+            reply = {"ok": True, "result": result}
+            if op != "run":
+                reply["messages"] = stdout.getvalue() + stderr.getvalue()
+            return reply
+
+    def _call(self, payload, op):
+        params = dict(payload)
+        name = params.pop("function", None) if op == "call" else ALIASES[op]
+        fn = FUNCTIONS.get(name)
+        if fn is None:
+            raise ValueError(f"unknown function '{name}' (choose from {', '.join(sorted(FUNCTIONS))})")
+        params.pop("op")
+        hives = params.pop("hives", None) or [params.pop("hive")]
+        kwargs = params.pop("kwargs", {})
+        kwargs.update(params)
+        with contextlib.ExitStack() as stack:
+            sessions = [stack.enter_context(self.hives.checkout(path)) for path in hives]
+            result = fn(*sessions, **kwargs)
+            if not isinstance(result, (dict, list, str, int, float, type(None))):
+                result = list(result)
+            return result
+
+    def _run(self, payload, stdout, stderr):
+        if self.run_cli is None:
+            raise ValueError("this server does not run command lines")
+        try:
+            status = self.run_cli(payload.get("argv", []), payload.get("cwd") or os.getcwd(), self.hives,
+                                  stdout, self._stdout.redirect)
+        except SystemExit as e:
+            ## argparse errors and --help
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "status": status or 0}
+
+    def status(self):
+        return {"ok": True, "pid": os.getpid(), "uptime_seconds": round(time.time() - self.started, 1),
+                "requests": self.requests, "max_open": self.hives.max_open,
+                "idle_timeout": self.idle_timeout, "hives": self.hives.status()}
+
+    def sweep(self):
+        """Close idle hives, at most every few seconds."""
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        if now - self._last_sweep >= min(self.idle_timeout / 2, 30):
+            self._last_sweep = now
+            closed = self.hives.evict_idle(self.idle_timeout)
+            if closed and self.verbose:
+                print(f" [Info] Closed {closed} idle hive(s)", file=sys.__stderr__)
+
+    ## --- serving ---
+
+    def serve_forever(self, address=DEFAULT_ADDRESS):
+        """Listen on address until interrupted."""
+        httpd = _make_httpd(address, self)
+        print(f" [Info] regpy server listening on {address} ({len(self.hives)} hive(s) loaded)", file=sys.stderr)
+        sys.stdout, sys.stderr = self._stdout, self._stderr
+        try:
+            httpd.serve_forever(poll_interval=0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout, sys.stderr = self._stdout._default, self._stderr._default
+            httpd.server_close()
+            if isinstance(httpd.server_address, str):
+                with contextlib.suppress(OSError):
+                    os.remove(httpd.server_address)
+            self.hives.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "regpy"
+
+    def _reply(self, code, body):
+        data = json.dumps(body, default=_json_default, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self._reply(200, self.server.regpy.status())
+        else:
+            self._reply(404, {"ok": False, "error": f"no such endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/query":
+            self._reply(404, {"ok": False, "error": f"no such endpoint {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+            reply = self.server.regpy.handle_query(payload)
+        except Exception as e:
+            self._reply(400, {"ok": False, "error": f"{type(e).__name__}: {e}"})
+            return
+        self._reply(200, reply)
+
+    def address_string(self):
+        ## Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.regpy.verbose:
+            sys.__stderr__.write(f" [Info] {self.address_string()} {format % args}\n")
+
+
+class _ServiceMixin(object):
+    daemon_threads = True
+
+    def service_actions(self):
+        self.regpy.sweep()
+
+
+class _TCPServer(_ServiceMixin, ThreadingHTTPServer):
+    pass
+
+
+class _UnixServer(_ServiceMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _make_httpd(address, regpy):
+    kind, target = parse_address(address)
+    if kind == "tcp":
+        ## the API has no authentication: it is only ever served to this machine
+        if not _is_loopback(target[0]):
+            raise OSError(f"{target[0]} is not a loopback address, regpy serve only listens on "
+                          "a loopback address (127.0.0.1, localhost) or a Unix socket")
+        httpd = _TCPServer(target, _Handler)
+    else:
+        if os.path.exists(target):
+            try:
+                request(address, "GET", "/status", timeout=2)
+            except OSError:
+                ## left behind by a server that did not shut down cleanly
+                os.remove(target)
+            else:
+                raise OSError(f"a regpy server is already listening on {target}")
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        old_umask = os.umask(0o077)
+        try:
+            httpd = _UnixServer(target, _Handler)
+        finally:
+            os.umask(old_umask)
+    httpd.regpy = regpy
+    return httpd
@@ -0,0 +1,191 @@
+import weakref
+
+from Registry import Registry
+
+from src.options import START_TYPES
+from src.session import open_hive
+from src.values import KeyValues
+
+
+## Services catalog.
+##
+## The Services key of the active control set is walked once and every
+## service becomes a ServiceRecord (a __slots__ row), with a case-insensitive
+## name index over them. Service lists, drivers, service details and filters
+## are all answered from that table, and the catalog is cached per parsed
+## hive, so a HiveSession shared between several of them walks Services
+## only once.
+##
+## Records are filled in lazily: a service's value list is read the first
+## time one of its fields is used and each value is decoded at most once
+## (see src.values), so listing service names costs no more than the walk
+## and a filter on Start decodes nothing else.
+##
+## The active control set is read from Select\Current; ControlSet001 is
+## only a fallback for hives without a usable Select key.
+
+KERNEL_DRIVER = 0x1
+FILE_SYSTEM_DRIVER = 0x2
+
+_catalogs = weakref.WeakKeyDictionary()
+
+
+def current_control_set(hive):
+    """Name of the active control set, e.g. "ControlSet001"."""
+    registry = open_hive(hive)
+    try:
+        current = KeyValues(registry.open("Select")).get("Current")
+    except Registry.RegistryKeyNotFoundException:
+        current = None
+    if not isinstance(current, int) or current <= 0:
+        return "ControlSet001"
+    return f"ControlSet{current:03d}"
+
+
+class ServiceRecord(object):
+    """
+    One service of a ServiceCatalog. Start, Type, ImagePath, DisplayName and
+    ObjectName are attributes (None when unset); parameters holds the values
+    of the Parameters subkey.
+    """
+
+    __slots__ = ("name", "_key", "_values", "_parameters")
+
+    def __init__(self, key):
+        self.name = key.name()
+        self._key = key
+        self._values = None
+        self._parameters = None
+
+    def __repr__(self):
+        return f"<ServiceRecord {self.name}>"
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = KeyValues(self._key)
+        return self._values
+
+    def _field(self, name):
+        try:
+            return self.values.get(name)
+        except Exception:
+            ## unreadable data counts as unset
+            return None
+
+    @property
+    def start(self):
+        return self._field("Start")
+
+    @property
+    def type(self):
+        return self._field("Type")
+
+    @property
+    def image_path(self):
+        return self._field("ImagePath")
+
+    @property
+    def display_name(self):
+        return self._field("DisplayName")
+
+    @property
+    def object_name(self):
+        return self._field("ObjectName")
+
+    @property
+    def parameters(self):
+        """KeyValues of the Parameters subkey (empty dict if there is none)."""
+        if self._parameters is None:
+            try:
+                self._parameters = KeyValues(self._key.subkey("Parameters"))
+            except Registry.RegistryKeyNotFoundException:
+                self._parameters = {}
+        return self._parameters
+
+    @property
+    def start_type(self):
+        start = self.start
+        return START_TYPES.get(start, str(start))
+
+    @property
+    def is_driver(self):
+        service_type = self.type
+        return isinstance(service_type, int) and bool(service_type & (KERNEL_DRIVER | FILE_SYSTEM_DRIVER))
+
+    def value_type(self, name):
+        """Type string of a value of the service key, or None."""
+        return self.values.type_str(name) if name in self.values else None
+
+    def details(self):
+        """Every value of the service key as a name -> data dict."""
+        return dict(self.values.items())
+
+    def summary(self):
+        return {"name": self.name, "start": self.start_type, "type": self.type,
+                "driver": self.is_driver, "image_path": self.image_path,
+                "display_name": self.display_name, "object_name": self.object_name}
+
+
+class ServiceCatalog(object):
+    """
+    Every service of one hive, in hive order, with a case-insensitive
+    name index. Use service_catalog() to get the cached one for a hive.
+    """
+
+    def __init__(self, hive):
+        registry = open_hive(hive)
+        self.control_set = current_control_set(registry)
+        self.key_path = f"{self.control_set}\\Services"
+        self.records = []
+        self._index = {}
+        for subkey in registry.open(self.key_path).subkeys():
+            record = ServiceRecord(subkey)
+            self.records.append(record)
+            self._index.setdefault(record.name.lower(), record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def get(self, name, default=None):
+        return self._index.get(name.lower(), default)
+
+    def names(self):
+        return [record.name for record in self.records]
+
+    def select(self, start=None, drivers=None, image_outside=None):
+        """
+        Records matching every filter given: start is a start type name or
+        number (or a list of them), drivers True/False keeps only drivers or
+        only services, and image_outside keeps those whose ImagePath does not
+        contain that directory (e.g. "System32", case-insensitive).
+        """
+        if start is not None:
+            wanted = start if isinstance(start, (list, tuple, set)) else [start]
+            names = {START_TYPES.get(s, s) if isinstance(s, int) else str(s).lower() for s in wanted}
+        outside = image_outside.strip("\\").lower() if image_outside else None
+        for record in self.records:
+            if start is not None and record.start_type not in names:
+                continue
+            if drivers is not None and record.is_driver != drivers:
+                continue
+            if outside is not None:
+                image = (record.image_path or "").lower()
+                if f"\\{outside}\\" in image or image.startswith(outside + "\\"):
+                    continue
+            yield record
+
+
+def service_catalog(hive):
+    """The ServiceCatalog of a hive path or session, built once per parsed hive."""
+    registry = open_hive(hive)
+    catalog = _catalogs.get(registry)
+    if catalog is None:
+        catalog = _catalogs[registry] = ServiceCatalog(registry)
+    return catalog
@@ -0,0 +1,246 @@
+from collections import OrderedDict
+import contextlib
+import os
+import threading
+import time
+
+from Registry import Registry, RegistryParse
+
+from src.archive import find_logs
+from src.options import BACKENDS
+from src.paths import KeyPathCache
+from src.regf import RegfError, RegfHive
+from src.replay import open_source, replayed
+
+
+## A HiveSession wraps one hive file so that several artifact functions
+## can share a single parse of it. Every function in src/ accepts either
+## a hive path (opened and parsed just for that call) or a HiveSession.
+##
+## Two backends can sit behind a session: "registry" (python-registry, the
+## default) and "mmap" (src.regf, decodes cells in place from a memory map).
+## Both resolve open() paths through a KeyPathCache (src.paths), so paths
+## sharing a prefix are not descended from the root again and again.
+##
+## A hive path may also name a member of a triage archive,
+## "archive.zip::Windows/System32/config/SYSTEM"; src.archive reads it out
+## of the archive for either backend. With src.replay enabled, a dirty
+## hive is read with the transaction logs beside it replayed, again for
+## either backend.
+
+class CachedRegistry(Registry.Registry):
+    """
+    python-registry hive whose open() goes through a KeyPathCache. Subkeys
+    are looked up by lh name hash with a RegfHive over the same bytes
+    instead of building a RegistryKey for every entry of the subkey list.
+    """
+
+    def __init__(self, filelikeobject):
+        super(CachedRegistry, self).__init__(filelikeobject)
+        self._paths = None
+        self._lists = None
+
+    def _subkey(self, key, name):
+        if self._lists is None:
+            return key.subkey(name)
+        nk = self._lists.find_subkey(key._nkrecord.offset(), name)
+        if nk is None:
+            raise Registry.RegistryKeyNotFoundException(key.path() + "\\" + name)
+        return Registry.RegistryKey(RegistryParse.NKRecord(self._buf, nk, key._nkrecord))
+
+    def open(self, path):
+        if self._paths is None:
+            try:
+                self._lists = RegfHive(self._buf)
+            except RegfError:
+                self._lists = None
+            self._paths = KeyPathCache(self.root(), self._subkey)
+        return self._paths.open(path)
+
+
+class HiveSession(object):
+    """
+    An open registry hive shared between artifact functions.
+    The hive is read and parsed the first time it is used and kept until close().
+    """
+
+    def __init__(self, hive_path, backend="registry"):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown hive backend '{backend}', expected one of {BACKENDS}")
+        self.hive_path = hive_path
+        self.backend = backend
+        self._registry = None
+        self._logs = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        state = "closed" if self.closed else "open"
+        return f"<HiveSession {self.hive_path} ({state})>"
+
+    @property
+    def closed(self):
+        return self._registry is None
+
+    @property
+    def registry(self):
+        registry = self._registry
+        if registry is None:
+            ## parsed once even if several threads ask at the same time
+            with self._lock:
+                if self._registry is None:
+                    if self.backend == "mmap":
+                        self._registry = RegfHive(self.hive_path)
+                    else:
+                        self._registry = CachedRegistry(open_source(self.hive_path))
+                registry = self._registry
+        return registry
+
+    @property
+    def logs(self):
+        """Transaction logs (.LOG1, .LOG2) found beside the hive, as hive paths."""
+        if self._logs is None:
+            self._logs = find_logs(self.hive_path)
+        return self._logs
+
+    @property
+    def replay(self):
+        """The ReplayedView the hive is read through (src.replay), None if no log entry was applied."""
+        view = replayed(self.hive_path)
+        return view if view is not None and view.entries else None
+
+    def root(self):
+        return self.registry.root()
+
+    def open(self, key_path):
+        return self.registry.open(key_path)
+
+    def close(self):
+        ## drops the parsed hive buffer, a later call reopens it
+        if isinstance(self._registry, RegfHive):
+            self._registry.close()
+        self._registry = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class HiveCache(object):
+    """
+    Keeps at most max_open HiveSessions alive, keyed by the real path of the
+    hive file. The least recently used session is closed when the cap is hit.
+    Sessions taken with checkout() are never closed while they are in use,
+    and evict_idle() closes the ones nobody has used for a while. All
+    methods are safe to call from several threads.
+    """
+
+    def __init__(self, max_open=8, backend="registry"):
+        self.max_open = max_open
+        self.backend = backend
+        self._sessions = OrderedDict()
+        self._last_used = {}
+        self._in_use = {}
+        self._lock = threading.RLock()
+
+    def _key(self, hive_path):
+        return os.path.realpath(hive_path)
+
+    def get(self, hive_path):
+        if isinstance(hive_path, HiveSession):
+            return hive_path
+        key = self._key(hive_path)
+        with self._lock:
+            self._last_used[key] = time.monotonic()
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                return session
+
+            session = HiveSession(hive_path, backend=self.backend)
+            self._sessions[key] = session
+            self._evict_over_cap()
+            return session
+
+    def _evict_over_cap(self):
+        ## least recently used first, skipping sessions that are checked out
+        for key in list(self._sessions):
+            if len(self._sessions) <= self.max_open:
+                break
+            if not self._in_use.get(key):
+                self._drop(key)
+
+    def _drop(self, key):
+        session = self._sessions.pop(key)
+        self._last_used.pop(key, None)
+        session.close()
+
+    @contextlib.contextmanager
+    def checkout(self, hive_path):
+        """Context manager giving the session of a hive, pinned until exit."""
+        session = self.get(hive_path)
+        key = self._key(session.hive_path)
+        with self._lock:
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            yield session
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+                if not self._in_use[key]:
+                    del self._in_use[key]
+                self._last_used[key] = time.monotonic()
+                self._evict_over_cap()
+
+    def evict_idle(self, max_idle):
+        """Close every session not in use and unused for max_idle seconds. Returns how many."""
+        cutoff = time.monotonic() - max_idle
+        with self._lock:
+            idle = [key for key in self._sessions
+                    if not self._in_use.get(key) and self._last_used.get(key, 0) <= cutoff]
+            for key in idle:
+                self._drop(key)
+        return len(idle)
+
+    def status(self):
+        """[{"path", "backend", "parsed", "in_use", "idle_seconds"}] for every cached hive."""
+        now = time.monotonic()
+        with self._lock:
+            return [{"path": session.hive_path, "backend": session.backend, "parsed": not session.closed,
+                     "in_use": self._in_use.get(key, 0), "idle_seconds": round(now - self._last_used.get(key, now), 1)}
+                    for key, session in self._sessions.items()]
+
+    def close(self, hive_path=None):
+        """Close one hive, or every cached hive when no path is given."""
+        with self._lock:
+            if hive_path is not None:
+                key = self._key(hive_path)
+                if key in self._sessions:
+                    self._drop(key)
+                return
+            while self._sessions:
+                self._drop(next(iter(self._sessions)))
+
+    def __contains__(self, hive_path):
+        return self._key(hive_path) in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_hive(hive):
+    """
+    Return a parsed Registry for a hive path or an open HiveSession.
+    """
+    if isinstance(hive, HiveSession):
+        return hive.registry
+    if isinstance(hive, (Registry.Registry, RegfHive)):
+        return hive
+    return Registry.Registry(open_source(hive))
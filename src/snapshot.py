@@ -0,0 +1,374 @@
+from array import array
+import itertools
+import json
+import os
+import sys
+
+from Registry import Registry
+
+from src.fingerprint import cache_path, fingerprint_matches, hive_file, hive_fingerprint
+from src.metrics import measured
+from src.regf import RegfHive
+from src.values import KeyValues
+
+
+## Compact in-memory snapshot of a whole hive.
+##
+## Instead of one Python object per key and value (a python-registry
+## RegistryKey holds an NKRecord, which holds its own dict and buffer
+## reference, and so on down), a snapshot keeps the tree as a handful of
+## flat arrays indexed by key number, keys numbered in the depth-first
+## pre-order the walkers produce:
+##
+##   parent[i]      number of the parent key (-1 for the root)
+##   end[i]         one past the last key of i's subtree, so the subtree of
+##                  i is the range i..end[i] and the next sibling is end[i]
+##   name_id[i]     index into names, the table of distinct key names (a
+##                  hive repeats a few thousand names over its keys)
+##   last_write[i]  LastWrite FILETIME
+##   value_start[i] where i's values start in value_vk, the offsets of the
+##                  vk records in the hive file
+##
+## That is 24 bytes per key plus 4 per value, whatever the hive. Paths are
+## strings only while a query is building them, key searches test each
+## distinct name once, lookups under keys with many subkeys go through a
+## name map built on first use, and value data is decoded on demand from a
+## RegfHive over the hive file. The arrays support the buffer protocol, so
+## numpy.frombuffer() can view them without a copy.
+##
+## save() writes the arrays as they are laid out in memory next to a JSON
+## header, so load() is a few reads; open_snapshot() keeps the file beside
+## the hive (<hive>.regpy-snapshot, or under ~/.cache/regpy) and rebuilds
+## it when the hive's fingerprint changes, as src.index does.
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".regpy-snapshot"
+MAGIC = b"RPYSNAP\x00"
+## keys with more subkeys than this get a name map once a lookup scans them
+WIDE_KEY = 64
+
+## array name -> typecode, in file order
+ARRAYS = (
+    ("parent", "i"),
+    ("end", "i"),
+    ("name_id", "i"),
+    ("last_write", "Q"),
+    ("value_start", "I"),
+    ("value_vk", "I"),
+)
+
+
+def snapshot_path(hive):
+    """Where the snapshot of a hive is kept, see src.fingerprint.cache_path."""
+    return cache_path(hive, SNAPSHOT_SUFFIX)
+
+
+class HiveSnapshot(object):
+    """
+    Struct-of-arrays copy of a hive's key tree, built by build_snapshot()
+    or read by load(). list_all_keys_recursive, search_keys_by_keyword
+    and get_key_values (and their iter_ versions) take it in place of a
+    hive path; other artifact functions can be given its RegfHive, .regf.
+    """
+
+    def __init__(self, hive_path, arrays, names, meta=None):
+        self.hive_path = hive_path
+        self.meta = meta or {}
+        for name, _ in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.names = names
+        self._lower = None
+        ## key number -> {lowercase subkey name: key number}, for wide keys
+        self._wide = {}
+        self._regf = None
+
+    def __repr__(self):
+        return f"<HiveSnapshot {self.hive_path} ({len(self)} keys)>"
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def regf(self):
+        """RegfHive over the hive file, opened the first time value data is read."""
+        if self._regf is None:
+            self._regf = RegfHive(self.hive_path)
+        return self._regf
+
+    def close(self):
+        if self._regf is not None:
+            self._regf.close()
+            self._regf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def nbytes(self):
+        """Bytes held by the arrays and the name table."""
+        size = sum(a.itemsize * len(a) for a in (getattr(self, name) for name, _ in ARRAYS))
+        return size + sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in self.names)
+
+    ## --- keys ---
+
+    def _lower_names(self):
+        if self._lower is None:
+            self._lower = [name.lower() for name in self.names]
+        return self._lower
+
+    def _child(self, key, part):
+        lower, name_id, end = self._lower_names(), self.name_id, self.end
+        wide = self._wide.get(key)
+        if wide is not None:
+            return wide.get(part)
+        child, stop, seen = key + 1, end[key], 0
+        while child < stop and lower[name_id[child]] != part:
+            child = end[child]
+            seen += 1
+        if seen >= WIDE_KEY:
+            ## scanned a long subkey list: map its names once (the first of
+            ## duplicate names wins, as in the scan)
+            wide = {}
+            sub = key + 1
+            while sub < stop:
+                wide.setdefault(lower[name_id[sub]], sub)
+                sub = end[sub]
+            self._wide[key] = wide
+        return child if child < stop else None
+
+    def subkey(self, key, name):
+        """Number of the subkey called name (case-insensitive) of a key number, or None."""
+        return self._child(key, name.lower())
+
+    def find(self, key_path):
+        """Number of the key at key_path (case-insensitive), like Registry.open()."""
+        key = 0
+        for part in key_path.split("\\"):
+            if not part:
+                continue
+            key = self._child(key, part.lower())
+            if key is None:
+                raise Registry.RegistryKeyNotFoundException(key_path)
+        return key
+
+    def name(self, key):
+        return self.names[self.name_id[key]]
+
+    def path(self, key):
+        """Full path of a key number, without the root's name."""
+        parts = []
+        while self.parent[key] >= 0:
+            parts.append(self.names[self.name_id[key]])
+            key = self.parent[key]
+        return "\\".join(reversed(parts))
+
+    def children(self, key_path=""):
+        """Names of the subkeys of key_path, in hive order."""
+        key = self.find(key_path)
+        names, name_id, end = self.names, self.name_id, self.end
+        out = []
+        child = key + 1
+        while child < end[key]:
+            out.append(names[name_id[child]])
+            child = end[child]
+        return out
+
+    def walk(self, start_key="", max_depth=None, max_keys=None, keyword=None):
+        """
+        Yield (key number, path) for start_key and every key below it, with
+        the same paths, order and limits as src.walk.walk_keys. With keyword,
+        only keys whose path contains it (case-insensitive) are yielded.
+        """
+        first = self.find(start_key)
+        names, name_id, end = self.names, self.name_id, self.end
+        root_path = start_key or ""
+        needle = keyword.lower() if keyword is not None else None
+        if needle is None:
+            hits = None
+        elif "\\" in needle:
+            ## a match can span components, test whole paths
+            hits = False
+        else:
+            ## a component never holds a backslash, so a path matches when
+            ## the start path or one of the names below it does: each
+            ## distinct name is tested once
+            hits = [needle in name for name in self._lower_names()]
+
+        ## open ancestors as (end, path, matched)
+        matched = needle is None or needle in root_path.lower()
+        if matched:
+            yield first, root_path
+        if max_keys is not None and max_keys <= 1 or max_depth is not None and max_depth <= 0:
+            return
+        stack = [(end[first], root_path, matched)]
+        count = 1
+        key, stop = first + 1, end[first]
+        while key < stop:
+            while stack[-1][0] <= key:
+                stack.pop()
+            depth = len(stack)
+            _, parent_path, parent_matched = stack[-1]
+            path = f"{parent_path}\\{names[name_id[key]]}"
+            if hits is None:
+                matched = True
+            elif hits is False:
+                matched = needle in path.lower()
+            else:
+                matched = parent_matched or hits[name_id[key]]
+            if matched:
+                yield key, path
+
+            count += 1
+            if max_keys is not None and count >= max_keys:
+                return
+            if max_depth is not None and depth >= max_depth:
+                key = end[key]
+                continue
+            if end[key] > key + 1:
+                stack.append((end[key], path, matched))
+            key += 1
+
+    def iter_keys(self, start_key="", max_depth=None, max_keys=None):
+        for _, path in self.walk(start_key, max_depth=max_depth, max_keys=max_keys):
+            yield path
+
+    def search(self, keyword, start_key="", max_depth=None, max_keys=None):
+        """Paths containing keyword; max_keys bounds the keys visited, as in iter_search_keys."""
+        for _, path in self.walk(start_key, max_depth=max_depth, max_keys=max_keys, keyword=keyword):
+            yield path
+
+    ## --- values ---
+
+    def value_offsets(self, key):
+        """Offsets of the vk records of a key number in the hive file."""
+        stop = self.value_start[key + 1] if key + 1 < len(self) else len(self.value_vk)
+        return self.value_vk[self.value_start[key]:stop]
+
+    def key_values(self, key_path):
+        """KeyValues (src.values) of the key at key_path, decoded from the hive file."""
+        return KeyValues.from_offsets(self.regf, self.value_offsets(self.find(key_path)))
+
+    ## --- on disk ---
+
+    def save(self, path=None):
+        """Write the snapshot (to snapshot_path() by default). Returns the path."""
+        path = path or snapshot_path(self.hive_path)
+        blob = "".join(self.names).encode("utf-8", "surrogatepass")
+        meta = dict(self.meta, version=SNAPSHOT_VERSION, byteorder=sys.byteorder,
+                    hive_path=os.path.abspath(self.hive_path), names=len(self.names), names_bytes=len(blob),
+                    lengths={name: len(getattr(self, name)) for name, _ in ARRAYS})
+        ## names are stored as one string and split again by their lengths
+        lengths = array("I", map(len, self.names))
+        header = json.dumps(meta).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + len(header).to_bytes(4, "little") + header)
+            for name, _ in ARRAYS:
+                getattr(self, name).tofile(f)
+            lengths.tofile(f)
+            f.write(blob)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path, hive_path=None):
+        """Read a snapshot written by save()."""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a regpy snapshot")
+            meta = json.loads(f.read(int.from_bytes(f.read(4), "little")))
+            if meta.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"{path} has snapshot version {meta.get('version')}, expected {SNAPSHOT_VERSION}")
+            arrays = {}
+            for name, typecode in ARRAYS + (("name_length", "I"),):
+                arrays[name] = a = array(typecode)
+                a.fromfile(f, meta["lengths"][name] if name in meta["lengths"] else meta["names"])
+                if meta["byteorder"] != sys.byteorder:
+                    a.byteswap()
+            text = f.read(meta["names_bytes"]).decode("utf-8", "surrogatepass")
+        offsets = itertools.accumulate(arrays.pop("name_length"), initial=0)
+        names = [text[a:b] for a, b in itertools.pairwise(offsets)]
+        return cls(hive_path or meta["hive_path"], arrays, names, meta)
+
+    def is_current(self, hive=None):
+        """True when the snapshot still describes the hive file on disk."""
+        return fingerprint_matches(self.meta, hive or self.hive_path)
+
+
+@measured
+def build_snapshot(hive, verbose=False):
+    """Walk a hive (path or HiveSession) once and return its HiveSnapshot."""
+    hive_path = hive_file(hive)
+    if verbose:
+        print(f" [Info] Building snapshot of {hive_path}")
+    meta = hive_fingerprint(hive_path)
+    regf = RegfHive(hive_path)
+    try:
+        parent = array("i")
+        name_id = array("i")
+        last_write = array("Q")
+        value_start = array("I")
+        value_vk = array("I")
+        interned = {}
+
+        ## same explicit pre-order walk as src.walk, subkeys in list order
+        stack = [(regf.root_offset(), -1)]
+        while stack:
+            nk, parent_key = stack.pop()
+            key = len(parent)
+            parent.append(parent_key)
+            name = regf.key_name(nk)
+            name_id.append(interned.setdefault(name, len(interned)))
+            last_write.append(regf.key_timestamp(nk))
+            value_start.append(len(value_vk))
+            value_vk.extend(regf.value_offsets(nk))
+            for sub in reversed(regf.subkey_offsets(nk)):
+                stack.append((sub, key))
+
+        ## children come after their parent, so one backward pass settles
+        ## every subtree end before it is passed up
+        end = array("i", range(1, len(parent) + 1))
+        for key in range(len(parent) - 1, 0, -1):
+            up = parent[key]
+            if end[key] > end[up]:
+                end[up] = end[key]
+    except BaseException:
+        regf.close()
+        raise
+
+    arrays = {"parent": parent, "end": end, "name_id": name_id, "last_write": last_write,
+              "value_start": value_start, "value_vk": value_vk}
+    snapshot = HiveSnapshot(hive_path, arrays, list(interned), meta)
+    snapshot._regf = regf
+    if verbose:
+        print(f" [Info] {len(parent)} keys, {len(value_vk)} values, {len(interned)} distinct names")
+    return snapshot
+
+
+def open_snapshot(hive, rebuild=True, save=True, verbose=False):
+    """
+    The snapshot of a hive, read from disk when a current one was saved,
+    otherwise built (and saved, with save). With rebuild=False a missing or
+    stale snapshot returns None.
+    """
+    path = snapshot_path(hive)
+    if os.path.exists(path):
+        try:
+            snapshot = HiveSnapshot.load(path, hive_file(hive))
+            if snapshot.is_current():
+                return snapshot
+            if verbose:
+                print(f" [Info] Snapshot {path} is stale")
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            if verbose:
+                print(f" [Info] Snapshot {path} is unreadable: {e}")
+    if not rebuild:
+        return None
+    snapshot = build_snapshot(hive, verbose=verbose)
+    if save:
+        snapshot.save(path)
+        if verbose:
+            print(f" [Info] Snapshot written to {path}")
+    return snapshot
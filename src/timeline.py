@@ -0,0 +1,132 @@
+import datetime
+import heapq
+import os
+import struct
+import tempfile
+
+from Registry import RegistryParse
+
+from src.export import utc_isoformat
+from src.fingerprint import hive_file
+from src.metrics import measured
+from src.regf import RegfHive
+
+
+## LastWrite timeline across hives.
+##
+## Each hive is walked once over the memory-mapped file. The time window is
+## checked against the raw FILETIME of every key before anything else, so
+## keys outside it never have their names decoded or their paths built;
+## paths are assembled from the parent chain only for keys that are kept.
+## Kept (timestamp, path) pairs are sorted in chunks of at most chunk_keys
+## entries that are spilled to temporary run files, and all runs of all
+## hives are merged with a heap, so memory stays bounded by the chunk size
+## however many keys the hives hold. Only the last hive may keep a single
+## chunk in memory instead of spilling it.
+
+CHUNK_KEYS = 500000
+TIMELINE_FIELDS = ("timestamp", "hive", "path")
+
+_EPOCH = datetime.datetime(1601, 1, 1)
+_RUN_RECORD = struct.Struct("<QI")
+
+
+def to_filetime(dt):
+    """FILETIME (100ns ticks since 1601) of a naive UTC or aware datetime."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // datetime.timedelta(microseconds=1) * 10
+
+
+def hive_label(kind, hive):
+    """SAM/SYSTEM/... for machine hives, NTUSER:<profile folder> for user hives."""
+    if kind.lower() != "ntuser":
+        return kind.upper()
+    path = os.path.abspath(hive_file(hive))
+    return f"NTUSER:{os.path.basename(os.path.dirname(path))}"
+
+
+def iter_key_times(hive, since=None, until=None, start_key=""):
+    """
+    Yield (filetime, path) for every key below start_key whose LastWrite
+    time is within [since, until] (datetimes, either bound optional), in
+    walk order. Paths are formatted like the other walkers.
+    """
+    low = to_filetime(since) if since is not None else None
+    high = to_filetime(until) if until is not None else None
+    with RegfHive(hive_file(hive)) as regf:
+        start = regf.open(start_key).offset() if start_key else regf.root_offset()
+        ## a node is (parent node, nk), the root's parent is None; the path
+        ## is only built by following the chain when a key is kept
+        stack = [(None, start)]
+        while stack:
+            node = stack.pop()
+            nk = node[1]
+            stamp = regf.key_timestamp(nk)
+            if (low is None or stamp >= low) and (high is None or stamp <= high):
+                names = []
+                chain = node
+                while chain[0] is not None:
+                    names.append(regf.key_name(chain[1]))
+                    chain = chain[0]
+                yield stamp, (start_key or "") + "".join("\\" + name for name in reversed(names))
+            for sub in reversed(regf.subkey_offsets(nk)):
+                stack.append((node, sub))
+
+
+def _write_run(directory, chunk):
+    chunk.sort()
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb", buffering=1 << 16) as f:
+        for stamp, key_path in chunk:
+            data = key_path.encode("utf-8")
+            f.write(_RUN_RECORD.pack(stamp, len(data)))
+            f.write(data)
+    return path
+
+
+def _read_run(path, label):
+    with open(path, "rb", buffering=1 << 16) as f:
+        while True:
+            header = f.read(_RUN_RECORD.size)
+            if not header:
+                return
+            stamp, length = _RUN_RECORD.unpack(header)
+            yield stamp, label, f.read(length).decode("utf-8")
+
+
+def _sorted_runs(hive, label, since, until, chunk_keys, directory, in_memory):
+    """
+    Sorted iterators covering one hive: the chunk itself when in_memory is
+    set and the hive fits in one chunk, run files otherwise.
+    """
+    chunk = []
+    run_paths = []
+    for entry in iter_key_times(hive, since, until):
+        chunk.append(entry)
+        if len(chunk) >= chunk_keys:
+            run_paths.append(_write_run(directory, chunk))
+            chunk = []
+    if not run_paths and in_memory:
+        chunk.sort()
+        return [((stamp, label, key_path) for stamp, key_path in chunk)]
+    if chunk:
+        run_paths.append(_write_run(directory, chunk))
+    return [_read_run(path, label) for path in run_paths]
+
+
+@measured
+def iter_timeline(hives, since=None, until=None, chunk_keys=CHUNK_KEYS, tmp_dir=None):
+    """
+    Merge the LastWrite times of several hives into one ascending stream of
+    {"timestamp", "hive", "path"} records. hives is a list of (label, hive)
+    pairs; labels break ties between equal timestamps.
+    """
+    with tempfile.TemporaryDirectory(prefix="regpy-timeline-", dir=tmp_dir) as directory:
+        runs = []
+        for index, (label, hive) in enumerate(hives):
+            runs.extend(_sorted_runs(hive, label, since, until, chunk_keys, directory,
+                                     in_memory=index == len(hives) - 1))
+        for stamp, label, key_path in heapq.merge(*runs):
+            yield {"timestamp": utc_isoformat(RegistryParse.parse_windows_timestamp(stamp)),
+                   "hive": label, "path": key_path}
@@ -1,30 +1,40 @@
 from Registry import Registry
+from src.metrics import measured
+from src.resultcache import cached
+from src.session import open_hive
+from src.values import KeyValues
+import codecs
+import datetime
 import os
+import struct
 import sys
 import re
 
+@measured
 def get_user_names(sam_path, verbose=False):
     try:
-        registry = Registry.Registry(sam_path)
+        registry = open_hive(sam_path)
         users_key = registry.open("SAM\\Domains\\Account\\Users\\Names")
         if verbose:
             print(" [Info] Parsing Key : SAM\\Domains\\Account\\Users\\Names")
 
+        names = []
         print("User Accounts:")
         for user in users_key.subkeys():
             print(user.name())
+            names.append(user.name())
+        return names
     except Exception as e:
         print(f"Error accessing SAM hive: {e}")
         return []
 
 
 def _get_default_value_bytes(key):
-    for v in key.values():
-        # python-registry represents the default value with an empty string name
-        if v.name() == "" or v.name() is None:
-            return v.value()
-    return None
+    # python-registry names the unnamed default value "(default)"
+    return KeyValues(key).get("(default)")
 
+@measured
+@cached
 def get_user_sids(software_path, verbose=False):
     """
     Read the SOFTWARE hive for user SIDs.
@@ -35,7 +45,7 @@ def get_user_sids(software_path, verbose=False):
     """
     sids = {}
     try:
-        registry = Registry.Registry(software_path)
+        registry = open_hive(software_path)
         users_root = registry.open('Microsoft\\Windows NT\\CurrentVersion\\ProfileList')
         
         if verbose:
@@ -72,14 +82,168 @@ def get_user_sids(software_path, verbose=False):
     return sids
 
 
-## function to get user timestamps by username
+## Account records from SAM\Domains\Account\Users\<RID as 8 hex digits>.
 ##
-## This function reads the SAM hive and retrieves user account timestamps
-## such as last login time, password last set time, account creation time, etc.
-##  
-##.  HKLM\SAM\SAM\Domains\Account\Users\<User RID>
+## Every account key holds a fixed-size binary F value and a variable V
+## value. F (0x50 bytes):
 ##
-##.   Last Login Time: Offset 0x30 (8 bytes, Windows FILETIME)
-##.   Password Last Set Time: Offset 0x38 (8 bytes, Windows FILETIME)
-##.   Account Creation Time: Offset 0x40 (8 bytes, Windows FILETIME)
-##
\ No newline at end of file
+##   0x08  last logon               FILETIME
+##   0x18  password last set        FILETIME
+##   0x20  account expires          FILETIME (0x7FFF... for never)
+##   0x28  last failed logon        FILETIME
+##   0x30  RID                      u32
+##   0x38  account control (ACB)    u16 flags
+##   0x40  failed logon count       u16
+##   0x42  logon count              u16
+##
+## V starts with a table of (offset, length, unknown) u32 triples, offsets
+## relative to the end of the table at 0xCC; entries 1, 2 and 3 are the
+## user name, full name and comment in UTF-16. The account's creation time
+## is not stored in either; it is the LastWrite of its Users\Names key.
+##
+## get_user_accounts() only collects the raw F and V bytes per account. The
+## F records are joined into one buffer and decoded in a single
+## struct.iter_unpack pass, and the V tables go through one precompiled
+## Struct, so thousands of accounts cost one pass instead of a slice and an
+## unpack per field per user.
+
+USERS_KEY = "SAM\\Domains\\Account\\Users"
+F_RECORD = struct.Struct("<8xQ8xQQQI4xH6xHH12x")
+V_HEADER = struct.Struct("<12xII4xII4xII")
+V_DATA = 0xCC
+FILETIME_NEVER = (0, 0x7FFFFFFFFFFFFFFF)
+
+## ACB bits of F 0x38
+ACCOUNT_FLAGS = {
+    0x0001: "disabled",
+    0x0002: "home_dir_required",
+    0x0004: "password_not_required",
+    0x0008: "temp_duplicate",
+    0x0010: "normal",
+    0x0020: "mns_logon",
+    0x0040: "interdomain_trust",
+    0x0080: "workstation_trust",
+    0x0100: "server_trust",
+    0x0200: "password_never_expires",
+    0x0400: "locked",
+    0x0800: "encrypted_text_password_allowed",
+    0x1000: "smartcard_required",
+    0x2000: "trusted_for_delegation",
+    0x4000: "not_delegated",
+    0x8000: "use_des_key_only",
+}
+
+ACCOUNT_FIELDS = ("rid", "name", "full_name", "comment", "created", "last_logon", "password_last_set",
+                  "account_expires", "last_failed_logon", "logon_count", "failed_logon_count", "flags")
+
+
+_EPOCH = datetime.datetime(1601, 1, 1)
+_utf16 = codecs.utf_16_le_decode
+
+
+def _filetime(stamp):
+    ## RegistryParse.parse_windows_timestamp's result (100ns ticks rounded
+    ## half-even to microseconds) without its Decimal arithmetic
+    if stamp in FILETIME_NEVER:
+        return None
+    us, rest = divmod(stamp, 10)
+    if rest > 5 or rest == 5 and us & 1:
+        us += 1
+    try:
+        return _EPOCH + datetime.timedelta(0, 0, us)
+    except OverflowError:
+        ## garbage in a damaged record, past year 9999
+        return None
+
+
+## flag names by flags value; accounts of a SAM share a handful of values
+_FLAG_NAMES = {}
+
+
+def _flag_names(flags):
+    names = _FLAG_NAMES.get(flags)
+    if names is None:
+        names = _FLAG_NAMES[flags] = tuple(flag for bit, flag in ACCOUNT_FLAGS.items() if flags & bit)
+    return list(names)
+
+
+def _v_string(v, offset, length):
+    start = V_DATA + offset
+    if not length or start + length > len(v):
+        return ""
+    return _utf16(v[start:start + length], "replace")[0]
+
+
+def decode_accounts(rids, f_records, v_records):
+    """
+    Account rows (dicts of ACCOUNT_FIELDS, without "created") from parallel
+    lists of RIDs and raw F / V bytes, None where a value was missing.
+    """
+    size = F_RECORD.size
+    ## one buffer, one pass: short or missing F records are padded with zeros
+    f_buffer = b"".join((f or b"")[:size].ljust(size, b"\x00") for f in f_records)
+    rows = []
+    for rid, fields, v in zip(rids, F_RECORD.iter_unpack(f_buffer), v_records):
+        last_logon, password_set, expires, last_failed, f_rid, flags, failed, logons = fields
+        if v and len(v) >= V_HEADER.size:
+            name_off, name_len, full_off, full_len, comment_off, comment_len = V_HEADER.unpack_from(v)
+            name, full_name, comment = (_v_string(v, name_off, name_len), _v_string(v, full_off, full_len),
+                                        _v_string(v, comment_off, comment_len))
+        else:
+            name = full_name = comment = ""
+        rows.append({
+            "rid": rid if rid is not None else f_rid,
+            "name": name,
+            "full_name": full_name,
+            "comment": comment,
+            "last_logon": _filetime(last_logon),
+            "password_last_set": _filetime(password_set),
+            "account_expires": _filetime(expires),
+            "last_failed_logon": _filetime(last_failed),
+            "logon_count": logons,
+            "failed_logon_count": failed,
+            "flags": _flag_names(flags),
+        })
+    return rows
+
+
+@measured
+@cached
+def get_user_accounts(sam_path, verbose=False):
+    """
+    Returns one row per account of the SAM hive (a dict of ACCOUNT_FIELDS),
+    in RID order: names and comment from V, logon and password times,
+    counts and flags from F, and the creation time from Users\\Names.
+    """
+    try:
+        registry = open_hive(sam_path)
+        users_key = registry.open(USERS_KEY)
+        if verbose:
+            print(f" [Info] Parsing Key : {USERS_KEY}")
+
+        rids, f_records, v_records = [], [], []
+        created = {}
+        for key in users_key.subkeys():
+            if key.name().lower() == "names":
+                for name_key in key.subkeys():
+                    created[name_key.name().lower()] = name_key.timestamp()
+                continue
+            try:
+                rid = int(key.name(), 16)
+            except ValueError:
+                continue
+            values = KeyValues(key)
+            rids.append(rid)
+            f_records.append(values.raw("F") if "F" in values else None)
+            v_records.append(values.raw("V") if "V" in values else None)
+
+        accounts = decode_accounts(rids, f_records, v_records)
+        for account in accounts:
+            account["created"] = created.get(account["name"].lower())
+        accounts.sort(key=lambda account: account["rid"])
+        if verbose:
+            print(f" [Info] Decoded {len(accounts)} accounts")
+        return [{field: account[field] for field in ACCOUNT_FIELDS} for account in accounts]
+    except Exception as e:
+        print(f"Error reading user accounts from SAM hive: {e}")
+        return []
@@ -0,0 +1,100 @@
+from src.regf import RegfKey
+
+
+## Per-key value view.
+##
+## Looking values up one by one with key.value(name) rescans the key's value
+## list on every call, and every .value() call decodes the data again. A
+## KeyValues reads the value list once into a name -> value map (names are
+## case-insensitive, as in Windows) and decodes data only when a value is
+## read, caching the result. Values that are never read, binary and
+## REG_MULTI_SZ data included, are never decoded.
+##
+## On the mmap backend the map holds raw vk offsets, so not even a value
+## object is built for values that are never used.
+
+_MISSING = object()
+
+
+class KeyValues(object):
+    """
+    Lazy, cached view of the values of one key (python-registry or regf).
+    The unnamed default value is "(default)", as python-registry names it.
+    """
+
+    __slots__ = ("key", "_hive", "_entries", "_decoded")
+
+    def __init__(self, key):
+        self.key = key
+        self._decoded = {}
+        if isinstance(key, RegfKey):
+            self._read_offsets(key._hive, key._hive.value_offsets(key.offset()))
+        else:
+            self._hive = None
+            self._entries = {}
+            for value in key.values():
+                self._entries.setdefault(value.name().lower(), value)
+
+    @classmethod
+    def from_offsets(cls, hive, offsets):
+        """View of the values at the vk offsets of a RegfHive, e.g. from a src.snapshot."""
+        values = cls.__new__(cls)
+        values.key = None
+        values._decoded = {}
+        values._read_offsets(hive, offsets)
+        return values
+
+    def _read_offsets(self, hive, offsets):
+        self._hive = hive
+        self._entries = {}
+        for vk in offsets:
+            ## the first value wins if a hive holds duplicate names
+            self._entries.setdefault((hive.value_name(vk) or "(default)").lower(), vk)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name.lower() in self._entries
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def names(self):
+        if self._hive is not None:
+            return [self._hive.value_name(vk) or "(default)" for vk in self._entries.values()]
+        return [value.name() for value in self._entries.values()]
+
+    def get(self, name, default=None):
+        """Decoded data of the value name, or default if the key has no such value."""
+        lname = name.lower()
+        data = self._decoded.get(lname, _MISSING)
+        if data is not _MISSING:
+            return data
+        entry = self._entries.get(lname, _MISSING)
+        if entry is _MISSING:
+            return default
+        data = self._hive.value_data(entry) if self._hive is not None else entry.value()
+        self._decoded[lname] = data
+        return data
+
+    def __getitem__(self, name):
+        data = self.get(name, _MISSING)
+        if data is _MISSING:
+            raise KeyError(name)
+        return data
+
+    def type_str(self, name):
+        entry = self._entries[name.lower()]
+        if self._hive is not None:
+            return self._hive.value_type_str(entry)
+        return entry.value_type_str()
+
+    def raw(self, name):
+        """Undecoded data bytes of the value name."""
+        entry = self._entries[name.lower()]
+        return self._hive.value_raw_data(entry) if self._hive is not None else entry.raw_data()
+
+    def items(self):
+        """(name, decoded data) for every value, in hive order."""
+        return [(name, self.get(name)) for name in self.names()]
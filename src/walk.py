@@ -0,0 +1,37 @@
+from src.session import open_hive
+
+
+## Iterative key walker shared by the functions that enumerate a hive.
+##
+## Keys come out in the same depth-first pre-order the old recursive
+## helpers used, but from an explicit stack: deep hives cannot hit the
+## recursion limit, and only the pending siblings along the current branch
+## are held, so memory depends on the shape of the tree and not on its size.
+## Paths are formatted the same way as before: the start key as given (or
+## "" for the root) followed by "\<subkey name>" per level.
+
+def walk_keys(hive, start_key="", max_depth=None, max_keys=None):
+    """
+    Lazily yield (path, key) for start_key and every key below it.
+    max_depth limits how many levels below start_key are visited (0 yields
+    only start_key) and max_keys stops the walk after that many keys.
+    """
+    registry = open_hive(hive)
+    root = registry.open(start_key) if start_key else registry.root()
+
+    ## entries are (key, parent path, depth); the root has no parent path
+    stack = [(root, None, 0)]
+    count = 0
+    while stack:
+        key, parent, depth = stack.pop()
+        path = (start_key or "") if parent is None else f"{parent}\\{key.name()}"
+        yield path, key
+
+        count += 1
+        if max_keys is not None and count >= max_keys:
+            return
+        if max_depth is not None and depth >= max_depth:
+            continue
+        subkeys = key.subkeys()
+        for subkey in reversed(subkeys):
+            stack.append((subkey, path, depth + 1))
@@ -0,0 +1,7 @@
+import os
+import sys
+
+## the tests import src as regpy.py does, and the hive writer from benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
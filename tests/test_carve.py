@@ -0,0 +1,27 @@
+import pytest
+
+from src.carve import recover_deleted
+from synth_hive import LAYOUTS, mark_deleted, write_hive
+
+
+def _deleted_paths(root):
+    ## paths as walk_keys and the carver write them: "\<name>" per level below the root
+    paths = set()
+    stack = [(key, "") for key in root.subkeys]
+    while stack:
+        key, parent = stack.pop()
+        path = f"{parent}\\{key.name}"
+        if key.deleted:
+            paths.add(path)
+        stack.extend((sub, path) for sub in key.subkeys)
+    return paths
+
+
+@pytest.mark.parametrize("layout", ["generic", "system"])
+def test_every_deleted_key_is_recovered(tmp_path, layout):
+    root = LAYOUTS[layout](1)
+    assert mark_deleted(root, 25)
+    path = str(tmp_path / f"{layout}.hive")
+    write_hive(path, root)
+    recovered = {record["path"] for record in recover_deleted(path) if record["record"] == "key"}
+    assert recovered == _deleted_paths(root)
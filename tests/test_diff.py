@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from src.diff import DIGEST_SUFFIX, iter_diff
+from synth_hive import BASE_FILETIME, dword, sz, system_hive, write_hive
+
+
+SERVICES = 20
+OLD_STAMP = "2020-01-01T00:00:00+00:00"
+NEW_STAMP = "2020-01-01T00:00:01+00:00"
+SERVICE = "\\ControlSet001\\Services\\Svc0003"
+ADDED = SERVICE + "\\Extra"
+
+## key pairs the walk compares: the root, Select, ControlSet001, its Services
+## and Control, every Services subkey (the services, LanmanServer and Tcpip)
+## and Svc0003's only subkey, Security; all but the five on the changed
+## paths (root, Select, ControlSet001, Services, Svc0003) have equal digests
+COMPARED = 5 + (SERVICES + 2) + 1
+CHANGED = 5
+
+
+def _tree(changed):
+    root = system_hive(services=SERVICES, interfaces=2, shares=1)
+    ## fixed LastWrite times, so that only the changes below differ
+    stack = [root]
+    while stack:
+        key = stack.pop()
+        key.timestamp = BASE_FILETIME
+        stack.extend(key.subkeys)
+    if changed:
+        root.child("Select").values[0] = ("Current", dword(2))
+        service = root.child(SERVICE.lstrip("\\"))
+        service.timestamp = BASE_FILETIME + 10000000
+        service.add("Extra", values=[("Note", sz("added"))], timestamp=BASE_FILETIME + 10000000)
+    return root
+
+
+@pytest.fixture(scope="module")
+def hives(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("diff")
+    old, new = str(directory / "OLD"), str(directory / "NEW")
+    write_hive(old, _tree(False))
+    write_hive(new, _tree(True))
+    return old, new
+
+
+def _record(change, kind, path, value=None, type=None, old=None, new=None):
+    return {"change": change, "kind": kind, "path": path, "value": value, "type": type, "old": old, "new": new}
+
+
+def test_diff_records_and_skipped_subtrees(hives):
+    stats = {}
+    records = list(iter_diff(*hives, cache=False, stats=stats))
+    assert records == [
+        _record("modified", "key", SERVICE, old=OLD_STAMP, new=NEW_STAMP),
+        _record("added", "key", ADDED, new=NEW_STAMP),
+        _record("added", "value", ADDED, "Note", "RegSZ", new="added"),
+        _record("modified", "value", "\\Select", "Current", "RegDWord", old=1, new=2),
+    ]
+    assert stats == {"compared": COMPARED, "skipped": COMPARED - CHANGED}
+
+
+def test_reversed_diff_removes(hives):
+    old, new = hives
+    records = list(iter_diff(new, old, cache=False))
+    assert [(r["change"], r["kind"], r["path"], r["value"]) for r in records] == [
+        ("modified", "key", SERVICE, None),
+        ("removed", "key", ADDED, None),
+        ("removed", "value", ADDED, "Note"),
+        ("modified", "value", "\\Select", "Current"),
+    ]
+
+
+def test_identical_hives_skip_at_the_root(hives):
+    old, _ = hives
+    stats = {}
+    assert list(iter_diff(old, old, cache=False, stats=stats)) == []
+    assert stats == {"compared": 1, "skipped": 1}
+
+
+def test_saved_digests_give_the_same_diff(hives):
+    expected = list(iter_diff(*hives, cache=False))
+    assert list(iter_diff(*hives)) == expected
+    assert all(os.path.exists(hive + DIGEST_SUFFIX) for hive in hives)
+    ## the second run reads the digests saved by the first
+    assert list(iter_diff(*hives)) == expected
@@ -0,0 +1,65 @@
+import os
+
+from src.general import list_all_keys_recursive
+from src.index import build_index, index_path, list_keys_from_index, open_index
+from synth_hive import count_keys, generic_tree, write_hive
+
+
+KEYS = 50
+
+
+def _tree(added=None, renamed=None):
+    root = generic_tree(keys=KEYS, seed=1)
+    if added:
+        root.add(added)
+    if renamed:
+        root.subkeys[0].name = renamed
+    return root
+
+
+def _rewrite(path, root, mtime_ns=None):
+    ## a new mtime unless one is given, whatever the file system's resolution
+    st = os.stat(path)
+    write_hive(path, root)
+    mtime_ns = mtime_ns if mtime_ns is not None else st.st_mtime_ns + 10 ** 9
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_rewritten_hive_is_reindexed(tmp_path):
+    path = str(tmp_path / "SOFTWARE")
+    write_hive(path, _tree())
+    build_index(path)
+    assert list_keys_from_index(path) == list_all_keys_recursive(path)
+
+    _rewrite(path, _tree(added="Added"))
+    keys = list_keys_from_index(path)
+    assert "\\Added" in keys
+    assert keys == list_all_keys_recursive(path)
+    with open_index(path, rebuild=False) as index:
+        assert index.is_current(path)
+
+
+def test_same_size_and_mtime_is_caught_by_the_digest(tmp_path):
+    path = str(tmp_path / "SOFTWARE")
+    write_hive(path, _tree())
+    build_index(path)
+    st = os.stat(path)
+    renamed = "Key999999"
+    assert len(renamed) == len(_tree().subkeys[0].name)
+
+    _rewrite(path, _tree(renamed=renamed), mtime_ns=st.st_mtime_ns)
+    assert os.stat(path).st_size == st.st_size
+    assert open_index(path, rebuild=False) is None
+    keys = list_keys_from_index(path)
+    assert "\\" + renamed in keys
+    assert keys == list_all_keys_recursive(path)
+
+
+def test_current_index_is_not_rebuilt(tmp_path):
+    path = str(tmp_path / "SOFTWARE")
+    write_hive(path, _tree())
+    db_path = build_index(path)
+    assert db_path == index_path(path)
+    built = os.stat(db_path).st_mtime_ns
+    assert len(list_keys_from_index(path)) == count_keys(_tree())
+    assert os.stat(db_path).st_mtime_ns == built
@@ -0,0 +1,90 @@
+import fnmatch
+
+import pytest
+
+from src.query import DEFAULT_VALUE, compile_query, iter_query
+from src.session import HiveSession
+from src.snapshot import build_snapshot
+from src.walk import walk_keys
+from synth_hive import system_hive, write_hive
+
+
+QUERIES = [
+    ## exact paths: lookups only
+    "Select\\Current",
+    "ControlSet001\\Services\\Tcpip\\",
+    ## single-segment globs
+    "ControlSet00*\\Services\\*\\ImagePath",
+    "ControlSet001\\Services\\Svc00?[0-4]\\Start",
+    "ControlSet001\\Services\\LanmanServer\\Shares\\*",
+    ## "**" descents, zero levels included
+    "**\\Parameters\\*",
+    "ControlSet001\\**\\Interfaces\\*\\Dhcp*",
+    "**\\Select\\",
+    "**\\",
+    ## case-insensitive names, literal and glob
+    "controlset001\\SERVICES\\tcpip\\parameters\\",
+    "CONTROLSET00?\\services\\SVC000*\\imagepath",
+]
+
+
+def _matches(parts, patterns):
+    ## brute force: "**" is any number of keys, everything else one key
+    if not patterns:
+        return not parts
+    if patterns[0] == "**":
+        return any(_matches(parts[i:], patterns[1:]) for i in range(len(parts) + 1))
+    return bool(parts) and fnmatch.fnmatchcase(parts[0].lower(), patterns[0].lower()) and _matches(parts[1:], patterns[1:])
+
+
+def _brute_force(path, query):
+    patterns = query.strip("\\").split("\\")
+    select_keys = query.endswith("\\")
+    key_patterns = patterns if select_keys else patterns[:-1]
+    found = []
+    for key_path, key in walk_keys(path):
+        if not _matches(key_path.split("\\")[1:], key_patterns):
+            continue
+        if select_keys:
+            found.append((key_path, None, None))
+            continue
+        for value in key.values():
+            name = value.name() or DEFAULT_VALUE
+            if fnmatch.fnmatchcase(name.lower(), patterns[-1].lower()):
+                found.append((key_path, name, value.value()))
+    return sorted(found, key=repr)
+
+
+@pytest.fixture(scope="module")
+def hive_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("query") / "SYSTEM")
+    write_hive(path, system_hive(services=40, interfaces=3, shares=2, filler_keys=200), hive_name="SYSTEM")
+    return path
+
+
+@pytest.fixture(scope="module", params=["registry", "mmap", "snapshot"])
+def source(request, hive_path):
+    if request.param == "snapshot":
+        yield build_snapshot(hive_path)
+        return
+    session = HiveSession(hive_path, backend=request.param)
+    yield session
+    session.close()
+
+
+def test_plan_steps():
+    plan = compile_query("ControlSet00*\\Services\\**\\**\\Run\\*")
+    assert [step.kind for step in plan.steps] == ["glob", "lookup", "any", "lookup"]
+    assert plan.value.kind == "glob"
+    assert compile_query("Select\\").value is None
+    with pytest.raises(ValueError):
+        compile_query("Select\\\\Current")
+    with pytest.raises(ValueError):
+        compile_query("Select\\**")
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_query_matches_brute_force(hive_path, source, query):
+    expected = _brute_force(hive_path, query)
+    assert expected
+    assert sorted(iter_query(source, query), key=repr) == expected
@@ -0,0 +1,24 @@
+import pytest
+
+from src.session import HiveSession
+from src.walk import walk_keys
+from synth_hive import LAYOUTS, write_hive
+
+
+def _walk(path, backend):
+    session = HiveSession(path, backend=backend)
+    try:
+        return [(key_path, key.name(), key.timestamp(),
+                 [(value.name(), value.value_type(), value.value()) for value in key.values()])
+                for key_path, key in walk_keys(session)]
+    finally:
+        session.close()
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_backends_walk_the_same(tmp_path, layout):
+    path = str(tmp_path / f"{layout}.hive")
+    write_hive(path, LAYOUTS[layout](1))
+    mmap_walk = _walk(path, "mmap")
+    assert len(mmap_walk) > 1
+    assert mmap_walk == _walk(path, "registry")
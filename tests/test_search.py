@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from src.search import AhoCorasick, IndicatorMatcher
+
+
+@pytest.mark.parametrize("patterns, text, expected", [
+    ## overlapping occurrences
+    (["abc", "bcd", "cde"], "xabcdex", {0, 1, 2}),
+    (["aa", "aaa"], "aaaa", {0, 1}),
+    ## shared prefixes: a miss deep in one branch falls back into another
+    (["he", "she", "his", "hers"], "ushers", {0, 1, 3}),
+    (["abcd", "bce", "c"], "abce", {1, 2}),
+    (["run", "runonce", "once"], "runonc", {0}),
+    ## a pattern inside another, found through the failure link's output
+    (["services", "vice"], "services", {0, 1}),
+    (["x", "y"], "", set()),
+    (["", "a"], "a", {1}),
+])
+def test_automaton_finds(patterns, text, expected):
+    assert AhoCorasick(patterns).search(text) == expected
+
+
+def test_automaton_agrees_with_naive_scan():
+    rng = random.Random(7)
+    for _ in range(300):
+        ## a small alphabet, so that prefixes are shared and matches overlap
+        patterns = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 5))) for _ in range(rng.randint(1, 8))]
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 60)))
+        expected = {index for index, pattern in enumerate(patterns) if pattern in text}
+        assert AhoCorasick(patterns).search(text) == expected, (patterns, text)
+
+
+def test_matcher_folds_case():
+    matcher = IndicatorMatcher(["Mimikatz", "PSEXESVC", "Mimikatz"])
+    assert matcher.keywords == ["Mimikatz", "PSEXESVC"]
+    assert matcher.match("C:\\Tools\\MIMIKATZ.exe -> psexesvc") == ["Mimikatz", "PSEXESVC"]
+    assert matcher.match("nothing here") == []
+
+
+def test_matcher_regexes_after_keywords():
+    matcher = IndicatorMatcher(["tor"], [r"\\temp\\[^\\]+\.exe$"])
+    assert matcher.match("C:\\Users\\x\\AppData\\Local\\Temp\\tor.EXE") == ["tor", r"\\temp\\[^\\]+\.exe$"]
+    assert not IndicatorMatcher()
+    assert not IndicatorMatcher([""], [""])
+
+
+def test_matcher_agrees_with_naive_scan():
+    rng = random.Random(11)
+    for _ in range(200):
+        keywords = ["".join(rng.choice("aAbB") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+        text = "".join(rng.choice("aAbBc") for _ in range(rng.randint(0, 40)))
+        matcher = IndicatorMatcher(keywords)
+        expected = [k for k in matcher.keywords if k.lower() in text.lower()]
+        assert matcher.match(text) == expected, (keywords, text)
@@ -0,0 +1,62 @@
+import datetime
+
+import pytest
+
+from src.session import HiveSession
+from src.users import decode_accounts, get_user_accounts
+from synth_hive import BASE_FILETIME, sam_hive, write_hive
+
+
+USERS = 5
+## what sam_hive writes, in its own terms: account i of (name, RID) logs on an
+## hour into day i of 2020, has i % 3 failed and 10 + i logons, and is
+## "normal" with a password that never expires (Guest is disabled too)
+ACCOUNTS = [("Administrator", 500), ("Guest", 501), ("DefaultAccount", 503), ("WDAGUtilityAccount", 504)]
+ACCOUNTS += [("user%03d" % i, 1001 + i) for i in range(USERS)]
+DAY = datetime.timedelta(days=1)
+NEW_YEAR = datetime.datetime(2020, 1, 1)
+
+
+def _created(rid):
+    return NEW_YEAR + datetime.timedelta(seconds=rid)
+
+
+@pytest.fixture(scope="module")
+def sam_path(tmp_path_factory):
+    root = sam_hive(users=USERS)
+    ## the creation time comes from the LastWrite of the account's Names key
+    for key in root.child("SAM\\Domains\\Account\\Users\\Names").subkeys:
+        key.timestamp = BASE_FILETIME + dict(ACCOUNTS)[key.name] * 10000000
+    path = str(tmp_path_factory.mktemp("sam") / "SAM")
+    write_hive(path, root, hive_name="SAM")
+    return path
+
+
+@pytest.mark.parametrize("backend", ["registry", "mmap"])
+def test_accounts_match_the_written_records(sam_path, backend):
+    session = HiveSession(sam_path, backend=backend)
+    try:
+        accounts = get_user_accounts(session)
+    finally:
+        session.close()
+    assert [(account["name"], account["rid"]) for account in accounts] == ACCOUNTS
+    for i, ((name, rid), account) in enumerate(zip(ACCOUNTS, accounts)):
+        assert account["full_name"] == "Synthetic " + name
+        assert account["comment"] == "Account %d" % rid
+        assert account["created"] == _created(rid)
+        assert account["last_logon"] == NEW_YEAR + i * DAY + datetime.timedelta(hours=1)
+        assert account["password_last_set"] == NEW_YEAR + i * DAY
+        assert account["last_failed_logon"] == NEW_YEAR + i * DAY + datetime.timedelta(minutes=30)
+        assert account["account_expires"] is None
+        assert account["logon_count"] == 10 + i
+        assert account["failed_logon_count"] == i % 3
+        expected = ["normal", "password_never_expires"]
+        assert account["flags"] == (["disabled"] + expected if rid == 501 else expected)
+
+
+def test_missing_records_decode_empty():
+    (account,) = decode_accounts([1000], [None], [b"\x00" * 4])
+    assert account["rid"] == 1000
+    assert account["name"] == ""
+    assert account["last_logon"] is None
+    assert account["flags"] == []